@@ -165,6 +165,8 @@ app.use(
     createProxyMiddleware({
         target: `http://${CHATBOT_SERVICE_HOST}:5000`,
         changeOrigin: true,
+        // Append the caller's address to X-Forwarded-For; the chatbot rate-limits per client IP
+        xfwd: true,
         pathRewrite: {
             '^/api/v1/chatbot': '/api/v1',
         },
@@ -8,6 +8,7 @@ import org.springframework.data.jpa.repository.Query;
 import org.springframework.data.repository.query.Param;
 import org.springframework.stereotype.Repository;
 
+import java.time.Instant;
 import java.util.List;
 
 @Repository
@@ -15,6 +16,15 @@ public interface ProductRepository extends JpaRepository<Product, Integer> {
         @Query("SELECT p FROM Product p WHERE p.category.id = ?1")
         List<Product> findAllByCategoryId(Integer categoryId);
 
+        @Query("SELECT p FROM Product p WHERE p.category.id = ?1")
+        List<Product> findAllByCategoryId(Integer categoryId, Pageable pageable);
+
+        // Lọc theo chất liệu (không phân biệt hoa thường) để client không phải tải cả danh mục;
+        // ?2 phải được escape '%', '_' và '\' (xem ProductService.escapeLike)
+        @Query("SELECT p FROM Product p WHERE p.category.id = ?1 " +
+                        "AND LOWER(p.material) LIKE LOWER(CONCAT('%', ?2, '%')) ESCAPE '\\'")
+        List<Product> findAllByCategoryIdAndMaterial(Integer categoryId, String material, Pageable pageable);
+
         @Query("SELECT p.brand from Product p where p.category.id = ?1 group by p.brand")
         List<String> getAllBrandByCategoryId(Integer categoryId);
 
@@ -33,6 +43,9 @@ public interface ProductRepository extends JpaRepository<Product, Integer> {
         @Query("SELECT p FROM Product p WHERE p.collection.id = ?1")
         List<Product> findAllByCollectionId(Integer collectionId);
 
+        @Query("SELECT p FROM Product p WHERE p.collection.id = ?1")
+        List<Product> findAllByCollectionId(Integer collectionId, Pageable pageable);
+
         @Query("SELECT p FROM Product p WHERE " +
                         "(p.collection.id = :collectionId OR " +
                         "(p.brand = :brand AND p.category.id = :categoryId) OR " +
@@ -54,5 +67,13 @@ public interface ProductRepository extends JpaRepository<Product, Integer> {
 
         List<Product> findByPriceBetween(Double minPrice, Double maxPrice);
 
+        List<Product> findByPriceBetween(Double minPrice, Double maxPrice, Pageable pageable);
+
         List<Product> findByPriceGreaterThanEqual(Double minPrice);
+
+        // Change feed: sản phẩm có (updatedAt, id) sau mốc, theo thứ tự cập nhật
+        @Query("SELECT p FROM Product p WHERE p.updatedAt > :since OR (p.updatedAt = :since AND p.id > :afterId) " +
+                        "ORDER BY p.updatedAt ASC, p.id ASC")
+        List<Product> findChangedSince(@Param("since") Instant since, @Param("afterId") Integer afterId,
+                        Pageable pageable);
 }
\ No newline at end of file
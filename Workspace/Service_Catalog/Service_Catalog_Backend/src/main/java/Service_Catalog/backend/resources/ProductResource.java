@@ -1,9 +1,13 @@
 package Service_Catalog.backend.resources;
 
+import java.math.BigDecimal;
+import java.time.Instant;
+import java.time.format.DateTimeParseException;
 import java.util.List;
 import java.util.stream.Collectors;
 
 import org.springframework.beans.factory.annotation.Autowired;
+import org.springframework.http.HttpStatus;
 import org.springframework.http.ResponseEntity;
 
 import org.springframework.web.bind.annotation.GetMapping;
@@ -11,6 +15,7 @@ import org.springframework.web.bind.annotation.PathVariable;
 import org.springframework.web.bind.annotation.RequestMapping;
 import org.springframework.web.bind.annotation.RequestParam;
 import org.springframework.web.bind.annotation.RestController;
+import org.springframework.web.server.ResponseStatusException;
 
 import Service_Catalog.backend.dto.ProductDto;
 import Service_Catalog.backend.dto.ProductImageDto;
@@ -21,9 +26,13 @@ import Service_Catalog.backend.services.CollectionService;
 import Service_Catalog.backend.services.ProductImageService;
 import Service_Catalog.backend.services.ProductService;
 
+import java.util.Arrays;
+import java.util.LinkedHashMap;
+import java.util.LinkedHashSet;
 import java.util.Map;
 import java.util.Optional;
 import java.util.Random;
+import java.util.Set;
 
 @RestController
 @RequestMapping("/api/products")
@@ -40,12 +49,44 @@ public class ProductResource {
     @Autowired
     private ProductImageService productImageService;
 
+    // limit, sort (vd: price,asc) và fields (vd: id,name,price) là tùy chọn,
+    // giúp client chỉ tải đúng số sản phẩm và thuộc tính cần dùng;
+    // page (bắt đầu từ 0, cùng với limit) để tải toàn bộ danh mục theo lô
     @GetMapping("")
-    public List<ProductDto> showProductList() {
-        List<Product> products = productService.getAllProducts();
-        return products.stream()
-                .map(this::convertToDto)
-                .collect(Collectors.toList());
+    public List<?> showProductList(@RequestParam(required = false) Integer limit,
+                                   @RequestParam(required = false) Integer page,
+                                   @RequestParam(required = false) String sort,
+                                   @RequestParam(required = false) String fields) {
+        List<Product> products = (limit == null && sort == null)
+                ? productService.getAllProducts()
+                : productService.getProducts(limit, sort, page);
+        return project(products, fields);
+    }
+
+    // Change feed cho client đồng bộ tăng dần: các sản phẩm có (updatedAt, id) sau mốc đã thấy,
+    // cũ nhất trước. Trang tiếp theo dùng updatedAt và id của phần tử cuối làm mốc.
+    @GetMapping("/changes")
+    public List<?> showProductChanges(@RequestParam String since,
+                                      @RequestParam(required = false) Integer afterId,
+                                      @RequestParam(defaultValue = "500") Integer limit,
+                                      @RequestParam(required = false) String fields) {
+        List<Product> products = productService.getChangedProducts(parseInstant(since), afterId, Math.min(limit, 5000));
+        return project(products, fields);
+    }
+
+    // "2024-01-01T00:00:00Z" hoặc epoch giây dạng số (cách Jackson ghi Instant mặc định)
+    private Instant parseInstant(String value) {
+        try {
+            BigDecimal seconds = new BigDecimal(value.trim());
+            return Instant.ofEpochSecond(seconds.longValue(),
+                    seconds.remainder(BigDecimal.ONE).movePointRight(9).longValue());
+        } catch (NumberFormatException e) {
+            try {
+                return Instant.parse(value.trim());
+            } catch (DateTimeParseException invalid) {
+                throw new ResponseStatusException(HttpStatus.BAD_REQUEST, "Invalid since: " + value);
+            }
+        }
     }
 
     @GetMapping("/{id}")
@@ -58,8 +99,15 @@ public class ProductResource {
     }
 
     @GetMapping("/category/{categoryId}")
-    public List<ProductDto> showProductListByCategory(@PathVariable Integer categoryId) {
-        return productService.getAllByCategoryIdDto(categoryId);
+    public List<?> showProductListByCategory(@PathVariable Integer categoryId,
+                                             @RequestParam(required = false) Integer limit,
+                                             @RequestParam(required = false) String sort,
+                                             @RequestParam(required = false) String fields,
+                                             @RequestParam(required = false) String material) {
+        if (limit == null && sort == null && fields == null && material == null) {
+            return productService.getAllByCategoryIdDto(categoryId);
+        }
+        return project(productService.getAllByCategoryId(categoryId, material, limit, sort), fields);
     }
 
     @GetMapping("/category/{categoryId}/brands")
@@ -88,27 +136,31 @@ public class ProductResource {
     }
 
     @GetMapping("/collection/{collectionId}")
-    public List<ProductDto> showProductListByCollection(@PathVariable Integer collectionId) {
-        List<Product> products = productService.getAllByCollectionId(collectionId);
-        return products.stream()
-                .map(this::convertToDto)
-                .collect(Collectors.toList());
+    public List<?> showProductListByCollection(@PathVariable Integer collectionId,
+                                               @RequestParam(required = false) Integer limit,
+                                               @RequestParam(required = false) String sort,
+                                               @RequestParam(required = false) String fields) {
+        List<Product> products = (limit == null && sort == null)
+                ? productService.getAllByCollectionId(collectionId)
+                : productService.getAllByCollectionId(collectionId, limit, sort);
+        return project(products, fields);
     }
 
     @GetMapping("/bestselling")
-    public List<ProductDto> showBestSellingProduct() {
+    public List<?> showBestSellingProduct(@RequestParam(required = false) Integer limit,
+                                          @RequestParam(required = false) String fields) {
         List<Product> products = productService.getTop10BestSellingProducts();
-        return products.stream()
-                .map(this::convertToDto)
-                .collect(Collectors.toList());
+        if (limit != null) {
+            products = products.stream().limit(Math.max(1, limit)).collect(Collectors.toList());
+        }
+        return project(products, fields);
     }
 
     @GetMapping("/new-arrivals")
-    public List<ProductDto> showNewArrivalsProduct(@RequestParam(defaultValue = "4") Integer limit) {
+    public List<?> showNewArrivalsProduct(@RequestParam(defaultValue = "4") Integer limit,
+                                          @RequestParam(required = false) String fields) {
         List<Product> products = productService.getNewArrivalsProducts(limit);
-        return products.stream()
-               .map(this::convertToDto)
-               .collect(Collectors.toList()); 
+        return project(products, fields);
     }
 
     @GetMapping("/{id}/related")
@@ -129,11 +181,14 @@ public class ProductResource {
     }
 
     @GetMapping("/price/between/{minPrice}/{maxPrice}")
-    public List<ProductDto> showProductsBetweenPrices(@PathVariable Double minPrice, @PathVariable Double maxPrice) {
-        List<Product> products = productService.getProductsBetweenPrices(minPrice, maxPrice);
-        return products.stream()
-                .map(this::convertToDto)
-                .collect(Collectors.toList());
+    public List<?> showProductsBetweenPrices(@PathVariable Double minPrice, @PathVariable Double maxPrice,
+                                             @RequestParam(required = false) Integer limit,
+                                             @RequestParam(required = false) String sort,
+                                             @RequestParam(required = false) String fields) {
+        List<Product> products = (limit == null && sort == null)
+                ? productService.getProductsBetweenPrices(minPrice, maxPrice)
+                : productService.getProductsBetweenPrices(minPrice, maxPrice, limit, sort);
+        return project(products, fields);
     }
 
     @GetMapping("/price/above/{minPrice}")
@@ -180,7 +235,58 @@ public class ProductResource {
 
     // Các phương thức CRUD khác
 
+    // Trả về DTO đầy đủ, hoặc chỉ các thuộc tính trong fields (không tải ảnh nếu không được yêu cầu)
+    private List<?> project(List<Product> products, String fields) {
+        if (fields == null || fields.isBlank()) {
+            return products.stream()
+                    .map(this::convertToDto)
+                    .collect(Collectors.toList());
+        }
+        Set<String> wanted = Arrays.stream(fields.split(","))
+                .map(String::trim)
+                .filter(field -> !field.isEmpty())
+                .collect(Collectors.toCollection(LinkedHashSet::new));
+        return products.stream()
+                .map(product -> convertToFieldMap(product, wanted))
+                .collect(Collectors.toList());
+    }
+
     // Conversion methods
+    private Map<String, Object> convertToFieldMap(Product product, Set<String> fields) {
+        Map<String, Object> map = new LinkedHashMap<>();
+        for (String field : fields) {
+            switch (field) {
+                case "id" -> map.put(field, product.getId());
+                case "name" -> map.put(field, product.getName());
+                case "code" -> map.put(field, product.getCode());
+                case "description" -> map.put(field, product.getDescription());
+                case "quantity" -> map.put(field, product.getQuantity());
+                case "price" -> map.put(field, product.getPrice());
+                case "status" -> map.put(field, product.getStatus());
+                case "gender" -> map.put(field, product.getGender());
+                case "material" -> map.put(field, product.getMaterial());
+                case "goldKarat" -> map.put(field, product.getGoldKarat());
+                case "color" -> map.put(field, product.getColor());
+                case "brand" -> map.put(field, product.getBrand());
+                case "size" -> map.put(field, product.getSize());
+                case "createdAt" -> map.put(field, product.getCreatedAt());
+                case "updatedAt" -> map.put(field, product.getUpdatedAt());
+                case "categoryId" -> map.put(field, product.getCategory() != null ? product.getCategory().getId() : null);
+                case "categoryName" -> map.put(field, product.getCategory() != null ? product.getCategory().getName() : null);
+                case "collectionId" -> map.put(field, product.getCollection() != null ? product.getCollection().getId() : null);
+                case "collectionName" -> map.put(field, product.getCollection() != null ? product.getCollection().getName() : null);
+                case "productImages" -> map.put(field, product.getProductImages() == null ? null
+                        : product.getProductImages().stream()
+                                .map(this::convertToImageDto)
+                                .collect(Collectors.toList()));
+                default -> {
+                    // Bỏ qua thuộc tính không hỗ trợ
+                }
+            }
+        }
+        return map;
+    }
+
     private ProductDto convertToDto(Product product) {
         if (product == null)
             return null;
@@ -11,6 +11,8 @@ import Service_Catalog.backend.repositories.ProductSalesSummaryRepository;
 import org.hibernate.Hibernate;
 import org.springframework.beans.factory.annotation.Autowired;
 import org.springframework.data.domain.PageRequest;
+import org.springframework.data.domain.Pageable;
+import org.springframework.data.domain.Sort;
 import org.springframework.data.redis.core.RedisTemplate;
 import org.springframework.stereotype.Service;
 import org.springframework.transaction.annotation.Transactional;
@@ -19,6 +21,7 @@ import java.time.Instant;
 import java.time.temporal.ChronoUnit;
 import java.util.ArrayList;
 import java.util.List;
+import java.util.Set;
 import java.util.concurrent.TimeUnit;
 
 @Service
@@ -35,6 +38,9 @@ public class ProductService {
     private static final String CACHE_KEY_PRODUCT = "product";
     private static final long CACHE_TTL = 3600;
 
+    // Các thuộc tính được phép sắp xếp qua tham số ?sort=price,asc
+    private static final Set<String> SORTABLE_FIELDS = Set.of("id", "name", "price", "quantity", "createdAt", "updatedAt");
+
     public Product addProduct(Product product) {
         product.setCreatedAt(Instant.now());
         product.setUpdatedAt(Instant.now());
@@ -91,6 +97,27 @@ public class ProductService {
         return productRepository.findAll();
     }
 
+    public List<Product> getProducts(Integer limit, String sort) {
+        if (limit == null) {
+            return productRepository.findAll(parseSort(sort));
+        }
+        return productRepository.findAll(pageOf(limit, sort)).getContent();
+    }
+
+    // Phân trang cho client tải toàn bộ danh mục theo lô; mặc định sắp theo id để các trang ổn định
+    public List<Product> getProducts(Integer limit, String sort, Integer page) {
+        if (limit == null || page == null) {
+            return getProducts(limit, sort);
+        }
+        Sort order = (sort == null || sort.isBlank()) ? Sort.by("id").ascending() : parseSort(sort);
+        return productRepository.findAll(PageRequest.of(Math.max(0, page), Math.max(1, limit), order)).getContent();
+    }
+
+    public List<Product> getChangedProducts(Instant since, Integer afterId, Integer limit) {
+        return productRepository.findChangedSince(since, afterId == null ? 0 : afterId,
+                PageRequest.of(0, Math.max(1, limit)));
+    }
+
     public List<Product> getAllByIds(List<Integer> ids) {
         return productRepository.findAllById(ids);
     }
@@ -99,6 +126,23 @@ public class ProductService {
         return productRepository.findAllByCategoryId(categoryId);
     }
 
+    public List<Product> getAllByCategoryId(Integer categoryId, Integer limit, String sort) {
+        return productRepository.findAllByCategoryId(categoryId, pageOf(limit, sort));
+    }
+
+    public List<Product> getAllByCategoryId(Integer categoryId, String material, Integer limit, String sort) {
+        if (material == null || material.isBlank()) {
+            return getAllByCategoryId(categoryId, limit, sort);
+        }
+        return productRepository.findAllByCategoryIdAndMaterial(categoryId, escapeLike(material.trim()),
+                pageOf(limit, sort));
+    }
+
+    // '%' và '_' trong chất liệu khách nhập là ký tự thường, không phải ký tự đại diện của LIKE
+    private static String escapeLike(String value) {
+        return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_");
+    }
+
     @Transactional(readOnly = true)
     public List<ProductDto> getAllByCategoryIdDto(Integer categoryId) {
         String cacheKey = CACHE_KEY_PRODUCT + "_category_" + categoryId;
@@ -159,6 +203,10 @@ public class ProductService {
         return productRepository.findAllByCollectionId(collectionId);
     }
 
+    public List<Product> getAllByCollectionId(Integer collectionId, Integer limit, String sort) {
+        return productRepository.findAllByCollectionId(collectionId, pageOf(limit, sort));
+    }
+
     public List<Product> getTop10BestSellingProducts() {
         Instant threeMonthsAgo = Instant.now().minus(3, ChronoUnit.MONTHS);
         return productSalesSummaryRepository.findTop10BestSellingProducts(threeMonthsAgo);
@@ -193,6 +241,32 @@ public class ProductService {
         return productRepository.findByPriceBetween(minPrice, maxPrice);
     }
 
+    public List<Product> getProductsBetweenPrices(Double minPrice, Double maxPrice, Integer limit, String sort) {
+        return productRepository.findByPriceBetween(minPrice, maxPrice, pageOf(limit, sort));
+    }
+
+    // limit == null -> không phân trang, chỉ sắp xếp
+    private Pageable pageOf(Integer limit, String sort) {
+        if (limit == null) {
+            return Pageable.unpaged(parseSort(sort));
+        }
+        return PageRequest.of(0, Math.max(1, limit), parseSort(sort));
+    }
+
+    // "price,asc" / "createdAt,desc" -> Sort, bỏ qua thuộc tính không hợp lệ
+    private Sort parseSort(String sort) {
+        if (sort == null || sort.isBlank()) {
+            return Sort.unsorted();
+        }
+        String[] parts = sort.split(",");
+        String property = parts[0].trim();
+        if (!SORTABLE_FIELDS.contains(property)) {
+            return Sort.unsorted();
+        }
+        boolean descending = parts.length > 1 && parts[1].trim().equalsIgnoreCase("desc");
+        return descending ? Sort.by(property).descending() : Sort.by(property).ascending();
+    }
+
     public List<Product> getProductsAbovePrice(Double minPrice) {
         return productRepository.findByPriceGreaterThanEqual(minPrice);
     }
@@ -1,12 +1,47 @@
 import os
-import requests
+import hmac
+import math
+import json
+import time
+import asyncio
 import logging
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+import httpx
+import ijson
+from catalog_client import CatalogClient, CircuitOpenError
+from cache import TTLCache, make_key, ttl_for
+from shared_cache import create_shared_cache
+from product_index import ProductIndex, ProductIndexSync, fold_text, INDEX_REFRESH_SECONDS
+from response_cache import ResponseCache, track_turn, note_catalog_use
+from sessions import SessionStore
+from singleflight import SingleFlight
+from prompts import Grounding, NarrativeContextCache, NARRATIVE_RULES
+from admission import (
+    AdmissionGate, RateLimiter, QuotaBackoff, Overloaded, is_quota_error, RATE_LIMITED_TEXT, BUSY_TEXT,
+    RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST, RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST,
+    TRUSTED_PROXY_COUNT, is_trusted_proxy,
+)
+from tool_registry import Tool, ToolRegistry, current_tool
+from routing import classify_intent, is_open_ended, MODEL_ROUTER, MODEL_LARGE, MODEL_NARRATIVE
+from telemetry import (
+    span, start_trace, finish_trace, annotate, record_usage, observe_catalog, observe_route, observe_shed,
+    register_cache_stats,
+    render_metrics, mark_worker_exited, JsonFormatter,
+)
+from templates import (
+    resolve_render_mode, render_sections, format_price, product_card, product_detail_card, category_card, collection_card,
+)
+from quart import Quart, request, jsonify
+from quart_cors import cors
 from google.generativeai import configure, GenerativeModel, types
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configure logging; LOG_FORMAT=json emits one JSON object per line
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+if os.environ.get("LOG_FORMAT") == "json":
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(JsonFormatter())
+# httpx logs every catalog request at INFO; the sampled traces cover that
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Configure Google Gemini API
@@ -30,450 +65,986 @@ Luôn trả lời lịch sự, chuyên nghiệp và đúng ngữ cảnh về tra
 Tuyệt đối: Không được trả lời các câu hỏi không liên quan đến trang sức hoặc cửa hàng.
 """
 
-# Define function declarations for Gemini function calling
-get_products_declaration = {
-    "name": "get_products",
-    "description": "Lấy danh sách sản phẩm trang sức của cửa hàng Tinh Tú",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "limit": {
-                "type": "integer",
-                "description": "Số lượng sản phẩm muốn hiển thị (mặc định: 5)",
-            }
-        },
-        "required": []
-    }
-}
-
-get_product_details_declaration = {
-    "name": "get_product_details",
-    "description": "Lấy thông tin chi tiết về một sản phẩm trang sức cụ thể",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "product_id": {
-                "type": "integer",
-                "description": "ID của sản phẩm cần xem chi tiết",
-            }
-        },
-        "required": ["product_id"]
-    }
-}
-
-get_categories_declaration = {
-    "name": "get_categories",
-    "description": "Lấy danh sách các danh mục trang sức của cửa hàng",
-    "parameters": {
-        "type": "object",
-        "properties": {}
-    }
-}
-
-get_products_by_category_declaration = {
-    "name": "get_products_by_category",
-    "description": "Lấy danh sách sản phẩm theo danh mục",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "category_id": {
-                "type": "integer",
-                "description": "ID của danh mục cần lấy sản phẩm",
-            }
-        },
-        "required": ["category_id"]
-    }
-}
-
-get_collections_declaration = {
-    "name": "get_collections",
-    "description": "Lấy danh sách các bộ sưu tập trang sức của cửa hàng",
-    "parameters": {
-        "type": "object",
-        "properties": {}
-    }
-}
-
-get_products_by_collection_declaration = {
-    "name": "get_products_by_collection",
-    "description": "Lấy danh sách sản phẩm theo bộ sưu tập",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "collection_id": {
-                "type": "integer",
-                "description": "ID của bộ sưu tập cần lấy sản phẩm",
-            }
-        },
-        "required": ["collection_id"]
-    }
-}
-
-get_bestselling_products_declaration = {
-    "name": "get_bestselling_products",
-    "description": "Lấy danh sách sản phẩm bán chạy nhất",
-    "parameters": {
-        "type": "object",
-        "properties": {}
-    }
-}
-
-get_new_arrivals_declaration = {
-    "name": "get_new_arrivals",
-    "description": "Lấy danh sách sản phẩm mới nhất",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "limit": {
-                "type": "integer",
-                "description": "Số lượng sản phẩm muốn hiển thị (mặc định: 4)",
-            }
-        },
-        "required": []
-    }
-}
-
-find_products_by_price_range_declaration = {
-    "name": "find_products_by_price_range",
-    "description": "Tìm sản phẩm trong khoảng giá",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "min_price": {
-                "type": "number",
-                "description": "Giá thấp nhất (VND)",
-            },
-            "max_price": {
-                "type": "number",
-                "description": "Giá cao nhất (VND)",
-            }
-        },
-        "required": ["min_price", "max_price"]
-    }
-}
-
-find_products_by_material_declaration = {
-    "name": "find_products_by_material",
-    "description": "Tìm sản phẩm theo chất liệu như vàng, bạc, kim cương, v.v.",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "category_id": {
-                "type": "integer",
-                "description": "ID của danh mục sản phẩm",
-            },
-            "material": {
-                "type": "string",
-                "description": "Chất liệu của sản phẩm (vàng, bạc, kim cương...)",
-            }
-        },
-        "required": ["category_id", "material"]
-    }
-}
-
-redirect_to_product_declaration = {
-    "name": "redirect_to_product",
-    "description": "Chuyển hướng người dùng đến trang sản phẩm cụ thể",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "product_id": {
-                "type": "integer",
-                "description": "ID của sản phẩm cần chuyển hướng đến",
-            }
-        },
-        "required": ["product_id"]
-    }
-}
-
-# Combine all function declarations
-tools = [
-    types.Tool(function_declarations=[
-        get_products_declaration,
-        get_product_details_declaration,
-        get_categories_declaration,
-        get_products_by_category_declaration,
-        get_collections_declaration,
-        get_products_by_collection_declaration,
-        get_bestselling_products_declaration,
-        get_new_arrivals_declaration,
-        find_products_by_price_range_declaration,
-        find_products_by_material_declaration,
-        redirect_to_product_declaration,
-    ])
-]
-
-# Initialize Gemini model
-model = GenerativeModel(
-    model_name="gemini-2.5-pro",
-    tools=tools,
-    system_instruction=system_instruction,
-)
+# Cheaper model, without tools, that folds old conversation turns into a summary
+SESSION_SUMMARY_MODEL = os.environ.get("SESSION_SUMMARY_MODEL", "gemini-2.5-flash")
+summary_model = GenerativeModel(model_name=SESSION_SUMMARY_MODEL)
 
-app = Flask(__name__)
-CORS(app, origins=["*"])
+# Product attributes the chatbot actually uses; the catalog projects list responses to these
+PRODUCT_LIST_FIELDS = "id,name,description,price,material,color,goldKarat,categoryId"
 
-# Helper function to call the API Gateway
-def call_api(endpoint, method="GET", params=None, data=None):
-    url = f"{API_GATEWAY}/catalog{endpoint}"
-    logger.info(f"Calling API: {method} {url}")
+# Number of products shown per list answer
+PRODUCT_LIST_LIMIT = int(os.environ.get("PRODUCT_LIST_LIMIT", "5"))
+
+# Max chats processed concurrently by this worker; extra requests wait in a bounded queue
+MAX_CONCURRENT_CHATS = int(os.environ.get("MAX_CONCURRENT_CHATS", "200"))
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+
+# Shared, pooled client for the catalog behind the API Gateway
+catalog_client = CatalogClient(f"{API_GATEWAY}/catalog")
+
+# Admission control: per-session and per-IP rate limits, then the concurrency cap
+chat_gate = AdmissionGate(MAX_CONCURRENT_CHATS)
+session_limiter = RateLimiter(RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST)
+ip_limiter = RateLimiter(RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST)
+# Shared pause for Gemini calls after quota errors
+model_quota = QuotaBackoff()
+
+@app.before_serving
+async def startup():
+    global narrative_model
+    await catalog_client.start()
+    if shared_cache is not None:
+        await shared_cache.start()
+    index_sync.start()
+    cache_stats_publisher.start()
+    narrative_model = await narrative_context.start() or narrative_model
+
+@app.after_serving
+async def shutdown():
+    await cache_stats_publisher.stop()
+    await index_sync.stop()
+    await narrative_context.stop()
+    await catalog_client.close()
+    await session_store.close()
+    await response_cache.close()
+    if shared_cache is not None:
+        await shared_cache.stop()
+    mark_worker_exited()
+
+# Cache tier shared by the workers (SHARED_CACHE_BACKEND), behind the in-process caches below
+shared_cache = create_shared_cache()
+
+# In-process cache for catalog GET results
+catalog_cache = TTLCache(shared=shared_cache)
+
+# Whole answers for repeated shopper questions, expiring with the catalog data they used
+response_cache = ResponseCache(shared=shared_cache)
+
+# Identical catalog reads and narrative generations in flight run once for all their callers
+catalog_flight = SingleFlight("catalog")
+narrative_flight = SingleFlight("narrative")
+
+# Token the catalog service sends when invalidating cached results. The hook is reachable
+# through the public gateway, so it stays disabled until a token is configured.
+CACHE_INVALIDATION_TOKEN = os.environ.get("CACHE_INVALIDATION_TOKEN", "")
+
+async def fetch_api(endpoint, method="GET", params=None, data=None, max_items=None):
+    logger.debug(f"Calling API: {method} {endpoint}")
     
+    # Inside a tool, the catalog call and its retries must fit in the tool's timeout
+    tool = current_tool.get()
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        if method == "GET":
-            response = requests.get(url, params=params)
-        else:
-            response = requests.post(url, json=data)
-        
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        with span("catalog", endpoint=endpoint):
+            result = await catalog_client.request(endpoint, method=method, params=params, data=data,
+                                                  max_items=max_items, budget=tool.timeout if tool else None)
+        outcome = "ok"
+        return result
+    except CircuitOpenError as e:
+        outcome = "circuit_open"
+        logger.warning(str(e))
+        return None
+    except (httpx.HTTPError, ijson.JSONError, ValueError) as e:
         logger.error(f"API call failed: {e}")
         return None
+    finally:
+        observe_catalog(endpoint, time.perf_counter() - started, outcome)
+
+# Helper function to call the API Gateway.
+# max_items caps list responses client-side, in case the catalog ignores ?limit.
+async def call_api(endpoint, method="GET", params=None, data=None, max_items=None):
+    if method != "GET":
+        return await fetch_api(endpoint, method=method, params=params, data=data)
+    
+    # The running tool's cache policy may override the endpoint TTL or skip the cache
+    tool = current_tool.get()
+    ttl = tool.cache_ttl if tool is not None and tool.cache_ttl is not None else ttl_for(endpoint)
+    key = make_key(endpoint, params)
+    # A burst of identical misses (or a background refresh racing one) shares one catalog request
+    def load():
+        return catalog_flight.do((key, max_items), lambda: fetch_api(endpoint, params=params, max_items=max_items))
+
+    if ttl == 0:
+        result, fresh_for = await load(), 0
+    else:
+        result, fresh_for = await catalog_cache.get_or_load(key, load, ttl)
+    # Cached answers built from this endpoint expire with the data they quote, not a full TTL later
+    note_catalog_use(endpoint=endpoint, ttl=fresh_for, failed=result is None)
+    return result
+
+@app.route("/api/v1/cache/invalidate", methods=["POST"])
+async def invalidate_cache():
+    token = request.headers.get("X-Cache-Token", "")
+    if not CACHE_INVALIDATION_TOKEN or not hmac.compare_digest(token, CACHE_INVALIDATION_TOKEN):
+        return jsonify({"error": "Forbidden"}), 403
+    
+    data = await request.get_json(silent=True) or {}
+    # e.g. {"prefix": "/products/12"} after a product update, or {} to drop everything
+    prefix = data.get("prefix")
+    removed = catalog_cache.invalidate(prefix)
+    removed_responses = response_cache.invalidate(endpoint_prefix=prefix) if prefix else response_cache.invalidate()
+    body = {"removed": removed, "removed_responses": removed_responses}
+    if shared_cache is not None:
+        # The other workers pick this up from the shared tier's invalidation log
+        body["removed_shared"] = await shared_cache.invalidate(endpoint_prefix=prefix)
+    # The index does not go through the TTL cache; have it pick up the change too
+    index_sync.refresh_soon()
+    return jsonify(body), 200
+
+# Hit/miss counts for /metrics, published by every worker
+def cache_counts(stats, *hit_keys):
+    return sum(stats[key] for key in hit_keys), stats["misses"], stats["size"]
+
+def flight_counts(flight):
+    stats = flight.stats()
+    return stats["joined"], stats["leaders"], stats["in_flight"]
+
+cache_stats_publisher = register_cache_stats({
+    "catalog": lambda: cache_counts(catalog_cache.stats(), "hits", "stale_hits", "shared_hits"),
+    "responses": lambda: cache_counts(response_cache.stats(), "hits", "shared_hits", "semantic_hits"),
+    # A caller joining an in-flight call counts as a hit
+    "catalog_flight": lambda: flight_counts(catalog_flight),
+    "narrative_flight": lambda: flight_counts(narrative_flight),
+})
+
+# Operational endpoints stay outside /api/v1, which the gateway exposes to shoppers
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    body, content_type = render_metrics()
+    return body, 200, {"Content-Type": content_type}
+
+@app.route("/stats/cache", methods=["GET"])
+async def cache_stats():
+    return jsonify({
+        "catalog": catalog_cache.stats(),
+        "responses": response_cache.stats(),
+        "shared": shared_cache.stats() if shared_cache is not None else None,
+        "in_flight": {"catalog": catalog_flight.stats(), "narrative": narrative_flight.stats()},
+    }), 200
+
+# Local product index answering price/material/collection and ranked-list queries without a
+# gateway hop. It is restored from the on-disk snapshot at startup, then kept current from the
+# catalog change feed; snapshot fetches bypass the TTL cache.
+product_index = ProductIndex()
+_index_invalidations = set()
+
+def index_changed():
+    """Any product change may alter prices in answers built from the index, here or in the shared tier."""
+    response_cache.invalidate(tag="index")
+    if shared_cache is not None:
+        task = asyncio.create_task(shared_cache.invalidate(namespace="responses", tag="index"))
+        _index_invalidations.add(task)
+        task.add_done_callback(_index_invalidations.discard)
+
+index_sync = ProductIndexSync(product_index, fetch_api, on_change=index_changed)
+if shared_cache is not None:
+    # Invalidations made on another worker refresh this worker's index as well
+    shared_cache.watch("catalog", lambda endpoint_prefix, tag: index_sync.refresh_soon())
+
+def index_ready():
+    if not product_index.ready:
+        return False
+    note_catalog_use(tag="index", ttl=INDEX_REFRESH_SECONDS)
+    return True
+
+async def indexed_entry(entries, entry_id, endpoint):
+    """A category or collection by id from the index; the catalog answers if the index list did not load."""
+    if not entries:
+        return await call_api(endpoint)
+    return next((entry for entry in entries if entry.get("id") == entry_id), None)
+
+def ranked_from_index(name, limit):
+    """A ranked list (bestselling, new_arrivals) from the index, or None if it was not loaded."""
+    if name not in product_index.lists or not index_ready():
+        return None
+    return product_index.ranked(name, limit)
+
+@app.route("/stats/index", methods=["GET"])
+async def index_stats():
+    return jsonify(index_sync.stats()), 200
+
+@app.route("/healthz", methods=["GET"])
+async def healthz():
+    return jsonify({"status": "ok"}), 200
+
+# Ready once the products are indexed, so a load balancer only routes chats to workers
+# that can answer catalog questions locally
+@app.route("/readyz", methods=["GET"])
+async def readyz():
+    body = {"ready": index_sync.warm, "index_source": index_sync.source}
+    return jsonify(body), 200 if index_sync.warm else 503
+
+async def summarize_history(summary, turns):
+    dialogue = "\n".join(f"Khách: {turn['user']}\nTrợ lý: {turn['assistant']}" for turn in turns)
+    prompt_for_summary = f"""
+    Tóm tắt ngắn gọn (tối đa 3 câu) cuộc trò chuyện giữa khách hàng và trợ lý của Tinh Tú Jewelry.
+    Giữ lại nhu cầu, ngân sách, sở thích của khách và ID các sản phẩm đã được nhắc đến.
+    
+    Tóm tắt trước đó: {summary or "(chưa có)"}
+    
+    Các lượt mới:
+    {dialogue}
+    """
+    with span("summary"):
+        response = await generate_content(summary_model, prompt_for_summary)
+    record_usage("summary", response)
+    return response.text
+
+# Conversation history per session id, bounded by token budgets
+session_store = SessionStore(summarize=summarize_history)
+
+def session_id_of(data):
+    return data.get("session_id") or request.headers.get("X-Session-Id")
+
+# Only the caller's own session: an id in the path would let anyone clear anyone's history
+@app.route("/api/v1/session", methods=["DELETE"])
+async def reset_session():
+    session_id = request.headers.get("X-Session-Id")
+    if not session_id:
+        return jsonify({"error": "Missing 'X-Session-Id'"}), 400
+    await session_store.reset(session_id)
+    return jsonify({"session_id": session_id}), 200
+
+class Reply:
+    """Outcome of the tool step: a final text, or a grounding prompt for the narrative pass."""
+
+    def __init__(self, text=None, prompt=None, tool=None, sections=None, **extra):
+        self.text = text
+        self.prompt = prompt
+        self.tool = tool
+        # Structured result as [(heading, cards)], used by the template/hybrid render modes
+        self.sections = sections or []
+        self.cards = None
+        # Side-channel fields for the storefront, e.g. product_id or redirect
+        self.extra = extra
+
+    @property
+    def tools(self):
+        return self.tool.split(",") if self.tool else []
+
+    def result_cards(self):
+        return [card for _, cards in self.sections for card in cards]
+
+    def to_json(self):
+        payload = {"response": self.text, **self.extra}
+        if self.cards:
+            payload["cards"] = self.cards
+        return payload
+
+# Decide how the reply's prose gets written; template mode skips the second model call
+def apply_render_mode(reply, requested=None):
+    mode = resolve_render_mode(reply.tools, requested)
+    if mode == "template" and reply.prompt and reply.sections:
+        reply.text = render_sections(reply.sections)
+        reply.prompt = None
+    if mode in ("template", "hybrid") and reply.sections:
+        reply.cards = reply.result_cards()
+    return mode
+
+def wants_stream(data):
+    return bool(data.get("stream")) or "text/event-stream" in request.headers.get("Accept", "")
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def client_ip():
+    remote = request.remote_addr or "unknown"
+    # Only a trusted proxy's X-Forwarded-For counts; anyone else could send a fresh one per request
+    if not is_trusted_proxy(remote):
+        return remote
+    # Each trusted proxy appended one entry, so the shopper is TRUSTED_PROXY_COUNT from the right
+    forwarded = [entry.strip() for entry in request.headers.get("X-Forwarded-For", "").split(",") if entry.strip()]
+    if TRUSTED_PROXY_COUNT and len(forwarded) >= TRUSTED_PROXY_COUNT:
+        return forwarded[-TRUSTED_PROXY_COUNT]
+    return remote
+
+def check_rate_limit(session_id):
+    wait = ip_limiter.check(client_ip())
+    if session_id:
+        wait = max(wait, session_limiter.check(session_id))
+    if wait:
+        raise Overloaded("rate_limited", retry_after=wait)
+
+# Redirects need one catalog lookup and no model call, so they skip ahead of queued chats
+def lane_for(prompt):
+    intent = classify_intent(prompt)
+    return "high" if intent is not None and intent.rule == "redirect_to_product" else "normal"
+
+# Fast templated answer for requests we refuse to queue; the storefront shows it like any reply
+def degraded_text(error):
+    observe_shed(error.reason)
+    annotate(shed=error.reason)
+    return RATE_LIMITED_TEXT if error.reason == "rate_limited" else BUSY_TEXT
+
+def degraded_events(error):
+    return (
+        sse_event("status", {"stage": "degraded", "reason": error.reason})
+        + sse_event("delta", {"text": degraded_text(error)})
+        + sse_event("done", {})
+    )
+
+def degraded_reply(error, stream=False):
+    status = 429 if error.reason == "rate_limited" else 503
+    headers = {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    if stream:
+        return degraded_events(error), status, {**headers, "Content-Type": "text/event-stream; charset=utf-8"}
+    return jsonify({"response": degraded_text(error), "degraded": error.reason}), status, headers
+
+# While Gemini quota is exhausted, answers that have structured results are rendered from templates
+def effective_render(render):
+    if model_quota.retry_after():
+        observe_shed("template_fallback")
+        return "template"
+    return render
+
+@app.route("/stats/admission", methods=["GET"])
+async def admission_stats():
+    return jsonify({
+        "gate": chat_gate.stats(),
+        "rate_limits": {"session": session_limiter.stats(), "ip": ip_limiter.stats()},
+        "model_quota": model_quota.stats(),
+    }), 200
 
 @app.route("/api/v1/response", methods=["POST"])
-def respond():
+async def respond():
+    trace = start_trace("json")
     try:
-        data = request.get_json(force=True)
+        data = await request.get_json(force=True)
         prompt = data.get("prompt", "").strip()
         
-        logger.info(f"Received prompt: {prompt}")
-        
         if not prompt:
+            finish_trace(trace, "bad_request")
             return jsonify({"error": "Missing 'prompt'"}), 400
-            
-        # Generate response from Gemini
-        ai_response = model.generate_content(contents=prompt)
-        logger.info(f"Received response from Gemini: {ai_response}")
         
-        # Check if we have a function call
-        if ai_response.candidates and ai_response.candidates[0].content.parts and \
-           hasattr(ai_response.candidates[0].content.parts[0], 'function_call'):
-            
-            function_call = ai_response.candidates[0].content.parts[0].function_call
-            function_name = function_call.name
-            function_args = function_call.args
-            
-            logger.info(f"Function called: {function_name} with args: {function_args}")
-            
-            # Handle different function calls
-            if function_name == "get_products":
-                limit = int(function_args.get("limit", 5))
-                products = call_api("/products")
-                if products:
-                    # Limit the number of products returned
-                    limited_products = products[:limit]
-                    
-                    # Use Gemini to generate a nice response about these products
-                    product_info = "\n".join([
-                        f"- {p.get('name', 'Không tên')} (ID: {p.get('id', 'N/A')}): "
-                        f"{p.get('description', 'Không có mô tả')}. "
-                        f"Giá: {p.get('price', 'N/A')} VND" 
-                        for p in limited_products
-                    ])
-                    
-                    prompt_for_response = f"""
-                    Dưới đây là {len(limited_products)} sản phẩm từ cửa hàng Tinh Tú Jewelry:
-                    {product_info}
-                    
-                    Hãy giới thiệu những sản phẩm này cho khách hàng một cách chuyên nghiệp, 
-                    nhấn mạnh vào tính độc đáo và chất lượng. Giữ ngôn ngữ tự nhiên và thân thiện,
-                    không liệt kê dưới dạng danh sách mà viết thành đoạn văn liền mạch.
-                    
-                    Vì lí do kỹ thuật, hãy tạm thời trình bày sản phẩm với khách hàng bằng id chứ không phải code. Cảm ơn."
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text}), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không thể lấy thông tin sản phẩm lúc này. Vui lòng thử lại sau."}), 200
-            
-            elif function_name == "get_product_details":
-                product_id = function_args.get("product_id")
-                product = call_api(f"/products/{product_id}")
-                
-                if product:
-                    # Format product details
-                    product_details = f"""
-                    Tên sản phẩm: {product.get('name', 'Không có tên')}
-                    Mã sản phẩm: {product.get('id', 'Không có mã')}
-                    Giá: {product.get('price', 'Không có giá')} VND
-                    Mô tả: {product.get('description', 'Không có mô tả')}
-                    Chất liệu: {product.get('material', 'Không có thông tin')}
-                    Màu sắc: {product.get('color', 'Không có thông tin')}
-                    Kích thước: {product.get('size', 'Không có thông tin')}
-                    """
-                    
-                    prompt_for_response = f"""
-                    Đây là thông tin chi tiết về sản phẩm mà khách hàng quan tâm:
-                    {product_details}
-                    
-                    Hãy mô tả sản phẩm này một cách hấp dẫn và chuyên nghiệp, đề cập đến các đặc điểm nổi bật 
-                    và hướng dẫn khách hàng cách để xem thêm chi tiết hoặc mua sản phẩm.
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text, "product_id": product_id}), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không tìm thấy thông tin về sản phẩm này."}), 200
-                    
-            elif function_name == "get_categories":
-                categories = call_api("/categories")
-                if categories:
-                    category_info = "\n".join([
-                        f"- {cat.get('name', 'Không có tên')} (ID: {cat.get('id', 'N/A')}): {cat.get('description', 'Không có mô tả')}"
-                        for cat in categories
-                    ])
-                    
-                    prompt_for_response = f"""
-                    Dưới đây là các danh mục sản phẩm của Tinh Tú Jewelry:
-                    {category_info}
-                    
-                    Hãy giới thiệu các danh mục này cho khách hàng một cách hấp dẫn, mời họ khám phá các bộ sưu tập.
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text}), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không thể lấy thông tin danh mục lúc này."}), 200
-                    
-            elif function_name == "get_products_by_category":
-                category_id = int(function_args.get("category_id"))
-                products = call_api(f"/products/category/{category_id}")
-                category = call_api(f"/categories/{category_id}")
-                
-                if products and category:
-                    # Format product information
-                    product_info = "\n".join([
-                        f"- {p.get('name', 'Không tên')} (ID: {p.get('id', 'N/A')}): "
-                        f"{p.get('description', 'Không có mô tả')[:100]}... "
-                        f"Giá: {p.get('price', 'N/A')} VND" 
-                        for p in products[:5]  # Limit to 5 products
-                    ])
-                    
-                    prompt_for_response = f"""
-                    Dưới đây là sản phẩm từ danh mục "{category.get('name', 'Không có tên')}" của Tinh Tú Jewelry:
-                    {product_info}
-                    
-                    Hãy giới thiệu ngắn gọn về danh mục này và những sản phẩm tiêu biểu, sử dụng ngôn ngữ chuyên nghiệp
-                    và gợi cảm hứng cho khách hàng.
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text}), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không thể tìm thấy sản phẩm trong danh mục này."}), 200
-
-            elif function_name == "get_bestselling_products":
-                products = call_api("/products/bestselling")
-                if products:
-                    product_info = "\n".join([
-                        f"- {p.get('name', 'Không tên')} (ID: {p.get('id', 'N/A')}): "
-                        f"{p.get('description', 'Không có mô tả')[:100]}... "
-                        f"Giá: {p.get('price', 'N/A')} VND" 
-                        for p in products[:5]
-                    ])
-                    
-                    prompt_for_response = f"""
-                    Dưới đây là các sản phẩm bán chạy nhất của Tinh Tú Jewelry:
-                    {product_info}
-                    
-                    Hãy giới thiệu những sản phẩm bán chạy này một cách hấp dẫn, nhấn mạnh vào lý do tại sao 
-                    chúng được nhiều khách hàng yêu thích. Sử dụng ngôn ngữ tự nhiên, không liệt kê dạng danh sách.
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text}), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không thể lấy thông tin sản phẩm bán chạy lúc này."}), 200
-                    
-            elif function_name == "get_new_arrivals":
-                limit = int(function_args.get("limit", 4))
-                products = call_api(f"/products/new-arrivals?limit={limit}")
+        # Optional per-request render mode: "llm", "template" or "hybrid"
+        render = data.get("render")
+        
+        # Optional conversation; without a session id every message stands alone
+        session_id = session_id_of(data)
+        try:
+            check_rate_limit(session_id)
+        except Overloaded as e:
+            finish_trace(trace, "shed")
+            return degraded_reply(e, wants_stream(data))
+        session = await session_store.load(session_id) if session_id else None
+        
+        if wants_stream(data):
+            # The stream records its own trace
+            return stream_reply(prompt, render, session)
+        annotate(prompt_chars=len(prompt), render=render, session=bool(session_id))
+        
+        # Cached answers are context-free, so they only serve a conversation's first turn
+        cacheable = session is None or not session.has_history
+        cached = await response_cache.lookup(prompt, variant=render) if cacheable else None
+        if cached is not None:
+            await remember_turn(session, prompt, cached.get("response"), cached.get("_results"), cached.get("_tool"))
+            finish_trace(trace, "cached")
+            return jsonify(public_payload(cached)), 200
+        
+        try:
+            async with chat_gate.slot(lane_for(prompt)):
+                deps = track_turn()
+                reply = await plan_reply(prompt, session)
+                mode = effective_render(render)
+                annotate(tool=reply.tool, render_mode=apply_render_mode(reply, mode))
+                if reply.prompt:
+                    with span("narrative"):
+                        reply.text = await write_narrative(reply.prompt)
+        except Overloaded as e:
+            finish_trace(trace, "shed")
+            return degraded_reply(e)
+        payload = reply.to_json()
+        # Template fallbacks during a quota pause are not what the shopper asked for; don't keep them
+        if cacheable and mode == render:
+            await response_cache.store(prompt, cache_payload(reply), deps, variant=render)
+        await remember_turn(session, prompt, reply.text, reply.result_cards(), reply.tool)
+        finish_trace(trace, "ok")
+        return jsonify(payload), 200
                 
-                if products:
-                    product_info = "\n".join([
-                        f"- {p.get('name', 'Không tên')} (ID: {p.get('id', 'N/A')}): "
-                        f"{p.get('description', 'Không có mô tả')[:100]}... "
-                        f"Giá: {p.get('price', 'N/A')} VND" 
-                        for p in products
-                    ])
-                    
-                    prompt_for_response = f"""
-                    Dưới đây là các sản phẩm mới nhất của Tinh Tú Jewelry:
-                    {product_info}
-                    
-                    Hãy giới thiệu những sản phẩm mới này một cách hấp dẫn, nhấn mạnh vào tính mới mẻ, 
-                    xu hướng hiện tại và lý do tại sao khách hàng nên quan tâm đến chúng.
-                    Sử dụng ngôn ngữ tự nhiên, không liệt kê dạng danh sách.
-                    
-                    Vì lí do kỹ thuật, hãy tạm thời trình bày sản phẩm với khách hàng bằng id chứ không phải code. Cảm ơn."
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text}), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không thể lấy thông tin sản phẩm mới lúc này."}), 200
+    except Exception as e:
+        logger.error(f"Error processing request: {e}", exc_info=True)
+        finish_trace(trace, "error")
+        return jsonify({"error": "Đã xảy ra lỗi khi xử lý yêu cầu của bạn"}), 500
 
-            elif function_name == "find_products_by_price_range":
-                min_price = int(function_args.get("min_price"))
-                max_price = int(function_args.get("max_price"))
-                
-                products = call_api(f"/products/price/between/{min_price}/{max_price}")
+# Server-Sent Events: "status" when the tool is chosen, "meta" for side-channel fields,
+# "cards" with structured results (template/hybrid modes), "delta" chunks of the narrative
+# as Gemini generates it, then "done" (or "error")
+def stream_reply(prompt, render=None, session=None):
+    async def events():
+        trace = start_trace("stream")
+        annotate(prompt_chars=len(prompt), render=render, session=session is not None)
+        try:
+            cacheable = session is None or not session.has_history
+            cached = await response_cache.lookup(prompt, variant=render) if cacheable else None
+            if cached is not None:
+                yield sse_event("status", {"stage": "cached"})
+                extra = {k: v for k, v in public_payload(cached).items() if k not in ("response", "cards")}
+                if extra:
+                    yield sse_event("meta", extra)
+                if cached.get("cards"):
+                    yield sse_event("cards", {"cards": cached["cards"]})
+                yield sse_event("delta", {"text": cached.get("response")})
+                # Persisted before "done": a client may stop reading once it arrives
+                await remember_turn(session, prompt, cached.get("response"), cached.get("_results"), cached.get("_tool"))
+                finish_trace(trace, "cached")
+                yield sse_event("done", {})
+                return
+            
+            async with chat_gate.slot(lane_for(prompt)):
+                deps = track_turn()
+                yield sse_event("status", {"stage": "thinking"})
+                reply = await plan_reply(prompt, session)
+                requested = effective_render(render)
+                mode = apply_render_mode(reply, requested)
+                annotate(tool=reply.tool, render_mode=mode)
+                yield sse_event("status", {"stage": "tool", "tool": reply.tool, "render": mode})
+                if reply.extra:
+                    yield sse_event("meta", reply.extra)
+                if reply.cards:
+                    yield sse_event("cards", {"cards": reply.cards})
                 
-                if products:
-                    product_info = "\n".join([
-                        f"- {p.get('name', 'Không tên')} (ID: {p.get('id', 'N/A')}): "
-                        f"{p.get('description', 'Không có mô tả')[:100]}... "
-                        f"Giá: {p.get('price', 'N/A')} VND" 
-                        for p in products[:5]
-                    ])
-                    
-                    prompt_for_response = f"""
-                    Dưới đây là các sản phẩm của Tinh Tú Jewelry trong khoảng giá từ {min_price} đến {max_price} VND:
-                    {product_info}
-                    
-                    Hãy giới thiệu những sản phẩm này, nhấn mạnh vào giá trị và chất lượng mà khách hàng nhận được.
-                    Giữ ngôn ngữ tự nhiên và thân thiện, không liệt kê dưới dạng danh sách.
-                    """
-                    
-                    response_text = model.generate_content(prompt_for_response).text
-                    return jsonify({"response": response_text}), 200
+                if reply.prompt:
+                    yield sse_event("status", {"stage": "writing"})
+                    chunks = []
+                    with span("narrative", stream=True):
+                        async for text in stream_narrative(reply.prompt):
+                            if not chunks:
+                                annotate(first_delta_ms=round(trace.elapsed() * 1000, 2))
+                            chunks.append(text)
+                            yield sse_event("delta", {"text": text})
+                    reply.text = "".join(chunks)
                 else:
-                    return jsonify({"response": f"Rất tiếc, tôi không tìm thấy sản phẩm nào trong khoảng giá từ {min_price} đến {max_price} VND."}), 200
+                    yield sse_event("delta", {"text": reply.text})
+            # Stored before "done", as in the JSON path: a client may stop reading once it arrives
+            if cacheable and requested == render:
+                await response_cache.store(prompt, cache_payload(reply), deps, variant=render)
+            await remember_turn(session, prompt, reply.text, reply.result_cards(), reply.tool)
+            finish_trace(trace, "ok")
+            yield sse_event("done", {})
+        except Overloaded as e:
+            finish_trace(trace, "shed")
+            yield degraded_events(e)
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}", exc_info=True)
+            finish_trace(trace, "error")
+            yield sse_event("error", {"error": "Đã xảy ra lỗi khi xử lý yêu cầu của bạn"})
 
-            elif function_name == "redirect_to_product":
-                product_id = int(function_args.get("product_id"))
-                
-                # Verify product exists
-                product = call_api(f"/products/{product_id}")
-                if product:
-                    redirect_url = f"/catalog/product/{product_id}"
-                    return jsonify({
-                        "response": f"Tôi đã tìm thấy sản phẩm {product.get('name', '')} mà bạn quan tâm. Tôi sẽ chuyển bạn đến trang sản phẩm ngay bây giờ.",
-                        "redirect": redirect_url
-                    }), 200
-                else:
-                    return jsonify({"response": "Rất tiếc, tôi không tìm thấy sản phẩm này."}), 200
-            
-            else:
-                # Handle any other function calls that might be added in the future
-                # return jsonify({"response": "Xin lỗi, chức năng này hiện không khả dụng."}), 200
-                if ai_response.candidates[0].content.parts[0].text:
-                    return jsonify({"response": ai_response.candidates[0].content.parts[0].text}), 200
-                else:
-                    return jsonify({"response": "Xin lỗi, tôi không hiểu câu hỏi của bạn. Vui lòng thử lại."}), 200
-                
-        else:
-            # If no function was called, return the direct text response
-            if ai_response.candidates[0].content.parts[0].text:
-                return jsonify({"response": ai_response.candidates[0].content.parts[0].text}), 200
-            else:
-                return jsonify({"response": "Xin lỗi, tôi không hiểu câu hỏi của bạn. Vui lòng thử lại."}), 200
-                
+    return events(), 200, {
+        "Content-Type": "text/event-stream; charset=utf-8",
+        "Cache-Control": "no-cache",
+        # Stop reverse proxies from buffering the stream
+        "X-Accel-Buffering": "no",
+    }
+
+def quota_exhausted():
+    model_quota.trip()
+    return Overloaded("model_quota", retry_after=model_quota.retry_after())
+
+# Every Gemini call goes through the quota backoff: refused while paused, pausing on 429s
+async def generate_content(gemini_model, contents, **kwargs):
+    model_quota.check()
+    try:
+        response = await gemini_model.generate_content_async(contents, **kwargs)
     except Exception as e:
-        logger.error(f"Error processing request: {e}", exc_info=True)
-        return jsonify({"error": "Đã xảy ra lỗi khi xử lý yêu cầu của bạn"}), 500
+        if is_quota_error(e):
+            raise quota_exhausted() from e
+        raise
+    model_quota.succeeded()
+    return response
+
+# Narrative for a grounding prompt. Shoppers asking the same thing at once ("sản phẩm bán chạy"
+# during a promotion) get identical grounding prompts, so one model call serves all of them.
+async def write_narrative(grounding):
+    prompt = grounding.render()
+    async def generate():
+        response = await generate_content(narrative_model, prompt)
+        record_usage("narrative", response)
+        return response.text
+    return await narrative_flight.do(("text", prompt), generate)
+
+def stream_narrative(grounding):
+    prompt = grounding.render()
+    async def generate():
+        response = await generate_content(narrative_model, prompt, stream=True)
+        try:
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            if is_quota_error(e):
+                raise quota_exhausted() from e
+            raise
+        record_usage("narrative", response)
+    return narrative_flight.stream(("stream", prompt), generate)
+
+# Cached answers keep the tool results too, so a session started from a cache hit can resolve follow-ups
+def cache_payload(reply):
+    return {**reply.to_json(), "_results": reply.result_cards(), "_tool": reply.tool}
+
+def public_payload(payload):
+    return {k: v for k, v in payload.items() if not k.startswith("_")}
+
+async def remember_turn(session, prompt, answer, cards=None, tool=None):
+    if session is not None:
+        await session_store.record(session, prompt, answer, cards, tool)
+
+# Ask Gemini which tools to use and run every requested call concurrently
+async def plan_reply(prompt, session=None):
+    if session is not None:
+        # Follow-ups about the last results ("cái thứ hai giá bao nhiêu?") skip the model and the catalog
+        follow_up = session.resolve_follow_up(prompt)
+        if follow_up:
+            return Reply(tool="session", text=follow_up)
+    
+    # Earlier turns, the rolling summary and the last results ride along with the prompt
+    contents = session.contents(prompt) if session is not None and (session.has_history or session.results) else prompt
+    
+    function_calls, direct_text = await select_tools(prompt, contents)
+    
+    if not function_calls:
+        # If no function was called, return the direct text response
+        if direct_text:
+            return Reply(text=direct_text)
+        else:
+            return Reply(text="Xin lỗi, tôi không hiểu câu hỏi của bạn. Vui lòng thử lại.")
+    
+    results = await asyncio.gather(*(
+        run_tool(name, args, direct_text)
+        for name, args in function_calls
+    ), return_exceptions=True)
+    
+    # One failing tool should not sink the answers from the others
+    replies = []
+    for (name, _), result in zip(function_calls, results):
+        if isinstance(result, Exception):
+            logger.error(f"Tool {name} failed: {result}", exc_info=result)
+            note_catalog_use(failed=True)
+            result = Reply(tool=name, text="Rất tiếc, tôi không thể tra cứu thông tin này lúc này.")
+        replies.append(result)
+    
+    if len(replies) == 1:
+        return replies[0]
+    return merge_replies(replies)
+
+def parse_calls(ai_response):
+    parts = ai_response.candidates[0].content.parts if ai_response.candidates else []
+    direct_text = next((part.text for part in parts if getattr(part, "text", "")), "")
+    # The model may return several function call parts for one question
+    function_calls = [
+        (part.function_call.name, part.function_call.args) for part in parts
+        if getattr(part, "function_call", None) and part.function_call.name
+    ]
+    return function_calls, direct_text
+
+def confident(function_calls, direct_text):
+    """Whether a tier's answer is usable: known tools with their required args, or plain text."""
+    if not function_calls:
+        return bool(direct_text)
+    return all(
+        tool_registry.get(name) is not None and tool_registry.get(name).accepts(args)
+        for name, args in function_calls
+    )
+
+# Pick the tools for a prompt: local rules first, then the light router model,
+# escalating to the large model for open-ended prompts or when the router is unsure
+async def select_tools(prompt, contents):
+    intent = classify_intent(prompt)
+    if intent is not None:
+        observe_route("rules")
+        annotate(route="rules", rule=intent.rule)
+        return intent.calls, ""
+    
+    if is_open_ended(prompt) or MODEL_ROUTER == MODEL_LARGE:
+        tiers = [("large", model)]
+    else:
+        tiers = [("router", router_model), ("large", model)]
+    for tier, tier_model in tiers:
+        with span("select_tool", tier=tier):
+            ai_response = await generate_content(tier_model, contents)
+        record_usage("select_tool", ai_response)
+        function_calls, direct_text = parse_calls(ai_response)
+        if tier == tiers[-1][0] or confident(function_calls, direct_text):
+            break
+    observe_route(tier)
+    annotate(route=tier)
+    return function_calls, direct_text
+
+# Combine the results of several tools into a single grounding prompt
+def merge_replies(replies):
+    extra = {}
+    sections = []
+    for reply in replies:
+        extra.update(reply.extra)
+        # Replies without structured data (e.g. "not found") become heading-only sections
+        sections.extend(reply.sections or ([(reply.text, [])] if reply.text else []))
+    tool = ",".join(reply.tool for reply in replies if reply.tool)
+    
+    if not any(reply.prompt for reply in replies):
+        return Reply(tool=tool, text="\n".join(reply.text for reply in replies if reply.text), **extra)
+    
+    # Products returned by more than one tool are listed once
+    grounding = Grounding.merge(
+        [reply.prompt if reply.prompt else Grounding().note(f"Ghi chú: {reply.text}") for reply in replies],
+        "Khách hỏi nhiều ý trong một câu: gộp tất cả thành một câu trả lời mạch lạc, không lặp lại sản phẩm.",
+    )
+    return Reply(tool=tool, prompt=grounding, sections=sections, **extra)
+
+# ---- Tools available to Gemini ----
+# Each tool is a handler that fetches data plus a formatter that builds the Reply;
+# the registry table at the end generates the function declarations.
+
+def products_reply(tool, products, heading, intro, instructions, **extra):
+    return Reply(
+        tool=tool,
+        prompt=Grounding().products(intro, products).instruct(instructions),
+        sections=[(heading, [product_card(p) for p in products])],
+        **extra,
+    )
+
+def product_list_formatter(heading, intro, instructions, empty_text):
+    """Formatter for tools whose handler returns a plain product list."""
+    def format_reply(tool, products, args):
+        if not products:
+            return Reply(tool=tool, text=empty_text)
+        return products_reply(tool, products, heading, intro.format(count=len(products)), instructions)
+    return format_reply
+
+def limit_arg(args, default):
+    return int(args.get("limit", default))
+
+async def get_products(args):
+    limit = limit_arg(args, 5)
+    # Limit the number of products returned on the catalog side
+    return await call_api("/products", params={"limit": limit, "fields": PRODUCT_LIST_FIELDS}, max_items=limit)
+
+async def get_product_details(args):
+    return await call_api(f"/products/{int(args.get('product_id'))}")
+
+def format_product_details(tool, product, args):
+    if not product:
+        return Reply(tool=tool, text="Rất tiếc, tôi không tìm thấy thông tin về sản phẩm này.")
+    
+    grounding = Grounding().detail("Sản phẩm khách hàng quan tâm:", product).instruct(
+        "Mô tả sản phẩm hấp dẫn, nêu đặc điểm nổi bật và hướng dẫn khách xem thêm chi tiết hoặc mua."
+    )
+    return Reply(
+        tool=tool,
+        prompt=grounding,
+        sections=[("Thông tin sản phẩm:", [product_detail_card(product)])],
+        product_id=int(args.get("product_id")),
+    )
+
+async def get_categories(args):
+    # An empty list means /categories failed while the index was built
+    if product_index.categories and index_ready():
+        return product_index.categories
+    return await call_api("/categories")
+
+def format_categories(tool, categories, args):
+    if not categories:
+        return Reply(tool=tool, text="Rất tiếc, tôi không thể lấy thông tin danh mục lúc này.")
+    
+    grounding = Grounding().entries("Các danh mục sản phẩm của Tinh Tú Jewelry:", categories).instruct(
+        "Giới thiệu các danh mục này hấp dẫn, mời khách khám phá các bộ sưu tập."
+    )
+    return Reply(
+        tool=tool,
+        prompt=grounding,
+        sections=[("Các danh mục trang sức của Tinh Tú Jewelry:", [category_card(cat) for cat in categories])],
+    )
+
+async def get_products_by_category(args):
+    category_id = int(args.get("category_id"))
+    if index_ready():
+        products = product_index.by_category(category_id, limit=PRODUCT_LIST_LIMIT)
+        category = await indexed_entry(product_index.categories, category_id, f"/categories/{category_id}")
+        return products, category
+    return await asyncio.gather(
+        call_api(
+            f"/products/category/{category_id}",
+            params={"limit": PRODUCT_LIST_LIMIT, "fields": PRODUCT_LIST_FIELDS},
+            max_items=PRODUCT_LIST_LIMIT,
+        ),
+        call_api(f"/categories/{category_id}"),
+    )
+
+def format_products_by_category(tool, data, args):
+    products, category = data
+    if not products:
+        return Reply(tool=tool, text="Rất tiếc, tôi không thể tìm thấy sản phẩm trong danh mục này.")
+    
+    category_name = category.get('name', 'Không có tên') if category else args.get("category_id")
+    return products_reply(
+        tool, products,
+        f"Sản phẩm danh mục {category_name}:",
+        f'Sản phẩm danh mục "{category_name}":',
+        "Giới thiệu ngắn gọn danh mục và các sản phẩm tiêu biểu, gợi cảm hứng cho khách.",
+    )
+
+async def get_bestselling_products(args):
+    products = ranked_from_index("bestselling", PRODUCT_LIST_LIMIT)
+    if products is not None:
+        return products
+    return await call_api(
+        "/products/bestselling",
+        params={"limit": PRODUCT_LIST_LIMIT, "fields": PRODUCT_LIST_FIELDS},
+        max_items=PRODUCT_LIST_LIMIT,
+    )
+
+async def get_new_arrivals(args):
+    limit = limit_arg(args, 4)
+    products = ranked_from_index("new_arrivals", limit)
+    if products is not None:
+        return products
+    return await call_api(
+        "/products/new-arrivals",
+        params={"limit": limit, "fields": PRODUCT_LIST_FIELDS},
+        max_items=limit,
+    )
+
+def price_range_args(args):
+    return int(args.get("min_price")), int(args.get("max_price"))
+
+async def find_products_by_price_range(args):
+    min_price, max_price = price_range_args(args)
+    if index_ready():
+        return product_index.price_range(min_price, max_price, limit=PRODUCT_LIST_LIMIT)
+    return await call_api(
+        f"/products/price/between/{min_price}/{max_price}",
+        params={"limit": PRODUCT_LIST_LIMIT, "fields": PRODUCT_LIST_FIELDS},
+        max_items=PRODUCT_LIST_LIMIT,
+    )
+
+def format_products_by_price_range(tool, products, args):
+    min_price, max_price = price_range_args(args)
+    if not products:
+        return Reply(tool=tool, text=f"Rất tiếc, tôi không tìm thấy sản phẩm nào trong khoảng giá từ {format_price(min_price)} đến {format_price(max_price)}.")
+    price_range = f"từ {format_price(min_price)} đến {format_price(max_price)}"
+    return products_reply(
+        tool, products,
+        f"Sản phẩm {price_range}:",
+        f"Sản phẩm trong khoảng giá {price_range}:",
+        "Giới thiệu các sản phẩm, nhấn mạnh giá trị và chất lượng khách nhận được.",
+    )
+
+def material_args(args):
+    category_id = args.get("category_id")
+    return (int(category_id) if category_id is not None else None), str(args.get("material", "")).strip()
+
+async def find_products_by_material(args):
+    category_id, material = material_args(args)
+    if index_ready():
+        return product_index.by_material(material, category_id=category_id, limit=PRODUCT_LIST_LIMIT)
+    
+    # Without the index, the catalog filters the category by material; the check below also
+    # covers diacritics ("vang" for "Vàng") and catalogs that ignore ?material
+    candidates = await call_api(
+        f"/products/category/{category_id}",
+        params={"material": material, "limit": PRODUCT_LIST_LIMIT, "fields": PRODUCT_LIST_FIELDS},
+        max_items=PRODUCT_LIST_LIMIT,
+    ) if category_id is not None and material else None
+    folded = fold_text(material)
+    return [p for p in (candidates or []) if folded and folded in fold_text(p.get("material"))][:PRODUCT_LIST_LIMIT]
+
+def format_products_by_material(tool, products, args):
+    _, material = material_args(args)
+    if not products:
+        return Reply(tool=tool, text=f"Rất tiếc, tôi không tìm thấy sản phẩm nào có chất liệu {material}.")
+    return products_reply(
+        tool, products,
+        f"Sản phẩm chất liệu {material}:",
+        f"Sản phẩm chất liệu {material}:",
+        "Giới thiệu các sản phẩm, nhấn mạnh vẻ đẹp và độ bền của chất liệu.",
+    )
+
+async def get_collections(args):
+    # An empty list means /collections failed while the index was built
+    if product_index.collections and index_ready():
+        return product_index.collections
+    return await call_api("/collections")
+
+def format_collections(tool, collections, args):
+    if not collections:
+        return Reply(tool=tool, text="Rất tiếc, tôi không thể lấy thông tin bộ sưu tập lúc này.")
+    
+    grounding = Grounding().entries("Các bộ sưu tập của Tinh Tú Jewelry:", collections).instruct(
+        "Giới thiệu các bộ sưu tập hấp dẫn, nêu bật phong cách riêng của từng bộ."
+    )
+    return Reply(
+        tool=tool,
+        prompt=grounding,
+        sections=[("Các bộ sưu tập của Tinh Tú Jewelry:", [collection_card(col) for col in collections])],
+    )
+
+async def get_products_by_collection(args):
+    collection_id = int(args.get("collection_id"))
+    if index_ready():
+        products = product_index.by_collection(collection_id, limit=PRODUCT_LIST_LIMIT)
+        collection = await indexed_entry(product_index.collections, collection_id, f"/collections/{collection_id}")
+        return products, collection
+    return await asyncio.gather(
+        call_api(
+            f"/products/collection/{collection_id}",
+            params={"limit": PRODUCT_LIST_LIMIT, "fields": PRODUCT_LIST_FIELDS},
+            max_items=PRODUCT_LIST_LIMIT,
+        ),
+        call_api(f"/collections/{collection_id}"),
+    )
+
+def format_products_by_collection(tool, data, args):
+    products, collection = data
+    if not products:
+        return Reply(tool=tool, text="Rất tiếc, tôi không thể tìm thấy sản phẩm trong bộ sưu tập này.")
+    
+    collection_name = collection.get('name', 'Không có tên') if collection else args.get("collection_id")
+    return products_reply(
+        tool, products,
+        f"Sản phẩm bộ sưu tập {collection_name}:",
+        f'Sản phẩm bộ sưu tập "{collection_name}":',
+        "Giới thiệu ngắn gọn bộ sưu tập và các sản phẩm tiêu biểu, gợi cảm hứng cho khách.",
+    )
+
+async def redirect_to_product(args):
+    # Verify product exists
+    return await call_api(f"/products/{int(args.get('product_id'))}")
+
+def format_redirect(tool, product, args):
+    if not product:
+        return Reply(tool=tool, text="Rất tiếc, tôi không tìm thấy sản phẩm này.")
+    return Reply(
+        tool=tool,
+        text=f"Tôi đã tìm thấy sản phẩm {product.get('name', '')} mà bạn quan tâm. Tôi sẽ chuyển bạn đến trang sản phẩm ngay bây giờ.",
+        redirect=f"/catalog/product/{int(args.get('product_id'))}",
+    )
+
+def int_param(description):
+    return {"type": "integer", "description": description}
+
+# Adding a tool = one entry here; dispatch is a dict lookup
+tool_registry = ToolRegistry([
+    Tool(
+        "get_products", "Lấy danh sách sản phẩm trang sức của cửa hàng Tinh Tú",
+        get_products,
+        product_list_formatter(
+            "Một số sản phẩm của Tinh Tú Jewelry:",
+            "{count} sản phẩm của Tinh Tú Jewelry:",
+            "Giới thiệu các sản phẩm, nhấn mạnh tính độc đáo và chất lượng.",
+            "Rất tiếc, tôi không thể lấy thông tin sản phẩm lúc này. Vui lòng thử lại sau.",
+        ),
+        parameters={"limit": int_param("Số lượng sản phẩm muốn hiển thị (mặc định: 5)")},
+    ),
+    Tool(
+        "get_product_details", "Lấy thông tin chi tiết về một sản phẩm trang sức cụ thể",
+        get_product_details, format_product_details,
+        parameters={"product_id": int_param("ID của sản phẩm cần xem chi tiết")},
+        required=["product_id"],
+        # Detail answers quote price and stock, keep them fresher than list answers
+        cache_ttl=60,
+    ),
+    Tool(
+        "get_categories", "Lấy danh sách các danh mục trang sức của cửa hàng",
+        get_categories, format_categories,
+        timeout=4.0,
+    ),
+    Tool(
+        "get_products_by_category", "Lấy danh sách sản phẩm theo danh mục",
+        get_products_by_category, format_products_by_category,
+        parameters={"category_id": int_param("ID của danh mục cần lấy sản phẩm")},
+        required=["category_id"],
+    ),
+    Tool(
+        "get_collections", "Lấy danh sách các bộ sưu tập trang sức của cửa hàng",
+        get_collections, format_collections,
+        timeout=4.0,
+    ),
+    Tool(
+        "get_products_by_collection", "Lấy danh sách sản phẩm theo bộ sưu tập",
+        get_products_by_collection, format_products_by_collection,
+        parameters={"collection_id": int_param("ID của bộ sưu tập cần lấy sản phẩm")},
+        required=["collection_id"],
+    ),
+    Tool(
+        "get_bestselling_products", "Lấy danh sách sản phẩm bán chạy nhất",
+        get_bestselling_products,
+        product_list_formatter(
+            "Sản phẩm bán chạy nhất:",
+            "Sản phẩm bán chạy nhất của Tinh Tú Jewelry:",
+            "Giới thiệu các sản phẩm bán chạy, nêu lý do chúng được nhiều khách yêu thích.",
+            "Rất tiếc, tôi không thể lấy thông tin sản phẩm bán chạy lúc này.",
+        ),
+    ),
+    Tool(
+        "get_new_arrivals", "Lấy danh sách sản phẩm mới nhất",
+        get_new_arrivals,
+        product_list_formatter(
+            "Sản phẩm mới nhất:",
+            "Sản phẩm mới nhất của Tinh Tú Jewelry:",
+            "Giới thiệu các sản phẩm mới, nhấn mạnh tính mới mẻ, xu hướng và lý do khách nên quan tâm.",
+            "Rất tiếc, tôi không thể lấy thông tin sản phẩm mới lúc này.",
+        ),
+        parameters={"limit": int_param("Số lượng sản phẩm muốn hiển thị (mặc định: 4)")},
+    ),
+    Tool(
+        "find_products_by_price_range", "Tìm sản phẩm trong khoảng giá",
+        find_products_by_price_range, format_products_by_price_range,
+        parameters={
+            "min_price": {"type": "number", "description": "Giá thấp nhất (VND)"},
+            "max_price": {"type": "number", "description": "Giá cao nhất (VND)"},
+        },
+        required=["min_price", "max_price"],
+    ),
+    Tool(
+        "find_products_by_material", "Tìm sản phẩm theo chất liệu như vàng, bạc, kim cương, v.v.",
+        find_products_by_material, format_products_by_material,
+        parameters={
+            "category_id": int_param("ID của danh mục sản phẩm"),
+            "material": {"type": "string", "description": "Chất liệu của sản phẩm (vàng, bạc, kim cương...)"},
+        },
+        required=["category_id", "material"],
+    ),
+    Tool(
+        "redirect_to_product", "Chuyển hướng người dùng đến trang sản phẩm cụ thể",
+        redirect_to_product, format_redirect,
+        parameters={"product_id": int_param("ID của sản phẩm cần chuyển hướng đến")},
+        required=["product_id"],
+        timeout=3.0,
+    ),
+])
+
+# Gemini models, with the tool declarations generated from the registry.
+# Tool selection starts on the light router tier; the large model handles escalations.
+gemini_tools = [types.Tool(function_declarations=tool_registry.declarations())]
+router_model = GenerativeModel(model_name=MODEL_ROUTER, tools=gemini_tools, system_instruction=system_instruction)
+model = GenerativeModel(model_name=MODEL_LARGE, tools=gemini_tools, system_instruction=system_instruction)
+# Writes the answer from tool results; it never calls tools. The writing rules sit in the
+# system instruction so every narrative request starts with the same cacheable prefix.
+narrative_instruction = system_instruction + NARRATIVE_RULES
+narrative_model = GenerativeModel(model_name=MODEL_NARRATIVE, system_instruction=narrative_instruction)
+narrative_context = NarrativeContextCache(MODEL_NARRATIVE, narrative_instruction)
+
+@app.route("/stats/tools", methods=["GET"])
+async def tool_stats():
+    return jsonify(tool_registry.stats()), 200
+
+# Run one tool call through the registry
+async def run_tool(function_name, function_args, direct_text=""):
+    logger.debug(f"Function called: {function_name} with args: {function_args}")
+    
+    reply = await tool_registry.dispatch(function_name, function_args)
+    if reply is not None:
+        return reply
+    
+    # Tools the model invents or that are no longer registered
+    if direct_text:
+        return Reply(tool=function_name, text=direct_text)
+    return Reply(tool=function_name, text="Xin lỗi, tôi không hiểu câu hỏi của bạn. Vui lòng thử lại.")
 
 if __name__ == "__main__":
-    # Get port from environment variable or use default
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    
+    # Production ASGI server; settings (bind, workers, keep-alive) live in hypercorn_config.py
+    asyncio.run(serve(app, Config.from_object("hypercorn_config")))
@@ -0,0 +1,231 @@
+import os
+import time
+import asyncio
+import logging
+import ipaddress
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from google.api_core.exceptions import ResourceExhausted
+
+logger = logging.getLogger(__name__)
+
+# Token buckets: sustained requests per minute and burst size, per session and per client IP.
+# The IP limit is looser because several shoppers can share one address (office, mobile NAT).
+# Buckets live in each worker process, so with WEB_CONCURRENCY=N a client spreading requests
+# over the workers gets up to N times these rates.
+RATE_LIMIT_SESSION_PER_MINUTE = float(os.environ.get("RATE_LIMIT_SESSION_PER_MINUTE", "20"))
+RATE_LIMIT_SESSION_BURST = int(os.environ.get("RATE_LIMIT_SESSION_BURST", "5"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get("RATE_LIMIT_IP_PER_MINUTE", "60"))
+RATE_LIMIT_IP_BURST = int(os.environ.get("RATE_LIMIT_IP_BURST", "15"))
+# Proxies in front of the chatbot that append the caller's address to X-Forwarded-For (the API
+# gateway). The client is the entry the outermost of them added; anything further left is
+# client-supplied and can be forged.
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "1"))
+# Addresses (CIDR) the nearest of those proxies connects from. X-Forwarded-For from anyone else
+# is ignored, so a caller reaching the chatbot directly cannot pick its own rate-limit bucket.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(cidr.strip())
+    for cidr in os.environ.get("TRUSTED_PROXIES", "10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,127.0.0.0/8,::1/128").split(",")
+    if cidr.strip()
+]
+# Buckets kept per worker; the least recently seen clients are forgotten first
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "20000"))
+
+# Chats waiting for a slot beyond MAX_CONCURRENT_CHATS, and how long one may wait
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# Pause for model calls after Gemini reports an exhausted quota; doubles while it keeps failing
+QUOTA_BACKOFF_INITIAL = float(os.environ.get("QUOTA_BACKOFF_INITIAL", "2"))
+QUOTA_BACKOFF_MAX = float(os.environ.get("QUOTA_BACKOFF_MAX", "60"))
+
+# Degraded replies, sent instead of making the shopper wait
+RATE_LIMITED_TEXT = "Bạn đang gửi tin nhắn hơi nhanh. Vui lòng thử lại sau giây lát nhé."
+BUSY_TEXT = "Hệ thống đang quá tải, bạn vui lòng thử lại sau ít phút nhé."
+
+
+def is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+class Overloaded(Exception):
+    """A request that should get a degraded reply; reason feeds metrics and the trace."""
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Seconds until a token is available; 0 when one was taken."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class RateLimiter:
+    """Token bucket per client key, LRU-bounded."""
+
+    def __init__(self, per_minute, burst, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, key):
+        """Seconds the client must wait, 0 if the request may proceed."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.take()
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self):
+        return {
+            "clients": len(self._buckets),
+            "per_minute": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class AdmissionGate:
+    """Concurrency cap with a bounded wait queue and a priority lane.
+
+    High-priority requests (cheap ones such as redirects) are woken before any queued
+    normal request and are not counted against the queue size.
+    """
+
+    def __init__(self, limit, max_waiting=ADMISSION_QUEUE_SIZE, timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = {"high": deque(), "normal": deque()}
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def slot(self, priority="normal"):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority):
+        if self.active < self.limit:
+            self.active += 1
+            self.admitted += 1
+            return
+        waiters = self._waiters[priority]
+        if priority != "high" and len(waiters) >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded("queue_full", retry_after=self.timeout)
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended; pass it on
+                self._release()
+            else:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise Overloaded("queue_timeout", retry_after=self.timeout) from None
+            raise
+        self.admitted += 1
+
+    def _release(self):
+        # Hand the slot straight to the next waiter, high lane first
+        for lane in ("high", "normal"):
+            waiters = self._waiters[lane]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "limit": self.limit,
+            "waiting": {lane: len(waiters) for lane, waiters in self._waiters.items()},
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+def is_quota_error(error):
+    """Gemini 429 / RESOURCE_EXHAUSTED."""
+    return isinstance(error, ResourceExhausted) or getattr(error, "code", None) == 429
+
+
+class QuotaBackoff:
+    """Stops model calls for a while after quota errors instead of hammering Gemini."""
+
+    def __init__(self, initial=QUOTA_BACKOFF_INITIAL, maximum=QUOTA_BACKOFF_MAX):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+        self.until = 0.0
+        self.trips = 0
+
+    def retry_after(self):
+        return max(0.0, self.until - time.monotonic())
+
+    def check(self):
+        """Raise Overloaded while backing off."""
+        remaining = self.retry_after()
+        if remaining:
+            raise Overloaded("model_quota", retry_after=remaining)
+
+    def trip(self):
+        self.delay = min(self.maximum, self.delay * 2 if self.delay else self.initial)
+        self.until = time.monotonic() + self.delay
+        self.trips += 1
+        logger.warning(f"Gemini quota exhausted, pausing model calls for {self.delay:.0f}s")
+
+    def succeeded(self):
+        self.delay = 0.0
+
+    def stats(self):
+        return {"backing_off_s": round(self.retry_after(), 2), "delay_s": self.delay, "trips": self.trips}
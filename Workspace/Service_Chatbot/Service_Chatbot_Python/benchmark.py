@@ -0,0 +1,630 @@
+"""Offline load test for the chatbot service.
+
+Runs Server.app in-process against a scripted fake Gemini model and a stub catalog
+gateway (separate process, loopback only), drives a weighted mix of tool requests
+at a fixed concurrency and reports throughput, latency percentiles, memory and the
+catalog connections used. Nothing leaves the machine.
+
+    python benchmark.py --products 10000 --concurrency 50 --requests 2000
+    python benchmark.py --mix search --stream-ratio 0.5 --json
+    python benchmark.py --workers 4 --shared-cache none   # per-worker caches only
+"""
+import os
+import re
+import sys
+import json
+import time
+import types
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from urllib.parse import parse_qs
+
+GATEWAY_PREFIX = "/api/v1"
+CATALOG_PREFIX = f"{GATEWAY_PREFIX}/catalog"
+
+MATERIALS = ["Vàng 18K", "Vàng trắng", "Vàng hồng", "Bạc 925", "Bạch kim", "Kim cương", "Ngọc trai"]
+COLORS = ["Vàng", "Trắng", "Hồng", "Bạc", "Xanh"]
+KINDS = ["Nhẫn", "Dây chuyền", "Bông tai", "Lắc tay", "Mặt dây", "Kiềng", "Vòng cổ", "Trâm cài"]
+COLLECTION_NAMES = ["Xuân", "Hạ", "Thu", "Đông", "Hoàng gia", "Tinh tú", "Ánh trăng", "Biển cả",
+                    "Cổ điển", "Hiện đại", "Cưới", "Doanh nhân"]
+
+
+# ---- synthetic catalog ----
+
+def build_catalog(count, seed):
+    rng = random.Random(seed)
+    categories = [
+        {"id": i + 1, "name": kind, "description": f"Các mẫu {kind.lower()} của Tinh Tú"}
+        for i, kind in enumerate(KINDS)
+    ]
+    collections = [
+        {"id": i + 1, "name": name, "description": f"Bộ sưu tập {name}"}
+        for i, name in enumerate(COLLECTION_NAMES)
+    ]
+    products = []
+    for pid in range(1, count + 1):
+        category = rng.choice(categories)
+        material = rng.choice(MATERIALS)
+        products.append({
+            "id": pid,
+            "name": f"{category['name']} {material} {pid}",
+            "description": f"{category['name']} chế tác thủ công từ {material.lower()}, thiết kế tinh xảo. " * 3,
+            "price": rng.randrange(5, 2000) * 100000,
+            "material": material,
+            "color": rng.choice(COLORS),
+            "goldKarat": rng.choice([None, 10, 14, 18, 24]),
+            "size": rng.choice(["S", "M", "L"]),
+            "categoryId": category["id"],
+            "collectionId": rng.choice(collections)["id"],
+            "quantity": rng.randrange(0, 50),
+            "sold": rng.randrange(0, 5000),
+            "createdAt": 1_700_000_000 + pid * 60,
+            "updatedAt": 1_700_000_000 + pid * 60,
+        })
+    return products, categories, collections
+
+
+class StubCatalog:
+    """ASGI app serving the catalog routes the chatbot uses, from an in-memory catalog."""
+
+    def __init__(self, count, seed, latency):
+        self.products, self.categories, self.collections = build_catalog(count, seed)
+        self.by_id = {p["id"]: p for p in self.products}
+        self.by_price = sorted(self.products, key=lambda p: p["price"])
+        self.prices = [p["price"] for p in self.by_price]
+        self.bestselling = sorted(self.products, key=lambda p: -p["sold"])
+        self.new_arrivals = sorted(self.products, key=lambda p: -p["createdAt"])
+        self.by_category = defaultdict(list)
+        self.by_collection = defaultdict(list)
+        for p in self.products:
+            self.by_category[p["categoryId"]].append(p)
+            self.by_collection[p["collectionId"]].append(p)
+        self.latency = latency
+        self.requests = 0
+        self.connections = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        if scope["path"] == "/__stats":
+            status, body = 200, {"requests": self.requests, "connections": len(self.connections)}
+        else:
+            self.requests += 1
+            # Client (host, port) pairs: one per TCP connection the chatbot opened
+            self.connections.add(tuple(scope.get("client") or ()))
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            query = {k: v[-1] for k, v in parse_qs(scope["query_string"].decode()).items()}
+            status, body = self.route(scope["path"][len(CATALOG_PREFIX):], query)
+
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": payload})
+
+    def route(self, path, query):
+        parts = path.strip("/").split("/")
+        ids = [int(part) for part in parts if re.fullmatch(r"\d+", part)]
+        products = None
+        if parts == ["products"]:
+            products = self.products
+            if query.get("sort", "").startswith("updatedAt"):
+                products = self.new_arrivals
+        elif parts == ["products", "changes"]:
+            since, after_id = float(query["since"]), int(query.get("afterId", 0))
+            products = sorted((p for p in self.products if (p["updatedAt"], p["id"]) > (since, after_id)),
+                              key=lambda p: (p["updatedAt"], p["id"]))
+        elif parts[:2] == ["products", "bestselling"]:
+            products = self.bestselling
+        elif parts[:2] == ["products", "new-arrivals"]:
+            products = self.new_arrivals
+        elif parts[:2] == ["products", "category"] and ids:
+            products = self.by_category.get(ids[0], [])
+            if query.get("material"):
+                products = [p for p in products if query["material"].lower() in (p.get("material") or "").lower()]
+        elif parts[:2] == ["products", "collection"] and ids:
+            products = self.by_collection.get(ids[0], [])
+        elif parts[:3] == ["products", "price", "between"] and len(ids) == 2:
+            products = self.by_price[bisect_left(self.prices, ids[0]):bisect_right(self.prices, ids[1])]
+        elif parts[0] == "products" and len(parts) == 2 and ids:
+            product = self.by_id.get(ids[0])
+            return (200, product) if product else (404, {"error": "Not found"})
+        elif parts == ["categories"]:
+            return 200, self.categories
+        elif parts == ["collections"]:
+            return 200, self.collections
+        elif parts[0] in ("categories", "collections") and ids:
+            items = self.categories if parts[0] == "categories" else self.collections
+            item = next((i for i in items if i["id"] == ids[0]), None)
+            return (200, item) if item else (404, {"error": "Not found"})
+        if products is None:
+            return 404, {"error": "Not found"}
+
+        if "limit" in query:
+            limit = int(query["limit"])
+            start = int(query.get("page", 0)) * limit
+            products = products[start:start + limit]
+        if "fields" in query:
+            fields = query["fields"].split(",")
+            products = [{f: p.get(f) for f in fields} for p in products]
+        return 200, products
+
+
+def serve_stub(port, count, seed, latency):
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    config.errorlog = None
+    asyncio.run(serve(StubCatalog(count, seed, latency), config))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Stub catalog did not start on port {port}")
+
+
+# ---- fake Gemini ----
+
+class FakeModel:
+    """Stands in for GenerativeModel: scripted function calls, canned prose, simulated latency.
+
+    script maps a prompt to [(function_name, args), ...]; any other prompt is treated as
+    a narrative request and answered with text.
+    """
+
+    def __init__(self, script, select_latency, narrative_latency, stream_chunks, jitter, seed):
+        self.script = script
+        self.select_latency = select_latency
+        self.narrative_latency = narrative_latency
+        self.stream_chunks = stream_chunks
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.narrative_calls = 0
+        self.narrative_prompt_tokens = 0
+
+    def _delay(self, seconds):
+        return max(0.0, seconds * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    @staticmethod
+    def _usage(prompt_text, output_tokens):
+        return types.SimpleNamespace(prompt_token_count=len(prompt_text) // 3, candidates_token_count=output_tokens)
+
+    async def generate_content_async(self, contents=None, stream=False, **kwargs):
+        prompt = contents
+        if isinstance(contents, list):
+            prompt = contents[-1]["parts"][0]
+        calls = self.script.get(prompt)
+        if calls is not None:
+            await asyncio.sleep(self._delay(self.select_latency))
+            parts = [
+                types.SimpleNamespace(text="", function_call=types.SimpleNamespace(name=name, args=args))
+                for name, args in calls
+            ]
+            return types.SimpleNamespace(
+                candidates=[types.SimpleNamespace(content=types.SimpleNamespace(parts=parts))],
+                text="",
+                usage_metadata=self._usage(prompt, 20),
+            )
+
+        text = "Tinh Tú Jewelry xin giới thiệu những mẫu trang sức tinh xảo phù hợp với bạn. " * 4
+        self.narrative_calls += 1
+        self.narrative_prompt_tokens += self._usage(prompt, 0).prompt_token_count
+        if not stream:
+            await asyncio.sleep(self._delay(self.narrative_latency))
+            return types.SimpleNamespace(candidates=[], text=text, usage_metadata=self._usage(prompt, len(text) // 3))
+        return self._stream(prompt, text)
+
+    def _stream(self, prompt, text):
+        size = max(1, len(text) // self.stream_chunks)
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        model = self
+
+        class Stream:
+            usage_metadata = self._usage(prompt, len(text) // 3)
+
+            async def __aiter__(self):
+                for chunk in chunks:
+                    await asyncio.sleep(model._delay(model.narrative_latency / len(chunks)))
+                    yield types.SimpleNamespace(text=chunk)
+
+        return Stream()
+
+
+# ---- request mixes ----
+
+def scenarios(products, categories, collections):
+    """name -> factory(rng) returning (prompt, [(function_name, args), ...])."""
+    return {
+        "get_products": lambda rng: ("xem sản phẩm", [("get_products", {"limit": rng.choice([3, 5])})]),
+        "get_product_details": lambda rng: (lambda pid: (f"chi tiết sản phẩm {pid}", [("get_product_details", {"product_id": pid})]))(rng.randint(1, products)),
+        "get_categories": lambda rng: ("có những danh mục nào", [("get_categories", {})]),
+        "get_products_by_category": lambda rng: (lambda cid: (f"sản phẩm danh mục {cid}", [("get_products_by_category", {"category_id": cid})]))(rng.randint(1, categories)),
+        "get_collections": lambda rng: ("các bộ sưu tập", [("get_collections", {})]),
+        "get_products_by_collection": lambda rng: (lambda cid: (f"sản phẩm bộ sưu tập {cid}", [("get_products_by_collection", {"collection_id": cid})]))(rng.randint(1, collections)),
+        "get_bestselling_products": lambda rng: ("sản phẩm bán chạy", [("get_bestselling_products", {})]),
+        "get_new_arrivals": lambda rng: ("sản phẩm mới", [("get_new_arrivals", {"limit": 4})]),
+        "find_products_by_price_range": lambda rng: (lambda lo: (f"trang sức từ {lo} triệu đến {lo + 5} triệu", [("find_products_by_price_range", {"min_price": lo * 1_000_000, "max_price": (lo + 5) * 1_000_000})]))(rng.randint(0, 50)),
+        "find_products_by_material": lambda rng: (lambda cid, mat: (f"{mat} danh mục {cid}", [("find_products_by_material", {"category_id": cid, "material": mat})]))(rng.randint(1, categories), rng.choice(["vàng", "bạc", "kim cương", "ngọc trai", "bạch kim"])),
+        "redirect_to_product": lambda rng: (lambda pid: (f"mở trang sản phẩm {pid}", [("redirect_to_product", {"product_id": pid})]))(rng.randint(1, products)),
+        "multi": lambda rng: (lambda lo, pid: (f"dưới {lo} triệu và chi tiết {pid}", [("find_products_by_price_range", {"min_price": 0, "max_price": lo * 1_000_000}), ("get_product_details", {"product_id": pid})]))(rng.randint(1, 30), rng.randint(1, products)),
+    }
+
+
+# Relative weights of each scenario
+MIXES = {
+    "default": {
+        "get_products": 8, "get_product_details": 20, "get_categories": 4, "get_products_by_category": 10,
+        "get_collections": 3, "get_products_by_collection": 6, "get_bestselling_products": 8, "get_new_arrivals": 8,
+        "find_products_by_price_range": 15, "find_products_by_material": 10, "redirect_to_product": 5, "multi": 3,
+    },
+    "browse": {
+        "get_products": 20, "get_categories": 10, "get_products_by_category": 25, "get_collections": 10,
+        "get_products_by_collection": 15, "get_bestselling_products": 10, "get_new_arrivals": 10,
+    },
+    "search": {
+        "get_product_details": 25, "find_products_by_price_range": 35, "find_products_by_material": 25,
+        "redirect_to_product": 5, "multi": 10,
+    },
+}
+
+
+def build_requests(args, script):
+    factories = scenarios(args.products, len(KINDS), len(COLLECTION_NAMES))
+    mix = MIXES[args.mix]
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rng = random.Random(args.seed)
+    requests = []
+    for _ in range(args.warmup + args.requests):
+        name = rng.choices(names, weights)[0]
+        prompt, calls = factories[name](rng)
+        script[prompt] = calls
+        body = {"prompt": prompt, "stream": rng.random() < args.stream_ratio}
+        if args.render:
+            body["render"] = args.render
+        requests.append((name, body))
+    return requests
+
+
+# ---- driver ----
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def memory_mb():
+    """(current RSS, peak RSS) of this process in MB."""
+    current = peak = 0.0
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return round(current, 1), round(peak, 1)
+
+
+async def drive(app, requests, concurrency):
+    client = app.test_client()
+    queue = asyncio.Queue()
+    for item in requests:
+        queue.put_nowait(item)
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            name, body = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.post("/api/v1/response", json=body)
+            data = await response.get_data(as_text=True)
+            ok = response.status_code == 200 and "event: error" not in data
+            results.append((name, time.perf_counter() - started, ok))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+async def fetch_stub_stats(port):
+    import httpx
+
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"http://127.0.0.1:{port}/__stats")).json()
+
+
+async def run(args, port, worker=0, barrier=None):
+    """Measurements of one worker process; barrier lines workers up when there are several."""
+    import Server
+
+    script = {}
+    fake = FakeModel(script, args.select_latency, args.narrative_latency, args.stream_chunks, args.jitter, args.seed)
+    Server.model = Server.narrative_model = Server.summary_model = fake
+    Server.router_model = FakeModel(
+        script, args.router_latency, args.narrative_latency, args.stream_chunks, args.jitter, args.seed,
+    )
+    requests = build_requests(args, script)
+    warmup, measured = requests[:args.warmup], requests[args.warmup:]
+    concurrency = args.concurrency
+    if args.workers > 1:
+        # Each worker gets its share of one request stream, as behind a round-robin balancer
+        warmup, measured = warmup[worker::args.workers], measured[worker::args.workers]
+        concurrency = max(1, args.concurrency // args.workers)
+
+    if not args.index:
+        # Every query then goes through the catalog gateway
+        Server.index_sync.start = lambda: None
+
+    memory_before = memory_mb()
+    narrative_before = (0, 0)
+    stub_before = stub_after = None
+    async with Server.app.test_app():
+        if args.index:
+            # Startup kicks off the index snapshot; measure steady state, not the cold start
+            deadline = time.monotonic() + 120
+            while not Server.product_index.ready and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+        if warmup:
+            await drive(Server.app, warmup, concurrency)
+        if barrier is None:
+            stub_before = await fetch_stub_stats(port)
+        else:
+            # Once every worker is warm the parent reads the stub counters, then all start together
+            await asyncio.to_thread(barrier.wait)
+            await asyncio.to_thread(barrier.wait)
+        narrative_before = (fake.narrative_calls, fake.narrative_prompt_tokens)
+        results, elapsed = await drive(Server.app, measured, concurrency)
+        if barrier is None:
+            stub_after = await fetch_stub_stats(port)
+    memory_after = memory_mb()
+
+    return {
+        "results": results,
+        "seconds": elapsed,
+        "memory": (memory_before, memory_after),
+        "catalog": (stub_before, stub_after),
+        "narrative": (fake.narrative_calls - narrative_before[0], fake.narrative_prompt_tokens - narrative_before[1]),
+        "caches": {
+            "catalog": Server.catalog_cache.stats(),
+            "responses": Server.response_cache.stats(),
+            "shared": Server.shared_cache.stats() if Server.shared_cache is not None else None,
+        },
+    }
+
+
+def run_worker(args, port, worker, barrier, queue):
+    queue.put(asyncio.run(run(args, port, worker, barrier)))
+
+
+def run_workers(args, port):
+    """Measurements of args.workers worker processes, and the stub counters over their measured run."""
+    barrier = multiprocessing.Barrier(args.workers + 1)
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(args, port, worker, barrier, queue), daemon=True)
+        for worker in range(args.workers)
+    ]
+    for process in workers:
+        process.start()
+    try:
+        barrier.wait(timeout=600)
+        stub_before = asyncio.run(fetch_stub_stats(port))
+        barrier.wait(timeout=60)
+        measurements = [queue.get(timeout=600) for _ in workers]
+        stub_after = asyncio.run(fetch_stub_stats(port))
+    finally:
+        for process in workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+    return measurements, (stub_before, stub_after)
+
+
+def merge_stats(stats):
+    """Sum per-worker cache counters; the hit ratio is recomputed from the sums."""
+    stats = [entry for entry in stats if entry]
+    if not stats:
+        return None
+    merged = {}
+    for entry in stats:
+        for key, value in entry.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "hit_ratio":
+                merged[key] = merged.get(key, 0) + value
+            else:
+                merged.setdefault(key, value)
+    if len(stats) > 1:
+        hits = sum(value for key, value in merged.items() if key.endswith("hits"))
+        lookups = hits + merged.get("misses", 0)
+        merged["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+    return merged
+
+
+def build_report(args, measurements, catalog):
+    results = [result for measurement in measurements for result in measurement["results"]]
+    # Workers run side by side: the run lasts as long as the slowest one
+    elapsed = max(measurement["seconds"] for measurement in measurements)
+    stub_before, stub_after = catalog
+    narrative_calls = sum(measurement["narrative"][0] for measurement in measurements)
+    narrative_tokens = sum(measurement["narrative"][1] for measurement in measurements)
+    latencies = [seconds for _, seconds, _ in results]
+    per_scenario = defaultdict(list)
+    for name, seconds, _ in results:
+        per_scenario[name].append(seconds)
+    return {
+        "config": vars(args),
+        "requests": len(results),
+        "errors": sum(1 for _, _, ok in results if not ok),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0) * 1000, 2),
+        },
+        "scenarios": {
+            name: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+            }
+            for name, values in sorted(per_scenario.items())
+        },
+        # Summed over worker processes
+        "memory_mb": {
+            "rss_before": round(sum(m["memory"][0][0] for m in measurements), 1),
+            "rss_after": round(sum(m["memory"][1][0] for m in measurements), 1),
+            "rss_peak": round(sum(m["memory"][1][1] for m in measurements), 1),
+        },
+        "catalog": {
+            "requests": stub_after["requests"] - stub_before["requests"],
+            "connections_total": stub_after["connections"],
+        },
+        "narrative": {
+            "calls": narrative_calls,
+            # Grounding prompt only; the system instruction is a fixed, cacheable prefix
+            "avg_prompt_tokens": round(narrative_tokens / narrative_calls, 1) if narrative_calls else 0.0,
+        },
+        "caches": {
+            name: merge_stats([measurement["caches"][name] for measurement in measurements])
+            for name in ("catalog", "responses", "shared")
+        },
+        "mix": dict(Counter(name for name, _, _ in results)),
+    }
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"requests {report['requests']}  errors {report['errors']}  "
+          f"elapsed {report['seconds']}s  throughput {report['throughput_rps']} req/s")
+    print(f"latency  p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  max {latency['max']}ms")
+    memory = report["memory_mb"]
+    print(f"memory   rss {memory['rss_before']} -> {memory['rss_after']} MB (peak {memory['rss_peak']} MB)")
+    print(f"catalog  {report['catalog']['requests']} requests over "
+          f"{report['catalog']['connections_total']} connections")
+    print(f"model    {report['narrative']['calls']} narrative calls, "
+          f"{report['narrative']['avg_prompt_tokens']} prompt tokens per call")
+    print(f"caches   catalog hit ratio {report['caches']['catalog']['hit_ratio']}, "
+          f"responses hit ratio {report['caches']['responses']['hit_ratio']}")
+    shared = report["caches"]["shared"]
+    if shared:
+        print(f"shared   {shared['backend']} tier hit ratio {shared['hit_ratio']}, "
+              f"{shared['errors']} errors across {report['config']['workers']} workers")
+    print(f"{'scenario':<30}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}")
+    for name, stats in report["scenarios"].items():
+        print(f"{name:<30}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the chatbot service")
+    parser.add_argument("--products", type=int, default=10000, help="synthetic catalog size (100 - 100000)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="share of SSE requests")
+    parser.add_argument("--render", choices=["llm", "template", "hybrid"], default=None)
+    parser.add_argument("--router-latency", type=float, default=0.1, help="fake light-tier tool selection, seconds")
+    parser.add_argument("--select-latency", type=float, default=0.3, help="fake large-tier tool selection, seconds")
+    parser.add_argument("--narrative-latency", type=float, default=1.0, help="fake narrative call, seconds")
+    parser.add_argument("--stream-chunks", type=int, default=8)
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- share applied to fake latencies")
+    parser.add_argument("--catalog-latency", type=float, default=0.005, help="stub catalog time per request")
+    parser.add_argument("--no-index", dest="index", action="store_false", help="disable the local product index")
+    parser.add_argument("--no-response-cache", dest="response_cache", action="store_false")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the per-IP rate limit (all requests share one IP)")
+    parser.add_argument("--no-rules", dest="rules", action="store_false", help="disable the local intent rules")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the request stream")
+    parser.add_argument("--shared-cache", choices=["none", "local", "redis"], default=None,
+                        help="cache tier shared by the workers (default: local with several workers)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    port = free_port()
+    stub = multiprocessing.Process(
+        target=serve_stub, args=(port, args.products, args.seed, args.catalog_latency), daemon=True,
+    )
+    stub.start()
+    scratch = tempfile.TemporaryDirectory(prefix="chatbot-benchmark-")
+    try:
+        wait_for_port(port)
+        # Server reads its configuration at import time
+        os.environ["API_GATEWAY_URL"] = f"http://127.0.0.1:{port}{GATEWAY_PREFIX}"
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+        # Always index the generated catalog, never a snapshot left by an earlier run
+        os.environ.setdefault("CATALOG_SNAPSHOT_PATH", "")
+        # Every simulated shopper shares one address; limit only when asked to
+        if not args.rate_limit:
+            os.environ.setdefault("RATE_LIMIT_IP_BURST", str(10 ** 9))
+        if not args.rules:
+            os.environ["ROUTER_RULES"] = "0"
+        if not args.response_cache:
+            os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+        # Server picks its default shared tier from the worker count
+        os.environ["WEB_CONCURRENCY"] = str(args.workers)
+        os.environ.setdefault("SHARED_CACHE_PATH", os.path.join(scratch.name, "shared-cache.sqlite"))
+        if args.shared_cache:
+            os.environ["SHARED_CACHE_BACKEND"] = args.shared_cache
+        if args.workers > 1:
+            measurements, catalog = run_workers(args, port)
+        else:
+            measurement = asyncio.run(run(args, port))
+            measurements, catalog = [measurement], measurement["catalog"]
+        report = build_report(args, measurements, catalog)
+    finally:
+        stub.terminate()
+        stub.join()
+        scratch.cleanup()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
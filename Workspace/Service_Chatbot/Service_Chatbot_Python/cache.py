@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CATALOG_CACHE_MAX_ENTRIES", "1024"))
+CACHE_DEFAULT_TTL = float(os.environ.get("CATALOG_CACHE_DEFAULT_TTL", "60"))
+# How long past expiry an entry may still be served while it is refreshed in the background
+CACHE_STALE_TTL = float(os.environ.get("CATALOG_CACHE_STALE_TTL", "300"))
+
+# Per-endpoint TTLs in seconds, matched by longest path prefix
+ENDPOINT_TTLS = {
+    "/categories": 3600,
+    "/collections": 3600,
+    "/products/bestselling": 900,
+    "/products/new-arrivals": 600,
+    "/products/category": 300,
+    "/products/price": 120,
+    "/products": 120,
+}
+
+
+def make_key(endpoint, params=None):
+    if not params:
+        return endpoint
+    query = "&".join(f"{k}={params[k]}" for k in sorted(params))
+    return f"{endpoint}?{query}"
+
+
+def under_prefix(key, prefix):
+    """key is the endpoint prefix itself or lies below it: "/products" covers "/products/1"
+    and "/products?page=2" but not "/products-sale"."""
+    return key == prefix or key.startswith(prefix.rstrip("/") + "/") or key.startswith(prefix + "?")
+
+
+def ttl_for(endpoint):
+    path = endpoint.split("?", 1)[0]
+    best = None
+    for prefix in ENDPOINT_TTLS:
+        if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return ENDPOINT_TTLS[best] if best else CACHE_DEFAULT_TTL
+
+
+class TTLCache:
+    """LRU-bounded TTL cache that serves stale entries while refreshing them in the background.
+
+    With a shared tier (see shared_cache.py), misses are looked up there before loading,
+    and loaded values are shared with the other workers.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, stale_ttl=CACHE_STALE_TTL, shared=None, namespace="catalog"):
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        self.namespace = namespace
+        if shared is not None:
+            shared.watch(namespace, self._shared_invalidation)
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._refreshing = {}  # key -> background refresh task
+        # Bumped by every invalidation; a load that started before one must not store what it read
+        self._epoch = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refresh_failures = 0
+
+    async def get_or_load(self, key, loader, ttl):
+        """(value, seconds it stays fresh) for key, awaiting loader() on a miss.
+
+        A stale hit is already past its TTL, so it reports 0 seconds left.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value, expires_at - now
+            if now < expires_at + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.create_task(self._refresh(key, loader, ttl))
+                return value, 0.0
+            del self._entries[key]
+        return await self._load(key, loader, ttl)
+
+    async def _load(self, key, loader, ttl, lookup=True):
+        # lookup=False for background refreshes, which are not counted as lookups
+        epoch = self._epoch
+        if self.shared is not None:
+            shared = await self.shared.get(self.namespace, key)
+            if shared is not None:
+                # Expires when the other worker's copy does
+                value, remaining = shared[0], shared[1]
+                self.shared_hits += lookup
+                if epoch == self._epoch:
+                    self.set(key, value, remaining)
+                return value, remaining
+        self.misses += lookup
+
+        value = await loader()
+        if epoch != self._epoch:
+            # Read before a catalog change: good for this caller, not for the cache
+            return value, 0.0
+        if value is not None:
+            self.set(key, value, ttl)
+            if self.shared is not None:
+                # Keys start with the endpoint, so endpoint prefixes invalidate them
+                await self.shared.set(self.namespace, key, value, ttl, endpoints=(key,))
+        return value, ttl
+
+    async def _refresh(self, key, loader, ttl):
+        try:
+            # Another worker may already have refreshed the shared copy
+            value, _ = await self._load(key, loader, ttl, lookup=False)
+            if value is None:
+                self.refresh_failures += 1
+        except Exception as e:
+            self.refresh_failures += 1
+            logger.error(f"Background refresh failed for {key}: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def set(self, key, value, ttl):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _shared_invalidation(self, endpoint_prefix, tag):
+        # Catalog results carry no tags
+        if tag is None:
+            self.invalidate(endpoint_prefix)
+
+    def invalidate(self, prefix=None):
+        """Drop entries from this worker; the shared tier is invalidated separately."""
+        self._epoch += 1
+        if prefix is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        keys = [k for k in self._entries if under_prefix(k, prefix)]
+        for k in keys:
+            del self._entries[k]
+        return len(keys)
+
+    def stats(self):
+        size = len(self._entries)
+        lookups = self.hits + self.stale_hits + self.shared_hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refresh_failures": self.refresh_failures,
+            "hit_ratio": round((self.hits + self.stale_hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+        }
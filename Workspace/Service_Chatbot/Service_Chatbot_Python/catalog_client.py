@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+import ijson
+
+logger = logging.getLogger(__name__)
+
+# Connection pool sizing (shared by every in-flight chat on this worker)
+POOL_MAX_CONNECTIONS = int(os.environ.get("CATALOG_POOL_MAX_CONNECTIONS", "64"))
+POOL_MAX_KEEPALIVE = int(os.environ.get("CATALOG_POOL_MAX_KEEPALIVE", "32"))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("CATALOG_POOL_KEEPALIVE_EXPIRY", "30"))
+# Max time to wait for a free connection from the pool
+POOL_TIMEOUT = float(os.environ.get("CATALOG_POOL_TIMEOUT", "2.0"))
+
+# Default (connect, read) timeouts in seconds
+CONNECT_TIMEOUT = float(os.environ.get("CATALOG_CONNECT_TIMEOUT", "1.0"))
+READ_TIMEOUT = float(os.environ.get("CATALOG_READ_TIMEOUT", "5.0"))
+
+# Retry budget for idempotent calls
+MAX_RETRIES = int(os.environ.get("CATALOG_MAX_RETRIES", "2"))
+BACKOFF_FACTOR = float(os.environ.get("CATALOG_BACKOFF_FACTOR", "0.2"))
+# Floor for an attempt's timeouts when a tight caller budget is split across the retries
+MIN_ATTEMPT_TIMEOUT = float(os.environ.get("CATALOG_MIN_ATTEMPT_TIMEOUT", "0.5"))
+RETRY_STATUSES = (502, 503, 504)
+
+# Circuit breaker: open after N consecutive failures, probe again after a cool-down
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CATALOG_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("CATALOG_BREAKER_RESET_TIMEOUT", "30"))
+
+# Per-endpoint (connect, read) timeouts, matched by longest path prefix.
+# Full list endpoints serialize the whole catalog so they get a longer read budget; calls made
+# for a tool are cut down to fit its timeout (see CatalogClient.timeout_for).
+ENDPOINT_TIMEOUTS = {
+    "/products": (CONNECT_TIMEOUT, 10.0),
+    "/products/bestselling": (CONNECT_TIMEOUT, READ_TIMEOUT),
+    "/products/new-arrivals": (CONNECT_TIMEOUT, READ_TIMEOUT),
+    "/products/category": (CONNECT_TIMEOUT, 8.0),
+    "/products/price": (CONNECT_TIMEOUT, 8.0),
+    "/categories": (CONNECT_TIMEOUT, 3.0),
+    "/collections": (CONNECT_TIMEOUT, 3.0),
+}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class _StreamReader:
+    """Async file-like view over a streamed httpx response body, for ijson."""
+
+    def __init__(self, response):
+        self._chunks = response.aiter_bytes()
+
+    async def read(self, size=-1):
+        if size == 0:
+            return b""
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures, half-open after the reset timeout."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow_request(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let a single probe through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+        if self.state == self.HALF_OPEN:
+            # A probe is already in flight
+            return False
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def end_probe(self):
+        """Called when a probe finishes; one that neither succeeded nor failed (cancelled, bad body) reopens."""
+        if self.state == self.HALF_OPEN:
+            self.record_failure()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Catalog circuit opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class CatalogClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.breaker = CircuitBreaker()
+        self.client = None
+
+    async def start(self):
+        # Created inside the serving event loop so the pool is bound to it
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(
+                max_connections=POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT),
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def timeout_for(self, endpoint, budget=None, attempts=1):
+        """Timeouts for one attempt; with a budget, every attempt and the backoff between them fit in it."""
+        path = endpoint.split("?", 1)[0]
+        best = None
+        for prefix in ENDPOINT_TIMEOUTS:
+            if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        connect, read = ENDPOINT_TIMEOUTS[best] if best else (CONNECT_TIMEOUT, READ_TIMEOUT)
+        if budget is None:
+            return httpx.Timeout(read, connect=connect, pool=POOL_TIMEOUT)
+        # Otherwise one slow attempt uses up the caller's budget and the retries never run
+        backoff = sum(BACKOFF_FACTOR * (2 ** (attempt - 1)) for attempt in range(1, attempts))
+        # A tenth of the budget is left for decoding and the tool's own work
+        per_attempt = max(MIN_ATTEMPT_TIMEOUT, (budget * 0.9 - backoff) / attempts)
+        connect = min(connect, per_attempt / 2)
+        read = min(read, per_attempt - connect)
+        return httpx.Timeout(read, connect=connect, pool=min(POOL_TIMEOUT, per_attempt))
+
+    async def request(self, endpoint, method="GET", params=None, data=None, max_items=None, budget=None):
+        """Call the catalog and return the decoded JSON body.
+
+        With max_items set, the body must be a JSON array; it is parsed incrementally
+        and the download stops after max_items elements. budget is the time in seconds
+        the caller waits for the call, retries included (e.g. its tool timeout).
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"Catalog circuit is open, skipping {method} {endpoint}")
+        probe = self.breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            return await self._send(endpoint, method, params, data, max_items, budget)
+        finally:
+            if probe:
+                # Callers' timeouts cancel slow probes; the breaker must not stay half-open for good
+                self.breaker.end_probe()
+
+    async def _send(self, endpoint, method, params, data, max_items, budget):
+        # Only idempotent calls get retried
+        attempts = 1 + (MAX_RETRIES if method == "GET" else 0)
+        timeout = self.timeout_for(endpoint, budget, attempts)
+
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(BACKOFF_FACTOR * (2 ** (attempt - 1)))
+            try:
+                http_request = self.client.build_request(method, endpoint, params=params, json=data, timeout=timeout)
+                response = await self.client.send(http_request, stream=True)
+            except httpx.TransportError:
+                if attempt + 1 < attempts:
+                    continue
+                self.breaker.record_failure()
+                raise
+
+            if response.status_code in RETRY_STATUSES and attempt + 1 < attempts:
+                await response.aclose()
+                continue
+            break
+
+        try:
+            # 5xx means the gateway or catalog is unhealthy; 4xx is a caller problem
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            response.raise_for_status()
+            if max_items is None:
+                await response.aread()
+                return response.json()
+            return await self._read_items(response, max_items)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        finally:
+            await response.aclose()
+
+    async def _read_items(self, response, max_items):
+        items = []
+        if max_items <= 0:
+            return items
+        async for item in ijson.items(_StreamReader(response), "item", use_float=True):
+            items.append(item)
+            if len(items) >= max_items:
+                break
+        return items
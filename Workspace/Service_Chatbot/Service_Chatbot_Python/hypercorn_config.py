@@ -0,0 +1,50 @@
+import os
+import glob
+import logging
+
+# Hypercorn settings for the chatbot service.
+# Run with: hypercorn --config python:hypercorn_config Server:app
+bind = [f"0.0.0.0:{os.environ.get('PORT', '5000')}"]
+
+
+def _cpu_count():
+    # Cores this process may run on, which a container's cpuset can narrow
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Worker processes: a number, or "auto" for one per available core. With several workers,
+# catalog results and answers are shared through SHARED_CACHE_BACKEND (see shared_cache.py).
+_concurrency = os.environ.get("WEB_CONCURRENCY", "1")
+workers = _cpu_count() if _concurrency == "auto" else int(_concurrency)
+worker_class = os.environ.get("HYPERCORN_WORKER_CLASS", "asyncio")
+
+# Keep gateway connections alive between chats
+keep_alive_timeout = float(os.environ.get("KEEP_ALIVE_TIMEOUT", "75"))
+backlog = int(os.environ.get("BACKLOG", "2048"))
+graceful_timeout = float(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+accesslog = "-"
+errorlog = "-"
+
+# Workers write their metrics to PROMETHEUS_MULTIPROC_DIR and /metrics sums them. Files
+# left by a previous run would be counted again, so the directory starts empty.
+_metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if _metrics_dir:
+    os.makedirs(_metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(_metrics_dir, "*.db")):
+        os.remove(path)
+elif workers > 1:
+    logging.getLogger(__name__).warning(
+        f"WEB_CONCURRENCY={workers} without PROMETHEUS_MULTIPROC_DIR: "
+        "each /metrics scrape reports only the worker that answers it"
+    )
+
+# Sessions kept per worker lose their history whenever a follow-up lands on another worker
+if workers > 1 and os.environ.get("SESSION_BACKEND") == "memory":
+    logging.getLogger(__name__).warning(
+        f"WEB_CONCURRENCY={workers} with SESSION_BACKEND=memory: "
+        "follow-up questions lose their history when another worker answers them"
+    )
@@ -0,0 +1,571 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import unicodedata
+from datetime import datetime
+from bisect import bisect_left, bisect_right
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+# Attributes kept per product in the local index
+PRODUCT_INDEX_FIELDS = "id,name,description,price,material,color,goldKarat,categoryId,collectionId,quantity,updatedAt"
+
+# Incremental refresh cadence, and how often to rebuild from a full snapshot anyway
+# (the change feed keeps the index current; rebuilds only catch hard deletes)
+INDEX_REFRESH_SECONDS = float(os.environ.get("PRODUCT_INDEX_REFRESH_SECONDS", "60"))
+INDEX_FULL_REBUILD_SECONDS = float(os.environ.get("PRODUCT_INDEX_FULL_REBUILD_SECONDS", "21600"))
+# Page size of the full snapshot fetch
+INDEX_SNAPSHOT_PAGE = int(os.environ.get("PRODUCT_INDEX_SNAPSHOT_PAGE", "1000"))
+# Page size of the change feed; past INDEX_CHANGES_MAX changes a rebuild is cheaper
+INDEX_CHANGES_PAGE = int(os.environ.get("PRODUCT_INDEX_CHANGES_PAGE", "200"))
+INDEX_CHANGES_MAX = int(os.environ.get("PRODUCT_INDEX_CHANGES_MAX", "5000"))
+
+# Ranked lists kept with the index, and how many products of each; categories and
+# collections are refreshed with them
+INDEX_LISTS = {
+    "bestselling": "/products/bestselling",
+    "new_arrivals": "/products/new-arrivals",
+}
+INDEX_LIST_SIZE = int(os.environ.get("PRODUCT_INDEX_LIST_SIZE", "20"))
+INDEX_LISTS_REFRESH_SECONDS = float(os.environ.get("PRODUCT_INDEX_LISTS_REFRESH_SECONDS", "300"))
+
+# On-disk copy of the index (msgpack) so a restarted worker is warm at once; empty = off
+CATALOG_SNAPSHOT_PATH = os.environ.get("CATALOG_SNAPSHOT_PATH", "/tmp/chatbot-catalog.msgpack")
+# Older snapshots are ignored and the index is rebuilt from the catalog
+CATALOG_SNAPSHOT_MAX_AGE = float(os.environ.get("CATALOG_SNAPSHOT_MAX_AGE", "86400"))
+# Minimum time between two snapshot writes after incremental changes
+CATALOG_SNAPSHOT_SAVE_SECONDS = float(os.environ.get("CATALOG_SNAPSHOT_SAVE_SECONDS", "300"))
+SNAPSHOT_FORMAT = 1
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Gold karat as written in queries: "18k", "24K"
+_KARAT_RE = re.compile(r"(\d{1,2})k")
+
+# Very common words that would make full-text postings useless
+_STOP_WORDS = {"va", "cua", "cho", "la", "voi", "cac", "nhung", "mot", "duoc", "the", "and"}
+
+
+def fold_text(text):
+    """Lowercase and strip Vietnamese diacritics: "Nhẫn Vàng" -> "nhan vang"."""
+    if not text:
+        return ""
+    text = str(text).replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.lower()
+
+
+def _timestamp(value):
+    # The catalog serializes Instants as ISO-8601 strings (or epoch numbers)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(fold_text(text)) if token not in _STOP_WORDS]
+
+
+class ProductIndex:
+    """In-memory catalog snapshot with price, attribute and full-text indexes."""
+
+    def __init__(self):
+        self.products = {}  # id -> product dict
+        self.categories = []
+        self.collections = []
+        self.ready = False
+        self.built_at = 0.0
+        self.updated_watermark = 0.0  # newest updatedAt seen, as epoch seconds
+        # (updatedAt as sent by the catalog, id) of the newest change: the change feed position
+        self.cursor = None
+        self.lists = {}  # name -> ranked product ids, e.g. bestselling
+        self.lists_at = 0.0
+
+        self._by_material = {}  # token -> set(ids)
+        self._by_color = {}
+        self._by_karat = {}  # int -> set(ids)
+        self._by_category = {}
+        self._by_collection = {}
+        self._text = {}  # token -> set(ids) over name + description
+
+        # Sorted price array; rebuilt after each upsert batch
+        self._prices = []
+        self._price_ids = []
+        self._prices_dirty = True
+
+    # ---- building ----
+
+    def build(self, products, categories=None, collections=None, lists=None):
+        self.products = {}
+        for index in (self._by_material, self._by_color, self._by_karat,
+                      self._by_category, self._by_collection, self._text):
+            index.clear()
+        self.updated_watermark = 0.0
+        self.cursor = None
+        self.upsert(products)
+        if categories is not None:
+            self.categories = categories
+        if collections is not None:
+            self.collections = collections
+        if lists is not None:
+            self.set_lists(lists)
+        self.ready = True
+        self.built_at = time.time()
+
+    def set_lists(self, lists):
+        """Ranked lists as returned by the catalog; only the ids are kept, products come from the index."""
+        for name, products in lists.items():
+            self.lists[name] = [p.get("id") for p in products if p.get("id") is not None]
+        self.lists_at = time.time()
+
+    def upsert(self, products):
+        for product in products:
+            product_id = product.get("id")
+            if product_id is None:
+                continue
+            self.remove(product_id)
+            updated = _timestamp(product.get("updatedAt"))
+            if self.cursor is None or (updated, product_id) > (self.updated_watermark, self.cursor[1]):
+                self.cursor = (product.get("updatedAt"), product_id)
+            self.updated_watermark = max(self.updated_watermark, updated)
+            # Deleted products are kept in the catalog with a negative quantity
+            if (product.get("quantity") or 0) < 0:
+                continue
+            self.products[product_id] = product
+            self._add_postings(product_id, product)
+        self._prices_dirty = True
+        self._ensure_prices()
+
+    def remove(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return
+        for index, keys in self._postings(product):
+            for key in keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del index[key]
+        self._prices_dirty = True
+
+    def _postings(self, product):
+        karat = product.get("goldKarat")
+        yield self._by_material, tokenize(product.get("material"))
+        yield self._by_color, tokenize(product.get("color"))
+        yield self._by_karat, [karat] if karat is not None else []
+        yield self._by_category, [product.get("categoryId")] if product.get("categoryId") is not None else []
+        yield self._by_collection, [product.get("collectionId")] if product.get("collectionId") is not None else []
+        yield self._text, tokenize(f"{product.get('name', '')} {product.get('description', '')}")
+
+    def _add_postings(self, product_id, product):
+        for index, keys in self._postings(product):
+            for key in keys:
+                index.setdefault(key, set()).add(product_id)
+
+    def _ensure_prices(self):
+        if not self._prices_dirty:
+            return
+        pairs = sorted(
+            (float(p["price"]), pid) for pid, p in self.products.items() if p.get("price") is not None
+        )
+        self._prices = [price for price, _ in pairs]
+        self._price_ids = [pid for _, pid in pairs]
+        self._prices_dirty = False
+
+    # ---- queries ----
+
+    def ranked(self, name, limit=None):
+        """Products of a ranked list (bestselling, new_arrivals) with their current data."""
+        return self._materialize(self.lists.get(name, ()), limit)
+
+    def _materialize(self, ids, limit):
+        products = [self.products[pid] for pid in ids if pid in self.products]
+        return products[:limit] if limit else products
+
+    @staticmethod
+    def _intersect(postings, limit=None):
+        """Ids present in every posting; walks the smallest one and stops once limit ids match."""
+        if not postings or any(not ids for ids in postings):
+            return []
+        postings = sorted(postings, key=len)
+        smallest, rest = postings[0], postings[1:]
+        matches = []
+        for pid in smallest:
+            if all(pid in ids for ids in rest):
+                matches.append(pid)
+                if limit and len(matches) >= limit:
+                    break
+        return sorted(matches)
+
+    def price_range(self, min_price, max_price, limit=None, category_id=None):
+        """Products with min_price <= price <= max_price, cheapest first."""
+        self._ensure_prices()
+        lo = bisect_left(self._prices, float(min_price))
+        hi = bisect_right(self._prices, float(max_price))
+        if category_id is None:
+            return self._materialize(self._price_ids[lo:hi if not limit else min(hi, lo + limit)], limit)
+        allowed = self._by_category.get(category_id, set())
+        ids = []
+        for pid in self._price_ids[lo:hi]:
+            if pid in allowed:
+                ids.append(pid)
+                if limit and len(ids) >= limit:
+                    break
+        return self._materialize(ids, limit)
+
+    def by_material(self, material, category_id=None, limit=None):
+        """Products matching every word of material (diacritics-insensitive).
+
+        Karat words ("18k") match the gold karat and other words the material or colour,
+        so "vàng trắng 18k" finds white gold at 18 karat.
+        """
+        tokens = tokenize(material)
+        if not tokens:
+            return []
+        scope = [self._by_category.get(category_id, set())] if category_id is not None else []
+        postings = []
+        for token in tokens:
+            karat = _KARAT_RE.fullmatch(token)
+            if karat:
+                postings.append(self._by_karat.get(int(karat.group(1)), set()))
+            else:
+                postings.append(self._by_material.get(token, set()) | self._by_color.get(token, set()))
+        ids = self._intersect(postings + scope, limit)
+        if not ids:
+            # Materials such as "kim cương" often only appear in the name or description
+            return self.search(material, category_id=category_id, limit=limit, match_all=True)
+        return self._materialize(ids, limit)
+
+    def by_category(self, category_id, limit=None):
+        return self._materialize(sorted(self._by_category.get(category_id, set())), limit)
+
+    def by_collection(self, collection_id, limit=None):
+        return self._materialize(sorted(self._by_collection.get(collection_id, set())), limit)
+
+    def search(self, text, category_id=None, limit=None, match_all=False):
+        """Rank products by how many query words appear in their name or description.
+
+        Candidates come from the rarest word's postings (the most selective word);
+        other matches only top up the result when that is not enough. With match_all,
+        only products containing every word are returned.
+        """
+        tokens = set(tokenize(text))
+        scope = [self._by_category.get(category_id, set())] if category_id is not None else []
+        if match_all:
+            return self._materialize(self._intersect([self._text.get(token, set()) for token in tokens] + scope, limit), limit)
+        postings = sorted((self._text[token] for token in tokens if token in self._text), key=len)
+        if not postings:
+            return []
+        allowed = scope[0] if scope else None
+        ranked = sorted(
+            (pid for pid in postings[0] if allowed is None or pid in allowed),
+            key=lambda pid: (-sum(pid in ids for ids in postings), pid),
+        )
+        seen = set(ranked)
+        for ids in postings[1:]:
+            if limit and len(ranked) >= limit:
+                break
+            for pid in ids:
+                if pid not in seen and (allowed is None or pid in allowed):
+                    seen.add(pid)
+                    ranked.append(pid)
+                    if limit and len(ranked) >= limit:
+                        break
+        return self._materialize(ranked, limit)
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "products": len(self.products),
+            "categories": len(self.categories),
+            "collections": len(self.collections),
+            "built_at": self.built_at,
+            "updated_watermark": self.updated_watermark,
+            "lists": {name: len(ids) for name, ids in self.lists.items()},
+        }
+
+    # ---- persistence ----
+
+    def to_snapshot(self):
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": time.time(),
+            "built_at": self.built_at,
+            "products": list(self.products.values()),
+            "categories": self.categories,
+            "collections": self.collections,
+            "lists": self.lists,
+            "lists_at": self.lists_at,
+        }
+
+    def restore(self, snapshot):
+        self.build(snapshot["products"], snapshot["categories"], snapshot["collections"])
+        self.lists = snapshot["lists"]
+        self.lists_at = snapshot["lists_at"]
+        # Keep the original build time so full rebuilds stay on schedule across restarts
+        self.built_at = snapshot["built_at"]
+
+
+def save_snapshot(path, snapshot):
+    # Written beside the target and renamed, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        msgpack.pack(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, max_age=CATALOG_SNAPSHOT_MAX_AGE):
+    """The snapshot at path, or None if missing, unreadable, from another format or too old."""
+    try:
+        with open(path, "rb") as f:
+            snapshot = msgpack.unpack(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, msgpack.UnpackException) as e:
+        logger.warning(f"Ignoring unreadable catalog snapshot {path}: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+        return None
+    if time.time() - snapshot.get("saved_at", 0) > max_age:
+        logger.info(f"Ignoring catalog snapshot {path} older than {max_age:.0f}s")
+        return None
+    return snapshot
+
+
+class ProductIndexSync:
+    """Keeps a ProductIndex in sync with the catalog.
+
+    Startup restores the on-disk snapshot when there is a recent one, otherwise pulls the
+    catalog in pages; after that the change feed applies only what changed.
+    """
+
+    def __init__(self, index, fetch, on_change=None, snapshot_path=CATALOG_SNAPSHOT_PATH):
+        # fetch(endpoint, params=None) -> decoded JSON or None
+        self.index = index
+        self.fetch = fetch
+        # Called after the indexed data changed, e.g. to drop answers built from it
+        self.on_change = on_change
+        self.snapshot_path = snapshot_path
+        self.source = None  # "snapshot" or "catalog": where the current data came from
+        self.saved_at = 0.0
+        self._dirty = False
+        self._task = None
+        self._wake = asyncio.Event()
+
+    @property
+    def warm(self):
+        """Products are loaded; categories, collections and ranked lists missing from the index come from the catalog."""
+        return self.index.ready
+
+    @property
+    def lists_missing(self):
+        """A ranked list, the categories or the collections failed to load; retried on every refresh."""
+        index = self.index
+        return not index.categories or not index.collections or any(name not in index.lists for name in INDEX_LISTS)
+
+    async def fetch_products(self):
+        """Every product, fetched in pages; None if the catalog is unavailable."""
+        products = []
+        seen = set()
+        page = 0
+        while True:
+            batch = await self.fetch("/products", params={
+                "limit": INDEX_SNAPSHOT_PAGE,
+                "page": page,
+                "sort": "id,asc",
+                "fields": PRODUCT_INDEX_FIELDS,
+            })
+            if batch is None:
+                return None
+            if batch and batch[0].get("id") in seen:
+                # A catalog without paging keeps returning the first page
+                logger.warning("Catalog ignores ?page, fetching the product list in one request")
+                return await self.fetch("/products", params={"fields": PRODUCT_INDEX_FIELDS})
+            products.extend(batch)
+            seen.update(p.get("id") for p in batch)
+            if len(batch) < INDEX_SNAPSHOT_PAGE:
+                return products
+            page += 1
+
+    async def fetch_lists(self):
+        names = list(INDEX_LISTS)
+        results = await asyncio.gather(*(
+            self.fetch(INDEX_LISTS[name], params={"limit": INDEX_LIST_SIZE, "fields": PRODUCT_INDEX_FIELDS})
+            for name in names
+        ))
+        return {name: result for name, result in zip(names, results) if result is not None}
+
+    async def fetch_changes(self):
+        """Products changed since the index cursor, oldest first; None if the feed is unavailable."""
+        since, after_id = self.index.cursor or (None, 0)
+        changes = []
+        while len(changes) < INDEX_CHANGES_MAX:
+            batch = await self.fetch("/products/changes", params={
+                "since": since if since is not None else 0,
+                "afterId": after_id,
+                "limit": INDEX_CHANGES_PAGE,
+                "fields": PRODUCT_INDEX_FIELDS,
+            })
+            if batch is None:
+                return None
+            changes.extend(batch)
+            if len(batch) < INDEX_CHANGES_PAGE:
+                break
+            since, after_id = batch[-1].get("updatedAt"), batch[-1].get("id")
+        return changes
+
+    async def fetch_recent(self):
+        """Fallback for catalogs without the change feed: the most recently updated page."""
+        changed = await self.fetch("/products", params={
+            "sort": "updatedAt,desc",
+            "limit": INDEX_CHANGES_PAGE,
+            "fields": PRODUCT_INDEX_FIELDS,
+        })
+        if changed is None:
+            return None
+        watermark = self.index.updated_watermark
+        return [p for p in changed if _timestamp(p.get("updatedAt")) > watermark]
+
+    async def restore(self):
+        """Load the on-disk snapshot; True if the index is now serving from it."""
+        if not self.snapshot_path:
+            return False
+        snapshot = await asyncio.to_thread(load_snapshot, self.snapshot_path)
+        if snapshot is None:
+            return False
+        self.index.restore(snapshot)
+        self.source = "snapshot"
+        self.saved_at = snapshot["saved_at"]
+        logger.info(f"Product index restored from {self.snapshot_path} with {len(self.index.products)} products")
+        if self.on_change:
+            self.on_change()
+        return True
+
+    async def save(self):
+        if not self.snapshot_path:
+            return
+        try:
+            await asyncio.to_thread(save_snapshot, self.snapshot_path, self.index.to_snapshot())
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Failed to save the catalog snapshot to {self.snapshot_path}: {e}")
+            return
+        self.saved_at = time.time()
+        self._dirty = False
+
+    async def rebuild(self):
+        products, categories, collections, lists = await asyncio.gather(
+            self.fetch_products(),
+            self.fetch("/categories"),
+            self.fetch("/collections"),
+            self.fetch_lists(),
+        )
+        if products is None:
+            logger.warning("Product index rebuild skipped: catalog unavailable")
+            return False
+        self.index.build(products, categories, collections, lists)
+        self.source = "catalog"
+        logger.info(f"Product index built with {len(self.index.products)} products")
+        if self.on_change:
+            self.on_change()
+        await self.save()
+        return True
+
+    async def refresh(self):
+        """Apply products changed since the last refresh; fall back to a rebuild if too many changed."""
+        changed = await self.fetch_changes()
+        limit = INDEX_CHANGES_MAX
+        if changed is None:
+            # A full page of recent changes may hide older ones
+            changed = await self.fetch_recent()
+            limit = INDEX_CHANGES_PAGE
+        if changed is None:
+            return False
+        if len(changed) >= limit:
+            return await self.rebuild()
+
+        updated = bool(changed)
+        if changed:
+            self.index.upsert(changed)
+            logger.info(f"Product index refreshed {len(changed)} products")
+        if self.lists_missing or time.time() - self.index.lists_at >= INDEX_LISTS_REFRESH_SECONDS:
+            lists, categories, collections = await asyncio.gather(
+                self.fetch_lists(), self.fetch("/categories"), self.fetch("/collections"),
+            )
+            if lists:
+                updated = updated or any(self.index.lists.get(name) != [p.get("id") for p in products]
+                                         for name, products in lists.items())
+                self.index.set_lists(lists)
+            # New or renamed categories and collections must not wait for the next rebuild
+            if categories is not None and categories != self.index.categories:
+                self.index.categories = categories
+                updated = True
+            if collections is not None and collections != self.index.collections:
+                self.index.collections = collections
+                updated = True
+        if updated:
+            self._dirty = True
+            if self.on_change:
+                self.on_change()
+        if self._dirty and time.time() - self.saved_at >= CATALOG_SNAPSHOT_SAVE_SECONDS:
+            await self.save()
+        return True
+
+    async def run(self):
+        # A recent snapshot makes the worker ready before the catalog answers; the first
+        # refresh below then catches up through the change feed
+        if not self.index.ready:
+            await self.restore()
+        while True:
+            try:
+                if not self.index.ready or time.time() - self.index.built_at >= INDEX_FULL_REBUILD_SECONDS:
+                    await self.rebuild()
+                else:
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Product index sync failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wake.wait(), INDEX_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def refresh_soon(self):
+        """Refresh now rather than at the next tick, ranked lists, categories and collections included."""
+        self.index.lists_at = 0.0
+        self._wake.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._dirty:
+            await self.save()
+
+    def stats(self):
+        return {
+            **self.index.stats(),
+            "warm": self.warm,
+            "lists_missing": self.lists_missing,
+            "source": self.source,
+            "cursor": self.index.cursor,
+            "snapshot_path": self.snapshot_path or None,
+            "snapshot_saved_at": self.saved_at,
+        }
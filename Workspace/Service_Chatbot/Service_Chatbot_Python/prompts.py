@@ -0,0 +1,247 @@
+import os
+import re
+import asyncio
+import logging
+import datetime
+from sessions import estimate_tokens
+from templates import format_price
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the facts of one narrative prompt; descriptions shrink first, then the tail of long lists
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "450"))
+# Longest description kept per product while the budget allows
+PROMPT_DESCRIPTION_CHARS = int(os.environ.get("PROMPT_DESCRIPTION_CHARS", "90"))
+# Below this a description is dropped rather than cut to a stub
+PROMPT_MIN_DESCRIPTION_CHARS = 24
+
+# Explicit Gemini context cache for the static narrative instructions, in seconds (0 = off).
+# Gemini only caches prefixes above a model-specific minimum size; below it creation fails
+# and the plain model is kept. Implicit prefix caching applies either way, since the static
+# text always leads the request.
+NARRATIVE_CACHE_TTL = int(os.environ.get("NARRATIVE_CACHE_TTL", "0"))
+
+# Writing rules shared by every narrative answer. They live in the system instruction
+# (a stable, cacheable prefix) instead of being repeated in each grounding prompt.
+NARRATIVE_RULES = """
+Cách viết câu trả lời từ dữ liệu cửa hàng:
+- Chỉ dùng các dữ kiện được cung cấp; không bịa thêm sản phẩm, giá hay chất liệu.
+- Viết thành đoạn văn tự nhiên, thân thiện, chuyên nghiệp; không liệt kê dạng danh sách.
+- Nhắc sản phẩm bằng tên kèm ID (ví dụ: "Nhẫn Kim Cương (ID: 12)"), không dùng mã code.
+- Giữ nguyên giá như đã cho.
+- Không nhắc đến các bước tra cứu hay dữ liệu nội bộ.
+Định dạng dữ liệu: mỗi sản phẩm một dòng "#ID Tên | Giá | thuộc tính | mô tả".
+Dòng "Chung:" ghi các thuộc tính giống nhau của mọi sản phẩm trong nhóm.
+"""
+
+_SPACE_RE = re.compile(r"\s+")
+
+# Attributes worth a few tokens each, in order of usefulness to shoppers
+_ATTRIBUTES = (
+    ("material", "{}"),
+    ("goldKarat", "vàng {}"),
+    ("color", "màu {}"),
+    ("size", "cỡ {}"),
+)
+
+
+def compact(text):
+    """Collapse whitespace, including the indentation of triple-quoted templates."""
+    return _SPACE_RE.sub(" ", text or "").strip()
+
+
+def truncate(text, limit):
+    """Cut at a word boundary: "Nhẫn vàng trắng đính đá" (12) -> "Nhẫn vàng…"."""
+    text = compact(text)
+    if len(text) <= limit:
+        return text
+    if limit < PROMPT_MIN_DESCRIPTION_CHARS:
+        return ""
+    cut = text[:limit].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+def _attributes(product):
+    return {key: str(product[key]).strip() for key, _ in _ATTRIBUTES if product.get(key) not in (None, "")}
+
+
+def _attribute_text(attributes):
+    return ", ".join(fmt.format(attributes[key]) for key, fmt in _ATTRIBUTES if key in attributes)
+
+
+class Grounding:
+    """Facts and instructions for one narrative call, rendered compactly within a token budget.
+
+    Blocks keep their structure until render(), so answers merged from several tools can
+    drop products already listed and the budget applies to the whole prompt.
+    """
+
+    def __init__(self):
+        self.blocks = []  # (kind, intro, items)
+        self.instructions = []
+
+    def products(self, intro, products):
+        self.blocks.append(("products", intro, list(products)))
+        return self
+
+    def entries(self, intro, entries):
+        """Categories or collections: one "#ID Name: description" line each."""
+        self.blocks.append(("entries", intro, list(entries)))
+        return self
+
+    def detail(self, intro, product):
+        self.blocks.append(("detail", intro, [product]))
+        return self
+
+    def note(self, text):
+        self.blocks.append(("note", text, []))
+        return self
+
+    def instruct(self, text):
+        self.instructions.append(compact(text))
+        return self
+
+    @classmethod
+    def merge(cls, groundings, instruction=None):
+        merged = cls()
+        for grounding in groundings:
+            merged.blocks.extend(grounding.blocks)
+            merged.instructions.extend(grounding.instructions)
+        if instruction:
+            merged.instruct(instruction)
+        return merged
+
+    def __bool__(self):
+        return bool(self.blocks or self.instructions)
+
+    def __str__(self):
+        return self.render()
+
+    def render(self, budget=PROMPT_TOKEN_BUDGET):
+        blocks = self._dedupe()
+        description_chars = PROMPT_DESCRIPTION_CHARS
+        while True:
+            text = self._render(blocks, description_chars)
+            if estimate_tokens(text) <= budget:
+                return text
+            if description_chars:
+                description_chars = description_chars // 2 if description_chars // 2 >= PROMPT_MIN_DESCRIPTION_CHARS else 0
+                continue
+            # Lists are ordered by relevance; trim the longest one from its tail
+            longest = max((block for block in blocks if block[0] == "products"), key=lambda b: len(b[2]), default=None)
+            if longest is None or len(longest[2]) <= 1:
+                return text
+            longest[2].pop()
+
+    def _dedupe(self):
+        seen = set()
+        blocks = []
+        for kind, intro, items in self.blocks:
+            if kind == "products":
+                fresh = [p for p in items if p.get("id") is None or p.get("id") not in seen]
+                seen.update(p.get("id") for p in fresh)
+                if not fresh and items:
+                    # Every product was already listed by an earlier block
+                    intro = f"{intro} (các sản phẩm đã nêu ở trên)"
+                items = fresh
+            else:
+                items = list(items)
+            blocks.append((kind, intro, items))
+        return blocks
+
+    def _render(self, blocks, description_chars):
+        lines = []
+        for kind, intro, items in blocks:
+            lines.append(compact(intro))
+            if kind == "products":
+                lines.extend(self._product_lines(items, description_chars))
+            elif kind == "entries":
+                for entry in items:
+                    description = truncate(entry.get("description"), description_chars)
+                    lines.append(f"#{entry.get('id', '?')} {entry.get('name') or 'Không có tên'}"
+                                 + (f": {description}" if description else ""))
+            elif kind == "detail":
+                lines.append(self._detail_line(items[0]))
+        if self.instructions:
+            lines.append("Yêu cầu: " + " ".join(self.instructions))
+        return "\n".join(line for line in lines if line)
+
+    @staticmethod
+    def _product_lines(products, description_chars):
+        attributes = [_attributes(p) for p in products]
+        # Attributes identical across the block are written once
+        shared = {}
+        if len(products) > 1:
+            shared = {key: value for key, value in attributes[0].items()
+                      if all(attrs.get(key) == value for attrs in attributes[1:])}
+        lines = [f"Chung: {_attribute_text(shared)}"] if shared else []
+        for product, attrs in zip(products, attributes):
+            own = {key: value for key, value in attrs.items() if key not in shared}
+            fields = [f"#{product.get('id', '?')} {product.get('name') or 'Không tên'}", format_price(product.get("price"))]
+            if own:
+                fields.append(_attribute_text(own))
+            description = truncate(product.get("description"), description_chars)
+            if description:
+                fields.append(description)
+            lines.append(" | ".join(fields))
+        return lines
+
+    @staticmethod
+    def _detail_line(product):
+        # The one product the shopper asked about keeps its full description
+        attrs = _attributes(product)
+        fields = [f"#{product.get('id', '?')} {product.get('name') or 'Không tên'}", format_price(product.get("price"))]
+        if attrs:
+            fields.append(_attribute_text(attrs))
+        fields.append(compact(product.get("description")) or "Không có mô tả")
+        return " | ".join(fields)
+
+
+class NarrativeContextCache:
+    """Keeps the static narrative instructions in a Gemini context cache and renews it before expiry."""
+
+    def __init__(self, model_name, system_instruction, ttl=NARRATIVE_CACHE_TTL):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.cached = None
+        self._task = None
+
+    async def start(self):
+        """A GenerativeModel bound to the cache, or None when caching is off or unavailable."""
+        if self.ttl <= 0:
+            return None
+        from google.generativeai import caching, GenerativeModel
+
+        try:
+            self.cached = await asyncio.to_thread(
+                caching.CachedContent.create,
+                model=self.model_name if self.model_name.startswith("models/") else f"models/{self.model_name}",
+                system_instruction=self.system_instruction,
+                ttl=datetime.timedelta(seconds=self.ttl),
+            )
+        except Exception as e:
+            # Typically the instructions are below the model's minimum cacheable size
+            logger.warning(f"Narrative context cache unavailable, using the plain model: {e}")
+            return None
+        self._task = asyncio.create_task(self._renew())
+        logger.info(f"Narrative instructions cached as {self.cached.name} for {self.ttl}s")
+        return GenerativeModel.from_cached_content(self.cached)
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.ttl / 2)
+            try:
+                await asyncio.to_thread(self.cached.update, ttl=datetime.timedelta(seconds=self.ttl))
+            except Exception as e:
+                logger.error(f"Failed to renew the narrative context cache: {e}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self.cached is not None:
+            try:
+                await asyncio.to_thread(self.cached.delete)
+            except Exception as e:
+                logger.warning(f"Failed to delete the narrative context cache: {e}")
+            self.cached = None
@@ -0,0 +1,249 @@
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict
+from cache import under_prefix
+from product_index import fold_text
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+# TTL for answers that did not touch catalog data (plain model answers)
+RESPONSE_CACHE_DEFAULT_TTL = float(os.environ.get("RESPONSE_CACHE_DEFAULT_TTL", "900"))
+
+# Optional embedding-similarity tier behind the exact (normalized prompt) tier
+RESPONSE_CACHE_SEMANTIC = os.environ.get("RESPONSE_CACHE_SEMANTIC", "0") == "1"
+RESPONSE_CACHE_EMBEDDING_MODEL = os.environ.get("RESPONSE_CACHE_EMBEDDING_MODEL", "models/text-embedding-004")
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0.93"))
+# The similarity scan is linear, so the semantic tier only covers the most recent entries
+RESPONSE_CACHE_SEMANTIC_ENTRIES = int(os.environ.get("RESPONSE_CACHE_SEMANTIC_ENTRIES", "512"))
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+")
+
+# Catalog data used while answering the current chat turn
+current_turn = contextvars.ContextVar("current_turn", default=None)
+
+
+class TurnDeps:
+    """Catalog endpoints and data tags an answer was built from."""
+
+    def __init__(self):
+        self.endpoints = set()
+        self.tags = set()
+        self.ttl = None
+        self.failed = False
+
+    def use(self, endpoint=None, tag=None, ttl=None):
+        if endpoint:
+            self.endpoints.add(endpoint)
+        if tag:
+            self.tags.add(tag)
+        if ttl is not None:
+            self.ttl = ttl if self.ttl is None else min(self.ttl, ttl)
+
+
+def track_turn():
+    deps = TurnDeps()
+    current_turn.set(deps)
+    return deps
+
+
+def note_catalog_use(endpoint=None, tag=None, ttl=None, failed=False):
+    deps = current_turn.get()
+    if deps is not None:
+        deps.use(endpoint, tag, ttl)
+        if failed:
+            deps.failed = True
+
+
+def normalize_prompt(prompt):
+    """Fold case, Vietnamese diacritics, punctuation and whitespace: "Nhẫn  vàng?" -> "nhan vang"."""
+    text = fold_text(prompt)
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _nearest(vector, numbers, variant, candidates):
+    """Key of the most similar candidate at or above RESPONSE_CACHE_SIMILARITY, or None."""
+    best_key, best_score = None, RESPONSE_CACHE_SIMILARITY
+    for other_key, (other_vector, other_numbers, other_variant) in candidates:
+        # Prices and quantities must match exactly: "dưới 5 triệu" is not "dưới 3 triệu"
+        if other_numbers != numbers or other_variant != variant:
+            continue
+        score = sum(a * b for a, b in zip(vector, other_vector))
+        if score >= best_score:
+            best_key, best_score = other_key, score
+    return best_key
+
+
+class ResponseCache:
+    """Answers keyed by normalized prompt, with an optional embedding-similarity tier.
+
+    Exact matches are also kept in the shared tier when there is one, so an answer
+    rendered by one worker serves the others.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, semantic=RESPONSE_CACHE_SEMANTIC, shared=None):
+        self.max_entries = max_entries
+        self.semantic = semantic
+        # RESPONSE_CACHE_MAX_ENTRIES=0 turns answer caching off on every tier
+        self.shared = shared if max_entries > 0 else None
+        if self.shared is not None:
+            self.shared.watch("responses", lambda endpoint_prefix, tag: self.invalidate(endpoint_prefix, tag))
+        # key -> (payload, expires_at, endpoints, tags)
+        self._entries = OrderedDict()
+        # key -> (unit embedding, numbers in the prompt, variant)
+        self._vectors = OrderedDict()
+        self._embedding = set()  # background tasks adding to _vectors
+        self.hits = 0
+        self.shared_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def _embed(self, text):
+        from google.generativeai import embed_content_async
+
+        try:
+            result = await embed_content_async(model=RESPONSE_CACHE_EMBEDDING_MODEL, content=text)
+            return _unit(result["embedding"])
+        except Exception as e:
+            logger.warning(f"Embedding failed, semantic cache skipped: {e}")
+            return None
+
+    def _get_fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[1]:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    @staticmethod
+    def _key(prompt, variant=None):
+        # The variant (e.g. render mode) keeps differently shaped answers apart
+        key = normalize_prompt(prompt)
+        return f"{variant}|{key}" if variant else key
+
+    async def lookup(self, prompt, variant=None):
+        key = self._key(prompt, variant)
+        payload = self._get_fresh(key)
+        if payload is not None:
+            self.hits += 1
+            return payload
+
+        if self.shared is not None:
+            shared = await self.shared.get("responses", key)
+            if shared is not None:
+                payload, remaining, endpoints, tags = shared
+                self._put(key, payload, remaining, frozenset(endpoints), frozenset(tags))
+                self.shared_hits += 1
+                return payload
+
+        if self.semantic and self._vectors:
+            text = normalize_prompt(prompt)
+            vector = await self._embed(text)
+            if vector is not None:
+                # The scan takes milliseconds over a full tier; keep it off the event loop
+                best_key = await asyncio.to_thread(
+                    _nearest, vector, _NUMBER_RE.findall(text), variant, list(self._vectors.items()),
+                )
+                if best_key is not None:
+                    payload = self._get_fresh(best_key)
+                    if payload is not None:
+                        self.semantic_hits += 1
+                        return payload
+
+        self.misses += 1
+        return None
+
+    async def store(self, prompt, payload, deps=None, variant=None):
+        if deps is not None and deps.failed:
+            # Never cache apologies for a catalog outage
+            return
+        ttl = deps.ttl if deps is not None and deps.ttl is not None else RESPONSE_CACHE_DEFAULT_TTL
+        if ttl <= 0:
+            # Built from stale or uncached catalog data: nothing left to keep it for
+            return
+        key = self._key(prompt, variant)
+        endpoints = frozenset(deps.endpoints) if deps is not None else frozenset()
+        tags = frozenset(deps.tags) if deps is not None else frozenset()
+
+        self._put(key, payload, ttl, endpoints, tags)
+        if self.shared is not None:
+            await self.shared.set("responses", key, payload, ttl, endpoints, tags)
+
+        if self.semantic and key not in self._vectors:
+            # The embedding round trip must not delay the chat that produced the answer
+            task = asyncio.create_task(self._remember(key, normalize_prompt(prompt), variant))
+            self._embedding.add(task)
+            task.add_done_callback(self._embedding.discard)
+
+    async def _remember(self, key, text, variant):
+        vector = await self._embed(text)
+        # The answer may have been invalidated or evicted while the embedding was computed
+        if vector is None or key not in self._entries:
+            return
+        self._vectors[key] = (vector, _NUMBER_RE.findall(text), variant)
+        while len(self._vectors) > RESPONSE_CACHE_SEMANTIC_ENTRIES:
+            self._vectors.popitem(last=False)
+
+    async def close(self):
+        for task in list(self._embedding):
+            task.cancel()
+        await asyncio.gather(*self._embedding, return_exceptions=True)
+
+    def _put(self, key, payload, ttl, endpoints, tags):
+        self._entries[key] = (payload, time.monotonic() + ttl, endpoints, tags)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._vectors.pop(old_key, None)
+            self.evictions += 1
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._vectors.pop(key, None)
+
+    def invalidate(self, endpoint_prefix=None, tag=None):
+        """Drop answers built from endpoints under endpoint_prefix or from data tagged tag, on this worker."""
+        if endpoint_prefix is None and tag is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._vectors.clear()
+            return removed
+        keys = [
+            key for key, (_, _, endpoints, tags) in self._entries.items()
+            if (tag is not None and tag in tags)
+            or (endpoint_prefix is not None and any(under_prefix(e, endpoint_prefix) for e in endpoints))
+        ]
+        for key in keys:
+            self._drop(key)
+        return len(keys)
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.semantic_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "semantic_size": len(self._vectors),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.shared_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,148 @@
+import os
+import re
+from product_index import fold_text
+
+# Model tier per stage: a light model picks the tool, the large model is kept for
+# open-ended questions and for calls the light tier is unsure about
+MODEL_ROUTER = os.environ.get("MODEL_ROUTER", "gemini-2.5-flash-lite")
+MODEL_LARGE = os.environ.get("MODEL_LARGE", "gemini-2.5-pro")
+MODEL_NARRATIVE = os.environ.get("MODEL_NARRATIVE", "gemini-2.5-flash")
+
+# Local rule classifier for obvious intents, tried before any model call
+ROUTER_RULES = os.environ.get("ROUTER_RULES", "1") == "1"
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.8"))
+# Longer messages tend to carry more than one ask
+ROUTER_MAX_WORDS = int(os.environ.get("ROUTER_MAX_WORDS", "20"))
+
+# Advice and comparison questions go straight to the large model
+_OPEN_ENDED_RE = re.compile(
+    r"\b(tu van|nen chon|nen mua|so sanh|tai sao|vi sao|phu hop|goi y|qua tang|dip|phong cach"
+    r"|nhu the nao|the nao|khac nhau|y nghia|bao quan|cach chon)\b"
+)
+# Words that narrow a query beyond what a single rule can express: material, colour, karat
+# ("18k" is read as a karat, not 18 thousand VND) and jewelry type
+_ATTRIBUTE_RE = re.compile(
+    r"\b(vang|bac|kim cuong|bach kim|ngoc trai|nhan|day chuyen|bong tai|lac|vong|kieng|mat day|cuoi"
+    r"|trang(?!\s+(?:suc|san pham|web|chu))|hong|xanh"
+    r"|\d{1,2}\s?k\s+vang|(?:[1-9]|1\d|2[0-4])\s?k)\b"
+)
+
+# "100.000" and "1,500,000" group thousands; a single "," or "." before one or two digits is
+# a decimal ("1,5 triệu")
+_NUMBER = r"(\d{1,3}(?:[.,]\d{3})+|\d+(?:[.,]\d{1,2})?)(?![.,]?\d)\s*(trieu|tr|cu|k|nghin|ngan|dong|vnd|d)?\b"
+_GROUPED_RE = re.compile(r"\d{1,3}(?:[.,]\d{3})+")
+_UNITS = {"trieu": 1_000_000, "tr": 1_000_000, "cu": 1_000_000, "k": 1_000, "nghin": 1_000, "ngan": 1_000}
+_BETWEEN_RE = re.compile(rf"\btu\s+{_NUMBER}\s*(?:den|toi|-)\s*{_NUMBER}")
+_BELOW_RE = re.compile(rf"\b(?:duoi|khong qua|toi da|re hon|it hon|nho hon)\s+{_NUMBER}")
+_ABOVE_RE = re.compile(rf"\b(?:tren|hon|cao hon|it nhat)\s+{_NUMBER}")
+_AROUND_RE = re.compile(rf"\b(?:khoang|tam|tam gia|gia)\s+{_NUMBER}")
+
+_ID = r"(?:so|id|ma)?\s*#?(\d+)\b"
+_RULES = (
+    # (intent, pattern, confidence, args from match)
+    ("redirect_to_product", re.compile(rf"\b(?:mo|chuyen|dua|di)\b.*\btrang san pham\s+{_ID}"), 0.95,
+     lambda m: {"product_id": int(m.group(1))}),
+    ("get_product_details", re.compile(rf"\b(?:chi tiet|thong tin)\b.*\b(?:san pham|sp)\s+{_ID}"), 0.9,
+     lambda m: {"product_id": int(m.group(1))}),
+    ("get_products_by_collection", re.compile(rf"\bbo suu tap\s+{_ID}"), 0.9,
+     lambda m: {"collection_id": int(m.group(1))}),
+    ("get_products_by_category", re.compile(rf"\bdanh muc\s+{_ID}"), 0.9,
+     lambda m: {"category_id": int(m.group(1))}),
+    ("get_new_arrivals", re.compile(r"\b(san pham moi|hang moi|mau moi|moi ve|moi nhat|moi ra mat)\b"), 0.9,
+     lambda m: {}),
+    ("get_bestselling_products", re.compile(r"\b(ban chay|best ?seller|mua nhieu nhat|hot nhat)\b"), 0.9,
+     lambda m: {}),
+    ("get_collections", re.compile(r"\b(cac|nhung|co)?\s*bo suu tap\b(?!\s+(?:so|id|ma)?\s*#?\d)"), 0.85,
+     lambda m: {}),
+    ("get_categories", re.compile(r"\b(danh muc|loai trang suc|loai san pham)\b(?!\s+(?:so|id|ma)?\s*#?\d)"), 0.85,
+     lambda m: {}),
+)
+
+
+class Intent:
+    """Tool calls picked by the rule classifier, with its confidence."""
+
+    def __init__(self, calls, confidence, rule):
+        self.calls = calls  # [(function_name, args)]
+        self.confidence = confidence
+        self.rule = rule
+
+
+def _number(value):
+    if _GROUPED_RE.fullmatch(value):
+        return float(re.sub(r"[.,]", "", value))
+    return float(value.replace(",", "."))
+
+
+def _amount(value, unit):
+    amount = _number(value)
+    if unit in _UNITS:
+        return int(amount * _UNITS[unit])
+    # Bare small numbers are millions ("dưới 5" in a jewelry shop), large ones are VND; in
+    # between ("dưới 500") it is anyone's guess, so None leaves the question to the model
+    if amount >= 10_000:
+        return int(amount)
+    if amount <= 100:
+        return int(amount * 1_000_000)
+    return None
+
+
+def parse_price_range(text):
+    """(min, max) in VND from folded text, e.g. "tu 2 den 5 trieu" -> (2000000, 5000000)."""
+    match = _BETWEEN_RE.search(text)
+    if match:
+        low_value, low_unit, high_value, high_unit = match.groups()
+        # "từ 2 đến 5 triệu": the unit of the upper bound applies to both
+        low = _amount(low_value, low_unit or high_unit)
+        high = _amount(high_value, high_unit or low_unit)
+        if low is None or high is None:
+            return None
+        return (low, high) if low <= high else (high, low)
+    match = _BELOW_RE.search(text)
+    if match:
+        high = _amount(*match.groups())
+        return (0, high) if high is not None else None
+    match = _ABOVE_RE.search(text)
+    # "hơn 2" without a unit is more often a quantity than a price
+    if match and (match.group(2) or _number(match.group(1)) >= 10_000):
+        return _amount(*match.groups()), 10_000_000_000
+    match = _AROUND_RE.search(text)
+    if match and match.group(2):
+        amount = _amount(*match.groups())
+        return int(amount * 0.8), int(amount * 1.2)
+    return None
+
+
+def is_open_ended(prompt):
+    return bool(_OPEN_ENDED_RE.search(fold_text(prompt)))
+
+
+def classify_intent(prompt):
+    """Intent for obvious requests, or None when a model should decide."""
+    if not ROUTER_RULES:
+        return None
+    text = fold_text(prompt)
+    if _OPEN_ENDED_RE.search(text):
+        return None
+
+    matches = []
+    for name, pattern, confidence, build_args in _RULES:
+        match = pattern.search(text)
+        if match:
+            matches.append((name, build_args(match), confidence))
+    price_range = parse_price_range(text)
+    if price_range:
+        matches.append(("find_products_by_price_range", {"min_price": price_range[0], "max_price": price_range[1]}, 0.9))
+
+    # Several intents in one message are for the model to combine
+    if len(matches) != 1:
+        return None
+    name, args, confidence = matches[0]
+    if len(text.split()) > ROUTER_MAX_WORDS:
+        confidence -= 0.2
+    if name not in ("get_product_details", "redirect_to_product") and _ATTRIBUTE_RE.search(text):
+        # "nhẫn vàng dưới 5 triệu": the rule would drop the material/category
+        confidence -= 0.2
+    if confidence < ROUTER_MIN_CONFIDENCE:
+        return None
+    return Intent([(name, args)], confidence, name)
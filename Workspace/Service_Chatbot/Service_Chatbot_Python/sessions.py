@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from product_index import fold_text
+from routing import is_open_ended
+from shared_cache import WEB_CONCURRENCY, SHARED_CACHE_PATH, LocalCacheBackend
+
+logger = logging.getLogger(__name__)
+
+# "memory" (per worker), "local" (SQLite in shared memory, the workers of one host) or "redis"
+# (shared, any Redis-compatible server). Local by default once there are several workers, so a
+# follow-up finds its history whichever worker answers it.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory" if WEB_CONCURRENCY == "1" else "local")
+SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", "3600"))
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", "10000"))
+
+# Token budgets for the context sent with each turn
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", "1200"))
+SESSION_SUMMARY_TOKENS = int(os.environ.get("SESSION_SUMMARY_TOKENS", "250"))
+SESSION_RESULTS_TOKENS = int(os.environ.get("SESSION_RESULTS_TOKENS", "400"))
+# Answers are clipped before they go into history
+SESSION_TURN_CHARS = int(os.environ.get("SESSION_TURN_CHARS", "600"))
+# Results of the last tool step kept for follow-ups
+SESSION_MAX_RESULTS = int(os.environ.get("SESSION_MAX_RESULTS", "10"))
+
+_ORDINALS = {
+    "dau": 0, "dau tien": 0, "nhat": 0, "1": 0,
+    "hai": 1, "2": 1,
+    "ba": 2, "3": 2,
+    "tu": 3, "4": 3,
+    "nam": 4, "5": 4,
+    "cuoi": -1, "cuoi cung": -1,
+}
+# "hai", "tư", "năm" and digits are ordinals only after "thứ"/"số": "sản phẩm nam" is men's
+# jewelry, "sản phẩm từ 2 triệu" a price range. A number followed by a price unit is never one.
+_REFERENCE_RE = re.compile(
+    r"\b(?:cai|san pham|chiec|mon)\s+"
+    r"(?:(?:thu|so)\s+(dau tien|cuoi cung|nhat|hai|ba|tu|nam|\d)|(dau tien|cuoi cung|dau|cuoi))\b"
+    r"(?!\s*(?:trieu|tr|cu|k|nghin|ngan|dong|vnd|d)\b)"
+)
+# Comparisons and searches that start from a result ("cái thứ hai có mẫu nào rẻ hơn không")
+# need more than the card's own fields
+_BEYOND_CARD_RE = re.compile(r"\b(hon|nao|khac|tuong tu|giong)\b")
+# Attribute asked about -> card field
+_ATTRIBUTES = (
+    (re.compile(r"\b(gia|bao nhieu tien)\b"), "price_text", "có giá"),
+    (re.compile(r"\bchat lieu\b"), "material", "có chất liệu"),
+    (re.compile(r"\bmau sac\b"), "color", "có màu"),
+    (re.compile(r"\b(tuoi vang|karat|\d+k)\b"), "gold_karat", "có tuổi vàng"),
+)
+
+
+def estimate_tokens(text):
+    # Rough count (Gemini averages ~3-4 characters per token on Vietnamese text)
+    return (len(text) + 2) // 3 if text else 0
+
+
+def _clip(text, limit):
+    text = text or ""
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+class MemorySessionBackend:
+    """Per-worker session store with LRU eviction and idle expiry."""
+
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # id -> (data, expires_at)
+
+    async def load(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[1]:
+            del self._sessions[session_id]
+            return None
+        return json.loads(entry[0])
+
+    async def save(self, session_id, data):
+        # Stored serialized so callers never share mutable state, as with Redis
+        self._sessions[session_id] = (json.dumps(data, ensure_ascii=False), time.monotonic() + self.ttl)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {"backend": "memory", "sessions": len(self._sessions)}
+
+
+class RedisSessionBackend:
+    """Sessions shared by every worker, in Redis or a compatible server (Valkey, KeyDB...)."""
+
+    def __init__(self, url=SESSION_REDIS_URL, ttl=SESSION_TTL, prefix="chat:session:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def load(self, session_id):
+        raw = await self.client.get(self.prefix + session_id)
+        return json.loads(raw) if raw else None
+
+    async def save(self, session_id, data):
+        await self.client.set(self.prefix + session_id, json.dumps(data, ensure_ascii=False), ex=self.ttl)
+
+    async def delete(self, session_id):
+        await self.client.delete(self.prefix + session_id)
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class LocalSessionBackend:
+    """Sessions shared by the workers of one host, in the shared cache's SQLite file."""
+
+    namespace = "sessions"
+
+    def __init__(self, path=SHARED_CACHE_PATH, ttl=SESSION_TTL):
+        self.store = LocalCacheBackend(path=path)
+        self.ttl = ttl
+
+    async def load(self, session_id):
+        entry = await self.store.get(self.namespace, session_id)
+        return json.loads(entry[0]) if entry else None
+
+    async def save(self, session_id, data):
+        await self.store.set(self.namespace, session_id, json.dumps(data, ensure_ascii=False),
+                             time.time() + self.ttl, [])
+
+    async def delete(self, session_id):
+        await self.store.delete(self.namespace, session_id)
+
+    async def close(self):
+        await self.store.close()
+
+    def stats(self):
+        return {"backend": "local", "path": self.store.path}
+
+
+def create_backend(name=SESSION_BACKEND):
+    if name == "redis":
+        return RedisSessionBackend()
+    if name == "local":
+        return LocalSessionBackend()
+    return MemorySessionBackend()
+
+
+class Session:
+    """One conversation: rolling summary, recent turns and the last tool results."""
+
+    def __init__(self, session_id, data=None):
+        data = data or {}
+        self.id = session_id
+        self.summary = data.get("summary", "")
+        self.turns = data.get("turns", [])  # [{"user": ..., "assistant": ...}]
+        self.results = data.get("results", [])  # cards from the last tool step
+        self.tool = data.get("tool")
+
+    @property
+    def has_history(self):
+        return bool(self.turns or self.summary)
+
+    def to_data(self):
+        return {"summary": self.summary, "turns": self.turns, "results": self.results, "tool": self.tool}
+
+    def history_tokens(self):
+        return sum(estimate_tokens(turn["user"]) + estimate_tokens(turn["assistant"]) for turn in self.turns)
+
+    def contents(self, prompt):
+        """Gemini contents for this turn: recent turns, then the prompt with summary and last results."""
+        contents = []
+        for turn in self.turns:
+            contents.append({"role": "user", "parts": [turn["user"]]})
+            contents.append({"role": "model", "parts": [turn["assistant"]]})
+        context = []
+        if self.summary:
+            context.append(f"Tóm tắt cuộc trò chuyện trước: {self.summary}")
+        if self.results:
+            context.append("Sản phẩm/kết quả vừa hiển thị cho khách (theo thứ tự):\n" + self.results_text())
+            context.append("Nếu câu hỏi nhắc tới các kết quả này, hãy trả lời trực tiếp từ đây thay vì tra cứu lại.")
+        if context:
+            prompt = "\n".join(context) + f"\n\nCâu hỏi của khách: {prompt}"
+        contents.append({"role": "user", "parts": [prompt]})
+        return contents
+
+    def results_text(self):
+        lines = []
+        budget = SESSION_RESULTS_TOKENS
+        for position, card in enumerate(self.results, 1):
+            details = ", ".join(
+                str(card[key]) for key in ("price_text", "material", "color") if card.get(key)
+            )
+            line = f"{position}. {card.get('name')} (ID: {card.get('id')})" + (f": {details}" if details else "")
+            budget -= estimate_tokens(line)
+            if budget < 0:
+                break
+            lines.append(line)
+        return "\n".join(lines)
+
+    def resolve_follow_up(self, prompt):
+        """Answer "cái thứ hai giá bao nhiêu?" from the last results, or None when the model is needed."""
+        if not self.results:
+            return None
+        text = fold_text(prompt)
+        references = list(_REFERENCE_RE.finditer(text))
+        # Several items ("so sánh cái thứ hai với cái đầu") or an open question are for the model
+        if len(references) != 1 or is_open_ended(prompt) or _BEYOND_CARD_RE.search(text):
+            return None
+        match = references[0]
+        position = _ORDINALS.get(match.group(1) or match.group(2))
+        if position is None or position >= len(self.results):
+            return None
+        card = self.results[position]
+        answers = [
+            f"{label} {card[key]}{'K' if key == 'gold_karat' else ''}"
+            for pattern, key, label in _ATTRIBUTES
+            if pattern.search(text) and card.get(key) not in (None, "")
+        ]
+        if not answers:
+            return None
+        return f"{card.get('name')} (ID: {card.get('id')}) " + ", ".join(answers) + "."
+
+
+class SessionStore:
+    """Loads and saves sessions, keeping the history within its token budget.
+
+    When recent turns outgrow SESSION_HISTORY_TOKENS the oldest ones are folded
+    into the rolling summary by summarize(summary, turns) -> str, in the background
+    so the reply does not wait for the extra model call.
+    """
+
+    def __init__(self, backend=None, summarize=None):
+        self.backend = backend or create_backend()
+        self.summarize = summarize
+        self.summaries = 0
+        self._compacting = {}  # session id -> background compaction task
+
+    async def load(self, session_id):
+        try:
+            data = await self.backend.load(session_id)
+        except Exception as e:
+            logger.warning(f"Session load failed for {session_id}: {e}")
+            data = None
+        return Session(session_id, data)
+
+    async def record(self, session, prompt, answer, cards=None, tool=None):
+        session.turns.append({
+            "user": _clip(prompt, SESSION_TURN_CHARS),
+            "assistant": _clip(answer, SESSION_TURN_CHARS),
+        })
+        # Tool-less answers keep the previous results, so follow-ups can keep referring to them
+        if cards:
+            session.results = cards[:SESSION_MAX_RESULTS]
+            session.tool = tool
+        try:
+            await self.backend.save(session.id, session.to_data())
+        except Exception as e:
+            logger.warning(f"Session save failed for {session.id}: {e}")
+        if session.history_tokens() > SESSION_HISTORY_TOKENS and session.id not in self._compacting:
+            task = asyncio.create_task(self._compact(session.id))
+            self._compacting[session.id] = task
+            task.add_done_callback(lambda _: self._compacting.pop(session.id, None))
+
+    async def _compact(self, session_id):
+        session = await self.load(session_id)
+        # Fold turns until half the budget is free, so summarization does not run every turn
+        dropped = []
+        while session.turns and session.history_tokens() > SESSION_HISTORY_TOKENS // 2:
+            dropped.append(session.turns.pop(0))
+        if not dropped:
+            return
+        summary = None
+        if self.summarize is not None:
+            try:
+                summary = await self.summarize(session.summary, dropped)
+            except Exception as e:
+                logger.warning(f"Session summarization failed: {e}")
+        if not summary:
+            # Fallback: keep the customer's earlier questions
+            summary = " ".join(filter(None, [session.summary] + [turn["user"] for turn in dropped]))
+
+        # Turns recorded while summarizing were saved meanwhile: fold only the summarized ones
+        current = await self.load(session_id)
+        if current.summary != session.summary or current.turns[:len(dropped)] != dropped:
+            return  # reset or rewritten in the meantime
+        current.turns = current.turns[len(dropped):]
+        current.summary = _clip(summary.strip(), SESSION_SUMMARY_TOKENS * 3)
+        try:
+            await self.backend.save(session_id, current.to_data())
+        except Exception as e:
+            logger.warning(f"Session save failed for {session_id}: {e}")
+            return
+        self.summaries += 1
+
+    async def reset(self, session_id):
+        await self.backend.delete(session_id)
+
+    async def close(self):
+        for task in list(self._compacting.values()):
+            task.cancel()
+        await asyncio.gather(*self._compacting.values(), return_exceptions=True)
+        await self.backend.close()
+
+    def stats(self):
+        return {**self.backend.stats(), "summaries": self.summaries}
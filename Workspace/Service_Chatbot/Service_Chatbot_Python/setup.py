@@ -2,10 +2,20 @@ from setuptools import setup
 
 setup(
     install_requires=[
-        "flask",
-        "flask-cors",
+        "quart",
+        "quart-cors",
+        "hypercorn",
+        "httpx",
+        "ijson",
         "google",
         "google-generativeai",
-        "requests",
-    ]
-)
\ No newline at end of file
+        "prometheus-client",
+        "msgpack",
+    ],
+    extras_require={
+        # SESSION_BACKEND=redis, SHARED_CACHE_BACKEND=redis
+        "redis": ["redis"],
+        # fakeredis stands in for a Redis server in tests/test_shared_cache.py
+        "test": ["pytest", "redis", "fakeredis"],
+    },
+)
@@ -0,0 +1,449 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+# Worker processes per host, as set for hypercorn (see hypercorn_config.py)
+WEB_CONCURRENCY = os.environ.get("WEB_CONCURRENCY", "1")
+
+# Cache tier shared behind the in-process caches:
+# "local" (SQLite in shared memory, the workers of one host), "redis" (every worker of every
+# replica, any Redis-compatible server) or "none". Local by default once there are several workers.
+SHARED_CACHE_BACKEND = os.environ.get("SHARED_CACHE_BACKEND", "none" if WEB_CONCURRENCY == "1" else "local")
+SHARED_CACHE_PATH = os.environ.get(
+    "SHARED_CACHE_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "chatbot-cache.sqlite"),
+)
+SHARED_CACHE_REDIS_URL = os.environ.get("SHARED_CACHE_REDIS_URL", "redis://localhost:6379/1")
+# Entries kept by the local backend; Redis is bounded by its own maxmemory policy
+SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("SHARED_CACHE_MAX_ENTRIES", "20000"))
+# How often each worker applies invalidations made by other workers to its in-process caches
+SHARED_CACHE_SYNC_SECONDS = float(os.environ.get("SHARED_CACHE_SYNC_SECONDS", "1.0"))
+# A slow shared tier must not hold up chats: past this a lookup counts as a miss and a store
+# or invalidation is given up
+SHARED_CACHE_TIMEOUT = float(os.environ.get("SHARED_CACHE_TIMEOUT", "0.25"))
+# After a failure the tier is skipped for this long, so an outage costs one timeout, not one per chat
+SHARED_CACHE_RETRY_SECONDS = float(os.environ.get("SHARED_CACHE_RETRY_SECONDS", "5"))
+
+# Invalidations older than this are dropped from the log; workers poll far more often
+INVALIDATION_LOG_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS deps (
+    namespace TEXT NOT NULL,
+    dep TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (namespace, dep, key)
+);
+CREATE INDEX IF NOT EXISTS deps_key ON deps (namespace, key);
+CREATE TABLE IF NOT EXISTS invalidations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event BLOB NOT NULL,
+    at REAL NOT NULL
+);
+"""
+
+
+def _deps(endpoints, tags):
+    # One namespace for both kinds, so a single lookup finds what an invalidation hits
+    return [f"e:{endpoint}" for endpoint in endpoints] + [f"t:{tag}" for tag in tags]
+
+
+class LocalCacheBackend:
+    """SQLite database in shared memory (/dev/shm), shared by the workers of one host.
+
+    Every call runs on one dedicated thread holding the connection, so lock waits
+    between workers never block the event loop.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_entries=SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._executor = None
+        self._db = None
+        self._writes = 0
+
+    async def _run(self, fn, *args):
+        # Created on first use, inside the worker process rather than the hypercorn master
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # The file lives in memory and is only a cache: durability is not worth an fsync
+            db.execute("PRAGMA synchronous=OFF")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    async def get(self, namespace, key):
+        return await self._run(self._get, namespace, key)
+
+    def _get(self, namespace, key):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    async def set(self, namespace, key, value, expires_at, deps):
+        await self._run(self._set, namespace, key, value, expires_at, deps)
+
+    def _set(self, namespace, key, value, expires_at, deps):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (namespace, key, value, expires_at))
+            db.execute("DELETE FROM deps WHERE namespace = ? AND key = ?", (namespace, key))
+            db.executemany("INSERT OR IGNORE INTO deps VALUES (?, ?, ?)", [(namespace, dep, key) for dep in deps])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % 256 == 0:
+            self._prune(db)
+
+    def _prune(self, db):
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            # Past the size limit the entries closest to expiry go first
+            db.execute(
+                "DELETE FROM entries WHERE (namespace, key) IN "
+                "(SELECT namespace, key FROM entries ORDER BY expires_at LIMIT "
+                "max(0, (SELECT count(*) FROM entries) - ?))",
+                (self.max_entries,),
+            )
+            db.execute(
+                "DELETE FROM deps WHERE NOT EXISTS "
+                "(SELECT 1 FROM entries WHERE entries.namespace = deps.namespace AND entries.key = deps.key)"
+            )
+            db.execute("DELETE FROM invalidations WHERE at < ?", (now - INVALIDATION_LOG_SECONDS,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    async def delete(self, namespace, key):
+        await self._run(self._delete, namespace, key)
+
+    def _delete(self, namespace, key):
+        db = self._connect()
+        db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        db.execute("DELETE FROM deps WHERE namespace = ? AND key = ?", (namespace, key))
+
+    async def invalidate(self, namespaces, endpoint_prefix, tag, event):
+        return await self._run(self._invalidate, namespaces, endpoint_prefix, tag, event)
+
+    def _invalidate(self, namespaces, endpoint_prefix, tag, event):
+        db = self._connect()
+        removed = 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for namespace in namespaces:
+                if endpoint_prefix is None and tag is None:
+                    removed += db.execute("DELETE FROM entries WHERE namespace = ?", (namespace,)).rowcount
+                    db.execute("DELETE FROM deps WHERE namespace = ?", (namespace,))
+                    continue
+                keys = set()
+                if endpoint_prefix is not None:
+                    dep = f"e:{endpoint_prefix}"
+                    below = [f"e:{endpoint_prefix.rstrip('/')}/", f"{dep}?"]
+                    keys.update(key for key, in db.execute(
+                        "SELECT key FROM deps WHERE namespace = ? AND "
+                        "(dep = ? OR substr(dep, 1, ?) = ? OR substr(dep, 1, ?) = ?)",
+                        (namespace, dep, len(below[0]), below[0], len(below[1]), below[1]),
+                    ))
+                if tag is not None:
+                    keys.update(key for key, in db.execute(
+                        "SELECT key FROM deps WHERE namespace = ? AND dep = ?", (namespace, f"t:{tag}"),
+                    ))
+                for key in keys:
+                    removed += db.execute(
+                        "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key),
+                    ).rowcount
+                    db.execute("DELETE FROM deps WHERE namespace = ? AND key = ?", (namespace, key))
+            db.execute("INSERT INTO invalidations (event, at) VALUES (?, ?)", (event, time.time()))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return removed
+
+    async def log_position(self):
+        return await self._run(
+            lambda: self._connect().execute("SELECT coalesce(max(seq), 0) FROM invalidations").fetchone()[0]
+        )
+
+    async def invalidations_since(self, position):
+        """(new position, [event]) for invalidations logged after position."""
+        rows = await self._run(lambda: self._connect().execute(
+            "SELECT seq, event FROM invalidations WHERE seq > ? ORDER BY seq", (position,),
+        ).fetchall())
+        return (rows[-1][0] if rows else position), [event for _, event in rows]
+
+    async def close(self):
+        if self._executor is not None:
+            if self._db is not None:
+                await self._run(self._db.close)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._db = None
+
+    def stats(self):
+        return {"backend": "local", "path": self.path, "max_entries": self.max_entries}
+
+
+class RedisCacheBackend:
+    """Entries shared by every worker and replica, in Redis or a compatible server (Valkey, KeyDB...).
+
+    An entry's dependencies are Redis sets of keys; invalidations go to a stream that
+    every worker reads.
+    """
+
+    def __init__(self, url=SHARED_CACHE_REDIS_URL, prefix="chat:cache:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url, socket_timeout=SHARED_CACHE_TIMEOUT, socket_connect_timeout=SHARED_CACHE_TIMEOUT)
+        self.prefix = prefix
+        self.log_key = f"{prefix}log"
+
+    def _entry_key(self, namespace, key):
+        return f"{self.prefix}e:{namespace}:{key}"
+
+    def _dep_key(self, namespace, dep):
+        return f"{self.prefix}d:{namespace}:{dep}"
+
+    async def get(self, namespace, key):
+        raw = await self.client.get(self._entry_key(namespace, key))
+        if raw is None:
+            return None
+        # The expiry travels with the value so one round trip gives both
+        expires_at, value = msgpack.unpackb(raw)
+        return (value, expires_at) if expires_at > time.time() else None
+
+    async def set(self, namespace, key, value, expires_at, deps):
+        ttl_ms = max(1, int((expires_at - time.time()) * 1000))
+        entry_key = self._entry_key(namespace, key)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(entry_key, msgpack.packb([expires_at, value]), px=ttl_ms)
+            for dep in deps:
+                dep_key = self._dep_key(namespace, dep)
+                pipe.sadd(dep_key, entry_key)
+                # A dependency set lives as long as its longest-lived member (NX/GT need Redis 7+)
+                pipe.pexpire(dep_key, ttl_ms, nx=True)
+                pipe.pexpire(dep_key, ttl_ms, gt=True)
+            await pipe.execute()
+
+    async def _scan(self, pattern):
+        return [key async for key in self.client.scan_iter(match=pattern, count=500)]
+
+    async def invalidate(self, namespaces, endpoint_prefix, tag, event):
+        removed = 0
+        for namespace in namespaces:
+            if endpoint_prefix is None and tag is None:
+                keys = await self._scan(_glob_escape(f"{self.prefix}e:{namespace}:") + "*")
+                dep_keys = await self._scan(_glob_escape(f"{self.prefix}d:{namespace}:") + "*")
+                if keys:
+                    removed += await self.client.unlink(*keys)
+                if dep_keys:
+                    await self.client.unlink(*dep_keys)
+                continue
+            dep_keys = []
+            if endpoint_prefix is not None:
+                # The prefix itself and what lies below it, as in cache.under_prefix
+                dep_keys.append(self._dep_key(namespace, f"e:{endpoint_prefix}"))
+                for below in (f"{endpoint_prefix.rstrip('/')}/", f"{endpoint_prefix}?"):
+                    dep_keys += await self._scan(_glob_escape(self._dep_key(namespace, f"e:{below}")) + "*")
+            if tag is not None:
+                dep_keys.append(self._dep_key(namespace, f"t:{tag}"))
+            keys = set()
+            for dep_key in dep_keys:
+                keys.update(await self.client.smembers(dep_key))
+            if keys:
+                removed += await self.client.unlink(*keys)
+            if dep_keys:
+                await self.client.unlink(*dep_keys)
+        await self.client.xadd(self.log_key, {"event": event}, maxlen=10000, approximate=True)
+        return removed
+
+    async def log_position(self):
+        last = await self.client.xrevrange(self.log_key, count=1)
+        return last[0][0] if last else "0-0"
+
+    async def invalidations_since(self, position):
+        entries = await self.client.xrange(self.log_key, min=f"({_text(position)}")
+        return (entries[-1][0] if entries else position), [fields[b"event"] for _, fields in entries]
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _glob_escape(text):
+    # Endpoints may contain characters SCAN MATCH treats as wildcards, e.g. "?" in a query
+    return "".join(f"\\{c}" if c in "*?[]\\" else c for c in text)
+
+
+class SharedCache:
+    """Cache tier shared by every worker, behind each worker's in-process caches.
+
+    Entries remember the catalog endpoints and tags they were built from. An invalidation
+    removes the matching shared entries at once and is logged; each worker replays the log
+    every SHARED_CACHE_SYNC_SECONDS to drop the same entries from its in-process caches.
+    Backend errors are treated as misses and pause the tier for SHARED_CACHE_RETRY_SECONDS.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.origin = uuid.uuid4().hex[:12]  # skips replaying this worker's own invalidations
+        self._watchers = {}  # namespace -> [callback(endpoint_prefix, tag)]
+        self._position = None
+        self._task = None
+        self._down_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations_sent = 0
+        self.invalidations_applied = 0
+
+    def watch(self, namespace, callback):
+        """Call callback(endpoint_prefix, tag) for invalidations other workers make in namespace."""
+        self._watchers.setdefault(namespace, []).append(callback)
+
+    async def get(self, namespace, key):
+        """(value, seconds left, endpoints, tags), or None on a miss."""
+        if self.down():
+            return None
+        try:
+            raw = await asyncio.wait_for(self.backend.get(namespace, key), SHARED_CACHE_TIMEOUT)
+        except Exception as e:
+            self._failed("lookup", e)
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value, endpoints, tags = msgpack.unpackb(raw[0])
+        return value, raw[1] - time.time(), endpoints, tags
+
+    async def set(self, namespace, key, value, ttl, endpoints=(), tags=()):
+        if self.down():
+            return
+        try:
+            raw = msgpack.packb([value, sorted(endpoints), sorted(tags)])
+            await asyncio.wait_for(
+                self.backend.set(namespace, key, raw, time.time() + ttl, _deps(endpoints, tags)),
+                SHARED_CACHE_TIMEOUT,
+            )
+        except Exception as e:
+            self._failed("store", e)
+
+    async def invalidate(self, namespace=None, endpoint_prefix=None, tag=None):
+        """Drop shared entries under endpoint_prefix or tagged tag (everything if neither), in one or all namespaces."""
+        namespaces = [namespace] if namespace else list(self._watchers)
+        event = msgpack.packb([self.origin, namespace, endpoint_prefix, tag])
+        try:
+            removed = await asyncio.wait_for(
+                self.backend.invalidate(namespaces, endpoint_prefix, tag, event), SHARED_CACHE_TIMEOUT,
+            )
+        except Exception as e:
+            self._failed("invalidation", e)
+            return 0
+        self.invalidations_sent += 1
+        return removed
+
+    def down(self):
+        return time.monotonic() < self._down_until
+
+    def _failed(self, operation, error):
+        self.errors += 1
+        if not self.down():
+            logger.warning(f"Shared cache {operation} failed, skipping it for {SHARED_CACHE_RETRY_SECONDS:.0f}s: {error!r}")
+        self._down_until = time.monotonic() + SHARED_CACHE_RETRY_SECONDS
+
+    async def start(self):
+        try:
+            self._position = await self.backend.log_position()
+        except Exception as e:
+            self._failed("log read", e)
+        self._task = asyncio.create_task(self._follow())
+
+    async def _follow(self):
+        while True:
+            await asyncio.sleep(SHARED_CACHE_SYNC_SECONDS)
+            try:
+                if self._position is None:
+                    self._position = await self.backend.log_position()
+                    continue
+                self._position, events = await self.backend.invalidations_since(self._position)
+            except Exception as e:
+                self._failed("log read", e)
+                continue
+            for event in events:
+                origin, namespace, endpoint_prefix, tag = msgpack.unpackb(event)
+                if origin == self.origin:
+                    continue
+                self.invalidations_applied += 1
+                for name, callbacks in self._watchers.items():
+                    if namespace is None or namespace == name:
+                        for callback in callbacks:
+                            callback(endpoint_prefix, tag)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.backend.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            **self.backend.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "down": self.down(),
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations_sent": self.invalidations_sent,
+            "invalidations_applied": self.invalidations_applied,
+        }
+
+
+def create_shared_cache(name=SHARED_CACHE_BACKEND):
+    """The shared tier for this worker, or None when every worker keeps to its own caches."""
+    if name == "redis":
+        return SharedCache(RedisCacheBackend())
+    if name == "local":
+        return SharedCache(LocalCacheBackend())
+    return None
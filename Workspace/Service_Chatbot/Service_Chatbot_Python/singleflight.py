@@ -0,0 +1,109 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Runs concurrent calls for the same key once and fans the result out to every caller.
+
+    The shared work runs in its own task, so a caller that goes away (client disconnect)
+    does not cancel it for the others. Nothing is kept once the call finishes; caching
+    the result is up to the caller.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> task
+        self.leaders = 0
+        self.joined = 0
+
+    async def do(self, key, fn):
+        """Await fn() for key, or the identical call already in flight."""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.joined += 1
+        return await asyncio.shield(task)
+
+    def stream(self, key, open_stream):
+        """Async iterator over the chunks of open_stream(), shared by concurrent callers.
+
+        Callers joining late replay the chunks already produced, then follow the live ones.
+        """
+        feed = self._calls.get(key)
+        if feed is None:
+            self.leaders += 1
+            feed = _Feed()
+            task = asyncio.ensure_future(feed.pump(open_stream))
+            self._calls[key] = feed
+            task.add_done_callback(lambda done: self._finish(key, done, feed))
+        else:
+            self.joined += 1
+        return feed.follow()
+
+    def _finish(self, key, done, entry=None):
+        if self._calls.get(key) is (entry or done):
+            del self._calls[key]
+        if not done.cancelled() and done.exception() is not None:
+            # Retrieved here so a call whose callers all left does not warn at shutdown
+            logger.debug(f"{self.name} call {key!r} failed: {done.exception()}")
+
+    def stats(self):
+        calls = self.leaders + self.joined
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "joined": self.joined,
+            "joined_ratio": round(self.joined / calls, 4) if calls else 0.0,
+        }
+
+
+class StreamCancelled(Exception):
+    """The shared stream stopped before its end because its task was cancelled."""
+
+
+class _Feed:
+    """Chunks of one shared stream, buffered for every follower."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def pump(self, open_stream):
+        try:
+            async for chunk in open_stream():
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            # Followers must not take a cut-off stream for a complete one
+            self.error = StreamCancelled("shared stream was cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def follow(self):
+        position = 0
+        while True:
+            changed = self._changed
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
@@ -0,0 +1,246 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import uuid
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+)
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("chat.trace")
+
+# Share of finished requests whose trace is logged; errors and slow requests are always logged
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.05"))
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "5.0"))
+# How often each worker copies its cache hit/miss counts into the metrics
+CACHE_STATS_SYNC_SECONDS = float(os.environ.get("CACHE_STATS_SYNC_SECONDS", "5"))
+
+# Chat latencies range from a cached hit (ms) to a long narrative (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+REQUEST_SECONDS = Histogram(
+    "chat_request_seconds", "End-to-end chat request latency", ["mode", "outcome"], buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Latency of one pipeline stage", ["stage"], buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter("chat_stage_errors_total", "Pipeline stages that raised", ["stage", "error"])
+TOOL_SECONDS = Histogram(
+    "chat_tool_seconds", "Tool handler latency", ["tool", "outcome"], buckets=LATENCY_BUCKETS,
+)
+CATALOG_SECONDS = Histogram(
+    "chat_catalog_request_seconds", "Catalog request latency (cache misses only)", ["endpoint", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+MODEL_TOKENS = Counter("chat_model_tokens_total", "Gemini tokens", ["stage", "kind"])
+ROUTES = Counter("chat_route_total", "Tool selections by tier (rules, router, large)", ["tier"])
+SHED = Counter("chat_shed_total", "Requests answered with a degraded reply", ["reason"])
+# Summed over workers in multiprocess mode; hit ratio = rate(hit) / rate(all results)
+CACHE_LOOKUPS = Counter("chat_cache_lookups_total", "Cache lookups by result (hit, miss)", ["cache", "result"])
+CACHE_ENTRIES = Gauge("chat_cache_entries", "Entries held", ["cache"], multiprocess_mode="livesum")
+
+# Numeric path segments become {id} so endpoint labels stay low-cardinality
+_ID_SEGMENT_RE = re.compile(r"/\d+(?=/|$)")
+
+# Spans of the request being handled
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def endpoint_label(endpoint):
+    """"/products/price/between/0/5000000" -> "/products/price/between/{id}/{id}"."""
+    return _ID_SEGMENT_RE.sub("/{id}", endpoint.split("?", 1)[0])
+
+
+class Trace:
+    """Per-request span list, logged as one structured line when sampled."""
+
+    def __init__(self, mode):
+        self.id = uuid.uuid4().hex[:16]
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.spans = []
+        self.fields = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def start_trace(mode):
+    trace = Trace(mode)
+    current_trace.set(trace)
+    return trace
+
+
+def annotate(**fields):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time a pipeline stage into chat_stage_seconds and the current trace."""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        STAGE_ERRORS.labels(stage, error).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        trace = current_trace.get()
+        if trace is not None:
+            entry = {"stage": stage, "ms": round(elapsed * 1000, 2), **attrs}
+            if error:
+                entry["error"] = error
+            trace.spans.append(entry)
+
+
+def finish_trace(trace, outcome):
+    elapsed = trace.elapsed()
+    REQUEST_SECONDS.labels(trace.mode, outcome).observe(elapsed)
+    if outcome == "error" or elapsed >= SLOW_REQUEST_SECONDS or random.random() < TRACE_SAMPLE_RATE:
+        entry = {
+            "trace_id": trace.id,
+            "mode": trace.mode,
+            "outcome": outcome,
+            "ms": round(elapsed * 1000, 2),
+            **trace.fields,
+            "spans": trace.spans,
+        }
+        trace_logger.info(json.dumps(entry, ensure_ascii=False, default=str), extra={"fields": entry})
+
+
+def observe_tool(tool, seconds, outcome):
+    TOOL_SECONDS.labels(tool, outcome).observe(seconds)
+
+
+def observe_catalog(endpoint, seconds, outcome):
+    CATALOG_SECONDS.labels(endpoint_label(endpoint), outcome).observe(seconds)
+
+
+def observe_route(tier):
+    ROUTES.labels(tier).inc()
+
+
+def observe_shed(reason):
+    SHED.labels(reason).inc()
+
+
+def record_usage(stage, response):
+    """Count prompt/output tokens from a Gemini response's usage metadata."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    MODEL_TOKENS.labels(stage, "prompt").inc(prompt_tokens)
+    MODEL_TOKENS.labels(stage, "output").inc(output_tokens)
+    trace = current_trace.get()
+    if trace is not None:
+        tokens = trace.fields.setdefault("tokens", {})
+        tokens[stage] = tokens.get(stage, 0) + prompt_tokens + output_tokens
+
+
+class CacheStatsPublisher:
+    """Copies the in-process caches' hit/miss counts into CACHE_LOOKUPS and CACHE_ENTRIES.
+
+    sources maps a cache name to a callable returning (hits, misses, entries). Every worker
+    publishes its own counts, so the counters add up across workers and pods.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self._published = {}  # name -> (hits, misses) already counted
+        self._task = None
+
+    def publish(self):
+        for name, read in self.sources.items():
+            hits, misses, size = read()
+            last_hits, last_misses = self._published.get(name, (0, 0))
+            # Counts only grow while the process lives; a reset cache starts over from zero
+            CACHE_LOOKUPS.labels(name, "hit").inc(hits - last_hits if hits >= last_hits else hits)
+            CACHE_LOOKUPS.labels(name, "miss").inc(misses - last_misses if misses >= last_misses else misses)
+            self._published[name] = (hits, misses)
+            CACHE_ENTRIES.labels(name).set(size)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(CACHE_STATS_SYNC_SECONDS)
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"Publishing cache stats failed: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.publish()
+
+
+_cache_stats = None
+
+
+def register_cache_stats(sources):
+    global _cache_stats
+    _cache_stats = CacheStatsPublisher(sources)
+    return _cache_stats
+
+
+def render_metrics():
+    """Prometheus exposition for this process, or for all workers in multiprocess mode."""
+    if _cache_stats is not None:
+        # Other workers publish on their own schedule; this one can be exact
+        _cache_stats.publish()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_worker_exited():
+    """Drop this worker's live gauges (cache entries) from the multiprocess totals."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log line (LOG_FORMAT=json)."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        fields = getattr(record, "fields", None)
+        if fields is not None:
+            # Trace lines: inline the fields instead of a JSON string inside JSON
+            entry.update(fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
@@ -0,0 +1,115 @@
+import os
+
+# Rendering modes for tool results:
+#   "llm"      - second Gemini pass writes the answer (original behaviour)
+#   "template" - answer rendered directly from the templates below, no second model call
+#   "hybrid"   - structured cards returned first, prose from the model streamed after
+RENDER_MODES = ("llm", "template", "hybrid")
+DEFAULT_RENDER_MODE = os.environ.get("RENDER_MODE", "llm")
+
+# Per-tool defaults; override with RENDER_MODE_OVERRIDES="get_products:hybrid,get_categories:llm"
+TOOL_RENDER_MODES = {
+    "get_categories": "template",
+    "get_collections": "template",
+}
+for _item in filter(None, os.environ.get("RENDER_MODE_OVERRIDES", "").split(",")):
+    _tool, _, _mode = _item.partition(":")
+    if _mode.strip() in RENDER_MODES:
+        TOOL_RENDER_MODES[_tool.strip()] = _mode.strip()
+
+
+def resolve_render_mode(tools, requested=None):
+    """Mode for a reply built from tools (list of names); an explicit request wins."""
+    if requested in RENDER_MODES:
+        return requested
+    modes = {TOOL_RENDER_MODES.get(tool, DEFAULT_RENDER_MODE) for tool in tools} or {DEFAULT_RENDER_MODE}
+    # Mixed tools: only skip the model when every tool is happy with a template
+    if modes == {"template"}:
+        return "template"
+    return "hybrid" if "hybrid" in modes else ("llm" if "llm" in modes else modes.pop())
+
+
+def format_price(price):
+    """1250000 -> "1.250.000₫"."""
+    if price is None:
+        return "Liên hệ"
+    try:
+        return f"{int(round(float(price))):,}₫".replace(",", ".")
+    except (TypeError, ValueError):
+        return str(price)
+
+
+def product_card(product):
+    return {
+        "type": "product",
+        "id": product.get("id"),
+        "name": product.get("name") or "Không tên",
+        "price": product.get("price"),
+        "price_text": format_price(product.get("price")),
+        "material": product.get("material"),
+        "color": product.get("color"),
+        "gold_karat": product.get("goldKarat"),
+        "url": f"/catalog/product/{product.get('id')}",
+    }
+
+
+def product_detail_card(product):
+    card = product_card(product)
+    card.update({
+        "type": "product_detail",
+        "description": product.get("description"),
+        "size": product.get("size"),
+    })
+    return card
+
+
+def category_card(category):
+    return {
+        "type": "category",
+        "id": category.get("id"),
+        "name": category.get("name") or "Không có tên",
+        "description": category.get("description"),
+    }
+
+
+def collection_card(collection):
+    return {
+        "type": "collection",
+        "id": collection.get("id"),
+        "name": collection.get("name") or "Không có tên",
+        "description": collection.get("description"),
+    }
+
+
+def _card_line(card):
+    if card["type"] == "product":
+        details = ", ".join(filter(None, [card.get("material"), card.get("color")]))
+        details = f" – {details}" if details else ""
+        return f"• {card['name']} (ID: {card['id']}){details}: {card['price_text']}"
+    if card["type"] == "product_detail":
+        lines = [
+            f"• {card['name']} (ID: {card['id']})",
+            f"  Giá: {card['price_text']}",
+        ]
+        for label, key in (("Chất liệu", "material"), ("Màu sắc", "color"), ("Kích thước", "size")):
+            if card.get(key):
+                lines.append(f"  {label}: {card[key]}")
+        if card.get("description"):
+            lines.append(f"  {card['description']}")
+        return "\n".join(lines)
+    description = f": {card['description']}" if card.get("description") else ""
+    return f"• {card['name']} (ID: {card['id']}){description}"
+
+
+def render_sections(sections):
+    """Render [(heading, cards), ...] into the plain-text answer."""
+    blocks = []
+    for heading, cards in sections:
+        lines = [heading] + [_card_line(card) for card in cards]
+        blocks.append("\n".join(lines))
+    types = {card["type"] for _, cards in sections for card in cards}
+    if "product" in types:
+        blocks.append("Bạn muốn xem chi tiết sản phẩm nào? Hãy cho tôi biết ID nhé!")
+    elif "category" in types or "collection" in types:
+        blocks.append("Bạn muốn khám phá sản phẩm thuộc danh mục hay bộ sưu tập nào?")
+    return "\n\n".join(blocks)
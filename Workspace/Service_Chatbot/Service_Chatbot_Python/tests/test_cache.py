@@ -0,0 +1,65 @@
+import asyncio
+import time
+from cache import TTLCache, make_key, under_prefix
+
+
+def test_under_prefix_stops_at_segment_boundaries():
+    assert under_prefix("/products", "/products")
+    assert under_prefix("/products/1", "/products")
+    assert under_prefix("/products/1", "/products/")
+    assert under_prefix("/products?limit=5", "/products")
+    assert not under_prefix("/products-sale", "/products")
+    assert not under_prefix("/products/10", "/products/1")
+    assert under_prefix("/products/1?fields=id", "/products/1")
+
+
+def test_invalidate_keeps_sibling_endpoints():
+    cache = TTLCache()
+    for key in ("/products/1", "/products/10", make_key("/products/1", {"fields": "id"}), "/products/bestselling"):
+        cache.set(key, [], 60)
+    assert cache.invalidate("/products/1") == 2
+    assert cache.invalidate("/products") == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_get_or_load_reports_how_long_the_value_stays_fresh():
+    async def loader():
+        return ["fresh"]
+
+    async def scenario():
+        cache = TTLCache(stale_ttl=60)
+        value, fresh_for = await cache.get_or_load("/products/1", loader, 30)
+        assert value == ["fresh"] and fresh_for == 30
+        value, fresh_for = await cache.get_or_load("/products/1", loader, 30)
+        assert 0 < fresh_for <= 30
+        # Past its TTL the entry is still served while it refreshes, but with no time left
+        cache.set("/products/2", ["old"], 0.01)
+        time.sleep(0.02)
+        value, fresh_for = await cache.get_or_load("/products/2", loader, 30)
+        assert value == ["old"] and fresh_for == 0
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+
+
+def test_refresh_started_before_an_invalidation_does_not_store():
+    release = None
+
+    async def slow_loader():
+        await release.wait()
+        return ["before the change"]
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        cache = TTLCache(stale_ttl=60)
+        cache.set("/products/1", ["old"], 0.01)
+        time.sleep(0.02)
+        await cache.get_or_load("/products/1", slow_loader, 30)  # stale hit, refresh starts
+        await asyncio.sleep(0)
+        cache.invalidate("/products")
+        release.set()
+        await asyncio.sleep(0.01)
+        return cache.stats()["size"]
+
+    assert asyncio.run(scenario()) == 0
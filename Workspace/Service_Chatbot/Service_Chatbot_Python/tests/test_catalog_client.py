@@ -0,0 +1,85 @@
+import asyncio
+import httpx
+import pytest
+from catalog_client import CatalogClient, CircuitBreaker, CircuitOpenError
+
+
+def make_client(handler):
+    client = CatalogClient("http://catalog.test/api/v1")
+    client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    client.client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_cancelled_probe_reopens_the_circuit():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 2:
+            # The probe: slower than the caller is willing to wait
+            await asyncio.sleep(1)
+        return httpx.Response(200, json=[{"id": 1}])
+
+    async def scenario():
+        client = make_client(handler)
+        client.breaker.record_failure()
+        assert client.breaker.state == CircuitBreaker.OPEN
+
+        await client.request("/products")  # the first probe closes the circuit
+        client.breaker.record_failure()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.request("/products"), 0.05)
+        assert client.breaker.state == CircuitBreaker.OPEN
+
+        # After the reset timeout the next call probes again instead of failing forever
+        assert await client.request("/products") == [{"id": 1}]
+        assert client.breaker.state == CircuitBreaker.CLOSED
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_probe_with_a_bad_body_does_not_leave_the_circuit_half_open():
+    async def handler(request):
+        return httpx.Response(200, content=b"not json")
+
+    async def scenario():
+        client = make_client(handler)
+        client.breaker.record_failure()
+        with pytest.raises(ValueError):
+            await client.request("/products")
+        # The body was bad but the probe answered: success was recorded before decoding
+        assert client.breaker.state == CircuitBreaker.CLOSED
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_open_circuit_rejects_calls():
+    async def handler(request):
+        return httpx.Response(503)
+
+    async def scenario():
+        client = make_client(handler)
+        client.breaker.reset_timeout = 60
+        client.breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            await client.request("/products")
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_attempts_fit_in_the_caller_budget():
+    import catalog_client
+    from tool_registry import TOOL_TIMEOUT
+
+    client = CatalogClient("http://catalog.test/api/v1")
+    attempts = 1 + catalog_client.MAX_RETRIES
+    backoff = sum(catalog_client.BACKOFF_FACTOR * (2 ** (n - 1)) for n in range(1, attempts))
+    for budget in (TOOL_TIMEOUT, 4.0, 3.0):
+        timeout = client.timeout_for("/products", budget, attempts)
+        assert attempts * (timeout.connect + timeout.read) + backoff < budget
+    # Without a budget (index sync) the endpoint's own timeouts apply
+    assert client.timeout_for("/products").read == catalog_client.ENDPOINT_TIMEOUTS["/products"][1]
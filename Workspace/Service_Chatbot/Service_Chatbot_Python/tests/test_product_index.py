@@ -0,0 +1,104 @@
+import asyncio
+import product_index
+from product_index import ProductIndex, ProductIndexSync
+
+
+def make_index():
+    index = ProductIndex()
+    index.build([
+        {"id": 1, "name": "Nhẫn Mây", "material": "Vàng", "color": "Trắng", "goldKarat": 18, "categoryId": 1, "price": 5_000_000},
+        {"id": 2, "name": "Nhẫn Nắng", "material": "Vàng", "color": "Vàng", "goldKarat": 24, "categoryId": 1, "price": 9_000_000},
+        {"id": 3, "name": "Nhẫn kim cương", "description": "Đá kim cương tự nhiên", "material": "Bạch kim",
+         "color": "Bạc", "categoryId": 2, "price": 30_000_000},
+    ])
+    return index
+
+
+def ids(products):
+    return [p["id"] for p in products]
+
+
+def test_material_queries_use_colour_and_karat():
+    index = make_index()
+    assert ids(index.by_material("vàng trắng")) == [1]
+    assert ids(index.by_material("Vàng 18K")) == [1]
+    assert ids(index.by_material("vàng 24k")) == [2]
+    assert ids(index.by_material("vàng trắng 24k")) == []
+    assert ids(index.by_material("vàng", category_id=2)) == []
+
+
+def test_material_falls_back_to_name_and_description():
+    assert ids(make_index().by_material("kim cương")) == [3]
+
+
+def test_search_ranks_by_matching_words():
+    index = make_index()
+    assert ids(index.search("nhẫn kim cương")) == [3, 1, 2]
+    assert ids(index.search("nhẫn", category_id=1, limit=1)) == [1]
+    assert ids(index.search("nhẫn kim cương", match_all=True)) == [3]
+
+
+def test_removed_products_leave_every_index():
+    index = make_index()
+    index.remove(1)
+    assert index.by_material("vàng 18k") == []
+    assert ids(index.search("mây")) == []
+
+
+def test_refresh_picks_up_new_collections_and_categories(monkeypatch):
+    catalog = {
+        "/products/changes": [],
+        "/products/bestselling": [{"id": 1}],
+        "/products/new-arrivals": [{"id": 2}],
+        "/categories": [{"id": 1, "name": "Nhẫn"}],
+        "/collections": [{"id": 1, "name": "Mùa xuân"}],
+    }
+
+    async def fetch(endpoint, params=None):
+        return catalog.get(endpoint)
+
+    async def scenario():
+        index = make_index()
+        changes = []
+        sync = ProductIndexSync(index, fetch, on_change=lambda: changes.append(1), snapshot_path="")
+        assert await sync.refresh()
+        assert index.collections == [{"id": 1, "name": "Mùa xuân"}]
+        assert changes
+
+        catalog["/collections"] = [{"id": 1, "name": "Mùa xuân"}, {"id": 2, "name": "Hạ"}]
+        sync.start()
+        await asyncio.sleep(0.05)
+        assert len(index.collections) == 1  # the lists were refreshed moments ago
+        sync.refresh_soon()
+        await asyncio.sleep(0.05)
+        assert len(index.collections) == 2
+        await sync.stop()
+
+    monkeypatch.setattr(product_index, "INDEX_REFRESH_SECONDS", 60)
+    asyncio.run(scenario())
+
+
+def test_refresh_retries_lists_that_failed_to_load():
+    catalog = {
+        "/products/changes": [],
+        "/products/bestselling": [{"id": 1}],
+        "/products/new-arrivals": [{"id": 2}],
+        "/categories": [{"id": 1, "name": "Nhẫn"}],
+    }
+
+    async def fetch(endpoint, params=None):
+        return catalog.get(endpoint)
+
+    async def scenario():
+        index = make_index()
+        sync = ProductIndexSync(index, fetch, snapshot_path="")
+        assert await sync.refresh()
+        assert sync.warm  # the products alone make the worker ready
+        assert sync.lists_missing and index.collections == []
+
+        catalog["/collections"] = [{"id": 1, "name": "Mùa xuân"}]
+        assert await sync.refresh()  # well before INDEX_LISTS_REFRESH_SECONDS
+        assert index.collections == [{"id": 1, "name": "Mùa xuân"}]
+        assert not sync.lists_missing
+
+    asyncio.run(scenario())
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from response_cache import ResponseCache, TurnDeps
+
+
+class FakeEmbeddings(ResponseCache):
+    """Embeds by word counts over a fixed vocabulary, after an optional delay."""
+
+    vocabulary = ["nhan", "vang", "bac", "day", "chuyen", "duoi", "trieu", "cho", "toi", "xem"]
+    delay = 0.0
+
+    async def _embed(self, text):
+        await asyncio.sleep(self.delay)
+        words = text.split()
+        vector = [words.count(word) for word in self.vocabulary]
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+
+def test_semantic_lookup_matches_similar_prompts():
+    async def scenario():
+        cache = FakeEmbeddings(semantic=True)
+        await cache.store("Cho tôi xem nhẫn vàng", {"text": "a"})
+        await asyncio.sleep(0.01)
+        assert await cache.lookup("xem nhẫn vàng cho tôi đi") == {"text": "a"}
+        assert cache.semantic_hits == 1
+        # Numbers must match exactly
+        await cache.store("nhẫn vàng dưới 5 triệu", {"text": "b"})
+        await asyncio.sleep(0.01)
+        assert await cache.lookup("nhẫn vàng dưới 3 triệu") is None
+        await cache.close()
+
+    asyncio.run(scenario())
+
+
+def test_store_does_not_wait_for_the_embedding():
+    async def scenario():
+        cache = FakeEmbeddings(semantic=True)
+        cache.delay = 0.3
+        started = time.monotonic()
+        await cache.store("nhẫn vàng", {"text": "a"})
+        assert time.monotonic() - started < 0.1
+        assert await cache.lookup("nhẫn vàng") == {"text": "a"}
+        await cache.close()
+
+    asyncio.run(scenario())
+
+
+def test_answer_invalidated_before_its_embedding_is_not_indexed():
+    async def scenario():
+        cache = FakeEmbeddings(semantic=True)
+        cache.delay = 0.05
+        deps = TurnDeps()
+        deps.use(endpoint="/products/1")
+        await cache.store("nhẫn vàng", {"text": "a"}, deps)
+        cache.invalidate(endpoint_prefix="/products")
+        await asyncio.sleep(0.1)
+        assert cache.stats()["semantic_size"] == 0
+        await cache.close()
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_matches_whole_path_segments():
+    async def scenario():
+        cache = ResponseCache()
+        for prompt, endpoint in (("a", "/products/1"), ("b", "/products/10"), ("c", "/products/1?fields=id")):
+            deps = TurnDeps()
+            deps.use(endpoint=endpoint)
+            await cache.store(prompt, {"text": prompt}, deps)
+        assert cache.invalidate(endpoint_prefix="/products/1") == 2
+        assert await cache.lookup("b") == {"text": "b"}
+
+    asyncio.run(scenario())
+
+
+def test_answers_from_stale_catalog_data_are_not_stored():
+    async def scenario():
+        cache = ResponseCache()
+        deps = TurnDeps()
+        deps.use(endpoint="/products/1", ttl=300)
+        deps.use(endpoint="/products/2", ttl=0)
+        await cache.store("nhẫn vàng", {"text": "a"}, deps)
+        assert await cache.lookup("nhẫn vàng") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,41 @@
+import pytest
+from product_index import fold_text
+from routing import classify_intent, parse_price_range
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("dưới 5", (0, 5_000_000)),
+    ("dưới 500k", (0, 500_000)),
+    ("dưới 500000", (0, 500_000)),
+    ("từ 2 đến 5 triệu", (2_000_000, 5_000_000)),
+    ("khoảng 500 nghìn", (400_000, 600_000)),
+    ("sản phẩm dưới 100.000 đồng", (0, 100_000)),
+    ("quà dưới 50.000đ", (0, 50_000)),
+    ("từ 20.000 đến 80.000 đồng", (20_000, 80_000)),
+    ("dưới 1.500.000", (0, 1_500_000)),
+    ("dưới 1,5 triệu", (0, 1_500_000)),
+])
+def test_price_ranges(text, expected):
+    assert parse_price_range(fold_text(text)) == expected
+
+
+@pytest.mark.parametrize("text", ["dưới 500", "từ 200 đến 300", "dưới 2000"])
+def test_unitless_mid_range_numbers_are_left_to_the_model(text):
+    assert parse_price_range(fold_text(text)) is None
+    intent = classify_intent(f"nhẫn {text}")
+    assert intent is None or all(name != "find_products_by_price_range" for name, _ in intent.calls)
+
+
+@pytest.mark.parametrize("prompt", [
+    "sản phẩm 18k dưới 5 triệu",
+    "trang sức 14k vàng dưới 10 triệu",
+    "sản phẩm màu trắng dưới 5 triệu",
+    "mẫu vàng hồng từ 2 đến 5 triệu",
+])
+def test_karat_and_colour_qualifiers_are_left_to_the_model(prompt):
+    assert classify_intent(prompt) is None
+
+
+def test_plain_price_queries_still_route_locally():
+    intent = classify_intent("trang sức dưới 500.000 đồng")
+    assert intent.calls == [("find_products_by_price_range", {"min_price": 0, "max_price": 500_000})]
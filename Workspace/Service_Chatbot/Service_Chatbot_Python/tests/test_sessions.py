@@ -0,0 +1,100 @@
+import pytest
+from sessions import Session
+
+
+def session_with_results(count=5):
+    cards = [
+        {"id": 100 + i, "name": f"Nhẫn {i + 1}", "price_text": f"{i + 1}.000.000 ₫", "material": "Vàng 18K"}
+        for i in range(count)
+    ]
+    return Session("s1", {"results": cards})
+
+
+@pytest.mark.parametrize("prompt, position", [
+    ("cái thứ hai giá bao nhiêu?", 1),
+    ("sản phẩm thứ 3 giá bao nhiêu", 2),
+    ("chiếc số 4 giá bao nhiêu", 3),
+    ("cái thứ năm giá bao nhiêu", 4),
+    ("sản phẩm đầu tiên giá bao nhiêu", 0),
+    ("cái cuối cùng chất liệu gì", 4),
+])
+def test_follow_up_resolves_ordinals(prompt, position):
+    answer = session_with_results().resolve_follow_up(prompt)
+    assert answer is not None
+    assert f"(ID: {100 + position})" in answer
+
+
+@pytest.mark.parametrize("prompt", [
+    # "nam" is men's jewelry, not "the fifth"
+    "sản phẩm nam giá bao nhiêu?",
+    # "từ" opens a price range, not "the fourth"
+    "sản phẩm từ 2 đến 5 triệu giá bao nhiêu",
+    # a bare number is a price or an id
+    "sản phẩm 2 triệu giá bao nhiêu",
+    "sản phẩm số 2 triệu giá bao nhiêu",
+    "cái thứ 2k giá bao nhiêu",
+    "sản phẩm hai giá bao nhiêu",
+    # comparisons and open-ended asks need the model
+    "so sánh giá cái thứ hai với cái đầu",
+    "cái thứ hai có mẫu nào giá rẻ hơn không",
+])
+def test_follow_up_ignores_new_searches(prompt):
+    assert session_with_results().resolve_follow_up(prompt) is None
+
+
+def test_follow_up_out_of_range():
+    assert session_with_results(2).resolve_follow_up("cái thứ ba giá bao nhiêu") is None
+
+
+def test_compaction_runs_after_the_turn_is_recorded():
+    import asyncio
+    import time
+    import sessions
+    from sessions import MemorySessionBackend, SessionStore
+
+    async def slow_summary(summary, turns):
+        await asyncio.sleep(0.3)
+        return f"{len(turns)} lượt trước"
+
+    async def scenario():
+        store = SessionStore(backend=MemorySessionBackend(), summarize=slow_summary)
+        session = await store.load("s1")
+        long_answer = "Trả lời " * 200
+        slowest = 0.0
+        for turn in range(6):
+            started = time.perf_counter()
+            await store.record(session, f"câu hỏi {turn}", long_answer)
+            slowest = max(slowest, time.perf_counter() - started)
+            session = await store.load("s1")
+        await asyncio.gather(*store._compacting.values())
+        compacted = await store.load("s1")
+        await store.close()
+        return slowest, compacted, store.summaries
+
+    slowest, compacted, summaries = asyncio.run(scenario())
+    assert slowest < 0.1
+    assert summaries >= 1
+    assert compacted.summary.endswith("lượt trước")
+    assert compacted.history_tokens() <= sessions.SESSION_HISTORY_TOKENS
+    # The newest turn is never folded away
+    assert compacted.turns[-1]["user"] == "câu hỏi 5"
+
+
+def test_local_backend_shares_sessions_between_workers(tmp_path):
+    import asyncio
+    from sessions import LocalSessionBackend
+
+    async def scenario():
+        path = str(tmp_path / "cache.sqlite")
+        first, second = LocalSessionBackend(path=path), LocalSessionBackend(path=path)
+        await first.save("s1", {"turns": [{"user": "nhẫn vàng"}]})
+        shared = await second.load("s1")
+        await second.delete("s1")
+        deleted = await first.load("s1")
+        await first.close()
+        await second.close()
+        return shared, deleted
+
+    shared, deleted = asyncio.run(scenario())
+    assert shared == {"turns": [{"user": "nhẫn vàng"}]}
+    assert deleted is None
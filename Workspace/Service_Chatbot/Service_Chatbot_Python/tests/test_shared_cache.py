@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+import shared_cache
+from shared_cache import LocalCacheBackend, RedisCacheBackend, SharedCache
+
+
+@pytest.fixture(params=["local", "redis"])
+def make_backend(request, tmp_path):
+    """Returns a factory of backends that all see the same storage, one per simulated worker."""
+    if request.param == "local":
+        path = str(tmp_path / "cache.sqlite")
+        return lambda: LocalCacheBackend(path=path)
+    # Only the Redis runs need the test extra; the SQLite ones run with the base install
+    pytest.importorskip("redis")
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def redis_backend():
+        backend = RedisCacheBackend()
+        backend.client = fakeredis.aioredis.FakeRedis(server=server)
+        return backend
+    return redis_backend
+
+
+def test_get_and_set(make_backend):
+    async def scenario():
+        cache = SharedCache(make_backend())
+        assert await cache.get("catalog", "k") is None
+        await cache.set("catalog", "k", {"price": 100}, 60, endpoints=["/products"], tags=["index"])
+        value, remaining, endpoints, tags = await cache.get("catalog", "k")
+        assert value == {"price": 100}
+        assert 0 < remaining <= 60
+        assert endpoints == ["/products"] and tags == ["index"]
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+        await cache.stop()
+
+    asyncio.run(scenario())
+
+
+def test_expired_entries_are_misses(make_backend):
+    async def scenario():
+        cache = SharedCache(make_backend())
+        await cache.set("catalog", "k", 1, 0.05)
+        await asyncio.sleep(0.1)
+        assert await cache.get("catalog", "k") is None
+        await cache.stop()
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_by_endpoint_and_tag(make_backend):
+    async def scenario():
+        cache = SharedCache(make_backend())
+        cache.watch("catalog", lambda endpoint_prefix, tag: None)
+        cache.watch("responses", lambda endpoint_prefix, tag: None)
+        await cache.set("catalog", "a", 1, 60, endpoints=["/products/1"])
+        await cache.set("catalog", "b", 2, 60, endpoints=["/categories"])
+        await cache.set("responses", "c", 3, 60, tags=["index"])
+        await cache.set("responses", "d", 4, 60, endpoints=["/products/2"])
+
+        assert await cache.invalidate(endpoint_prefix="/products") == 2
+        assert await cache.get("catalog", "a") is None
+        assert await cache.get("responses", "d") is None
+        assert (await cache.get("catalog", "b"))[0] == 2
+
+        assert await cache.invalidate(namespace="responses", tag="index") == 1
+        assert await cache.get("responses", "c") is None
+
+        assert await cache.invalidate() == 1
+        assert await cache.get("catalog", "b") is None
+        await cache.stop()
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_matches_whole_path_segments(make_backend):
+    async def scenario():
+        cache = SharedCache(make_backend())
+        for key, endpoint in (("a", "/products/1"), ("b", "/products/10"), ("c", "/products/1?fields=id")):
+            await cache.set("catalog", key, key, 60, endpoints=[endpoint])
+        assert await cache.invalidate(namespace="catalog", endpoint_prefix="/products/1") == 2
+        assert (await cache.get("catalog", "b"))[0] == "b"
+        await cache.stop()
+
+    asyncio.run(scenario())
+
+
+def test_other_workers_replay_invalidations(make_backend, monkeypatch):
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_SYNC_SECONDS", 0.01)
+
+    async def scenario():
+        first, second = SharedCache(make_backend()), SharedCache(make_backend())
+        seen = {"first": [], "second": []}
+        first.watch("responses", lambda endpoint_prefix, tag: seen["first"].append((endpoint_prefix, tag)))
+        second.watch("responses", lambda endpoint_prefix, tag: seen["second"].append((endpoint_prefix, tag)))
+        second.watch("catalog", lambda endpoint_prefix, tag: seen["second"].append(("catalog", endpoint_prefix)))
+        await first.start()
+        await second.start()
+
+        await first.set("responses", "k", "answer", 60, tags=["index"])
+        assert (await second.get("responses", "k"))[0] == "answer"
+        await first.invalidate(namespace="responses", tag="index")
+        await asyncio.sleep(0.1)
+
+        assert await second.get("responses", "k") is None
+        # Only the other worker replays it, and only for the namespace it was made in
+        assert seen == {"first": [], "second": [(None, "index")]}
+        assert second.stats()["invalidations_applied"] == 1
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_slow_writes_do_not_hold_up_the_caller(monkeypatch):
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_TIMEOUT", 0.05)
+
+    class LockedBackend(LocalCacheBackend):
+        async def set(self, *args):
+            await asyncio.sleep(10)
+
+        async def invalidate(self, *args):
+            await asyncio.sleep(10)
+
+    async def scenario():
+        cache = SharedCache(LockedBackend())
+        started = asyncio.get_running_loop().time()
+        await cache.set("responses", "k", "answer", 60)
+        assert cache.down()
+        cache._down_until = 0.0
+        assert await cache.invalidate(namespace="responses", tag="index") == 0
+        return asyncio.get_running_loop().time() - started, cache.stats()["errors"]
+
+    elapsed, errors = asyncio.run(scenario())
+    assert elapsed < 1
+    assert errors == 2
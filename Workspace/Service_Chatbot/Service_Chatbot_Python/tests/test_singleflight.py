@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from singleflight import SingleFlight, StreamCancelled
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_followers_see_a_failed_stream_as_an_error():
+    async def open_stream():
+        yield "a"
+        raise ValueError("model went away")
+
+    async def scenario():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(
+            collect(flight.stream("k", open_stream)),
+            collect(flight.stream("k", open_stream)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.stats()["joined"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_followers_see_a_cancelled_stream_as_an_error():
+    started = None
+
+    async def open_stream():
+        yield "a"
+        started.set()
+        await asyncio.sleep(60)
+        yield "b"
+
+    async def scenario():
+        nonlocal started
+        started = asyncio.Event()
+        flight = SingleFlight("test")
+        follower = asyncio.ensure_future(collect(flight.stream("k", open_stream)))
+        await started.wait()
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task() and task is not follower:
+                task.cancel()
+        with pytest.raises(StreamCancelled):
+            await follower
+
+    asyncio.run(scenario())
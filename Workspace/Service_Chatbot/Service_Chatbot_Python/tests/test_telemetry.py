@@ -0,0 +1,27 @@
+import os
+from prometheus_client import REGISTRY
+from telemetry import CacheStatsPublisher, mark_worker_exited
+
+
+def lookups(cache, result):
+    return REGISTRY.get_sample_value("chat_cache_lookups_total", {"cache": cache, "result": result}) or 0.0
+
+
+def test_publisher_counts_only_new_lookups():
+    counts = {"hits": 3, "misses": 1}
+    publisher = CacheStatsPublisher({"test": lambda: (counts["hits"], counts["misses"], 7)})
+    publisher.publish()
+    publisher.publish()
+    assert lookups("test", "hit") == 3 and lookups("test", "miss") == 1
+    counts["hits"] = 5
+    publisher.publish()
+    assert lookups("test", "hit") == 5
+    assert REGISTRY.get_sample_value("chat_cache_entries", {"cache": "test"}) == 7
+
+
+def test_exited_worker_leaves_the_live_gauges(tmp_path, monkeypatch):
+    live = tmp_path / f"gauge_livesum_{os.getpid()}.db"
+    live.write_bytes(b"")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    mark_worker_exited()
+    assert not live.exists()
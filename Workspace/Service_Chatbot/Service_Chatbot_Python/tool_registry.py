@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from telemetry import span, observe_tool
+
+logger = logging.getLogger(__name__)
+
+# Default budget for one tool call, catalog retries included
+TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", "8.0"))
+
+# Tool whose handler runs in the current task; catalog reads look up its cache policy here
+current_tool = contextvars.ContextVar("current_tool", default=None)
+
+
+class Tool:
+    """A Gemini function: declaration, async handler, cache policy, timeout and result formatter.
+
+    handler(args) fetches the data and formatter(name, data, args) turns it into the reply.
+    cache_ttl applies to the catalog reads the handler makes: None keeps the per-endpoint
+    TTLs, 0 bypasses the catalog cache, any other value overrides the TTL.
+    """
+
+    def __init__(self, name, description, handler, formatter, parameters=None, required=None,
+                 timeout=TOOL_TIMEOUT, cache_ttl=None):
+        self.name = name
+        self.description = description
+        self.handler = handler
+        self.formatter = formatter
+        self.parameters = parameters or {}
+        self.required = list(required or [])
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def declaration(self):
+        return {
+            "name": self.name,
+            "description": self.description,
+            "parameters": {
+                "type": "object",
+                "properties": self.parameters,
+                "required": self.required,
+            },
+        }
+
+    def accepts(self, args):
+        """Whether args carry every required parameter with a usable value."""
+        for name in self.required:
+            value = args.get(name) if args else None
+            if value is None or value == "":
+                return False
+            if self.parameters.get(name, {}).get("type") in ("integer", "number"):
+                try:
+                    float(value)
+                except (TypeError, ValueError):
+                    return False
+        return True
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_seconds / self.calls * 1000, 2) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2),
+            "timeout_s": self.timeout,
+            "cache_ttl": self.cache_ttl,
+        }
+
+
+class ToolRegistry:
+    """Name -> Tool table; Gemini declarations are generated from it."""
+
+    def __init__(self, tools=()):
+        self._tools = {}
+        for tool in tools:
+            self.register(tool)
+
+    def register(self, tool):
+        if tool.name in self._tools:
+            raise ValueError(f"Tool {tool.name} is already registered")
+        self._tools[tool.name] = tool
+        return tool
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def declarations(self):
+        return [tool.declaration() for tool in self._tools.values()]
+
+    async def dispatch(self, name, args):
+        """Run a tool and format its result; None if no such tool is registered.
+
+        Handler errors and timeouts are counted and re-raised to the caller.
+        """
+        tool = self._tools.get(name)
+        if tool is None:
+            return None
+
+        token = current_tool.set(tool)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("tool", tool=name):
+                data = await asyncio.wait_for(tool.handler(args), tool.timeout)
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            tool.timeouts += 1
+            tool.errors += 1
+            raise TimeoutError(f"Tool {name} timed out after {tool.timeout}s") from None
+        except Exception:
+            tool.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            tool.calls += 1
+            tool.total_seconds += elapsed
+            tool.max_seconds = max(tool.max_seconds, elapsed)
+            observe_tool(name, elapsed, outcome)
+            current_tool.reset(token)
+        with span("prompt", tool=name):
+            return tool.formatter(name, data, args)
+
+    def stats(self):
+        return {name: tool.stats() for name, tool in self._tools.items()}